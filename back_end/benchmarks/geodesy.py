@@ -0,0 +1,86 @@
+"""
+Round-trip precision and throughput of the array geodesy conversions.
+
+Random points over the whole globe, from 500 m below to 50 km above the
+ellipsoid, go geodetic -> ECEF -> geodetic and geodetic -> ENU -> geodetic.
+The worst position error of the round trip is reported, in meters, for both
+the array inverse and the single-pass Bowring inverse previously used, along
+with the time per million points. The run fails if a round trip of the array
+conversions is off by more than ROUND_TRIP_TOLERANCE.
+
+Usage (from back_end/):
+    uv run -m benchmarks.geodesy [NUM_POINTS]
+"""
+import sys
+import time
+
+import numpy as np
+
+from modules.path_generation.geodesy import LocalFrame, ecef_to_geodetic, geodetic_to_ecef
+
+# Largest round-trip position or height error accepted (m); float64 ECEF resolves a few nanometers
+ROUND_TRIP_TOLERANCE = 1e-6
+
+
+def bowring_to_geodetic(ecef):
+    """The one-step inverse transform_ecef_to_gps used before, for comparison."""
+    a = 6378137.0
+    e_sq = 6.69437999014e-3
+    x, y, z = ecef[..., 0], ecef[..., 1], ecef[..., 2]
+
+    b = np.sqrt(a**2 * (1 - e_sq))
+    ep = np.sqrt((a**2 - b**2) / b**2)
+    p = np.sqrt(x**2 + y**2)
+    th = np.arctan2(a * z, b * p)
+    lon = np.arctan2(y, x)
+    lat = np.arctan2(z + ep**2 * b * np.sin(th)**3, p - e_sq * a * np.cos(th)**3)
+    N = a / np.sqrt(1 - e_sq * np.sin(lat)**2)
+    alt = p / np.cos(lat) - N
+    return np.degrees(lat), np.degrees(lon), alt
+
+
+def position_error(ecef, lat, lon, alt):
+    return np.linalg.norm(geodetic_to_ecef(lat, lon, alt) - ecef, axis=-1)
+
+
+def main(num_points):
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(-89.9, 89.9, num_points)
+    lon = rng.uniform(-180, 180, num_points)
+    alt = rng.uniform(-500, 50000, num_points)
+
+    start = time.perf_counter()
+    ecef = geodetic_to_ecef(lat, lon, alt)
+    forward_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = ecef_to_geodetic(ecef)
+    inverse_seconds = time.perf_counter() - start
+
+    scale = 1e6 / num_points
+    print(f"{num_points} points")
+    print(f"geodetic -> ECEF       {forward_seconds * scale * 1000:8.1f} ms per million")
+    print(f"ECEF -> geodetic       {inverse_seconds * scale * 1000:8.1f} ms per million")
+    round_trip = position_error(ecef, *result).max()
+    height = np.abs(result[2] - alt).max()
+    print(f"max round-trip error   {round_trip:.2e} m (Bowring only: "
+          f"{position_error(ecef, *bowring_to_geodetic(ecef)).max():.2e} m)")
+    print(f"max height error       {height:.2e} m")
+
+    # Flight-sized ENU round trip around a random reference
+    frame = LocalFrame(lat[0], lon[0], 0.0)
+    local_lat = lat[0] + rng.uniform(-0.05, 0.05, num_points)
+    local_lon = lon[0] + rng.uniform(-0.05, 0.05, num_points)
+    local_alt = rng.uniform(0, 500, num_points)
+    enu = frame.from_geodetic(local_lat, local_lon, local_alt)
+    back = frame.to_geodetic(enu)
+    enu_round_trip = position_error(geodetic_to_ecef(local_lat, local_lon, local_alt), *back).max()
+    print(f"max ENU round-trip     {enu_round_trip:.2e} m")
+
+    assert round_trip < ROUND_TRIP_TOLERANCE, f"ECEF round trip off by {round_trip:.2e} m"
+    assert height < ROUND_TRIP_TOLERANCE, f"Height round trip off by {height:.2e} m"
+    assert enu_round_trip < ROUND_TRIP_TOLERANCE, f"ENU round trip off by {enu_round_trip:.2e} m"
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
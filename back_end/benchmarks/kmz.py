@@ -0,0 +1,45 @@
+"""
+Time rendering mission files from the precompiled Placemark template against
+filling in and serializing the template tree.
+
+Both renders of template.kml and waylines.wpml are compared byte for byte.
+
+Usage (from back_end/):
+    uv run -m benchmarks.kmz [NUM_WAYPOINTS]
+"""
+import sys
+import time
+
+import numpy as np
+
+from modules.path_generation.dji_exporter.kmz_gen import kml_template, waylines_template, build_kmz
+
+
+def random_waypoints(num_waypoints, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = 52.0 + rng.uniform(0, 1e-3, num_waypoints)
+    lng = 4.3 + rng.uniform(0, 1e-3, num_waypoints)
+    alt = rng.uniform(20, 60, num_waypoints)
+    return [{'lat': float(a), 'lng': float(b), 'alt': float(c)} for a, b, c in zip(lat, lng, alt)]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main(num_waypoints):
+    waypoints = random_waypoints(num_waypoints)
+    now = int(time.time() * 1000)
+    for name, template in (("template.kml", kml_template), ("waylines.wpml", waylines_template)):
+        tree, tree_seconds = timed(template.render_tree, waypoints, "Benchmark", now)
+        compiled, compiled_seconds = timed(template.render, waypoints, "Benchmark", now)
+        print(f"{name:<14}tree {tree_seconds * 1000:>9.1f} ms   compiled {compiled_seconds * 1000:>8.1f} ms"
+              f"  ({tree_seconds / compiled_seconds:.0f}x, identical: {tree == compiled})")
+    _, kmz_seconds = timed(build_kmz, waypoints)
+    print(f"{'KMZ':<14}{kmz_seconds * 1000:>14.1f} ms for {num_waypoints} waypoints")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
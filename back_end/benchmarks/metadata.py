@@ -0,0 +1,123 @@
+"""
+Time the image metadata index against reading EXIF GPS image by image.
+
+A folder of synthetic geotagged drone JPEGs is written to a temporary directory
+(or an existing folder is used). Reported: the per-image piexif.load loop
+previously run by generate_kmz and pair scheduling, building the index from
+scratch (as at upload time), and reopening the persisted index (as every later
+stage does). The GPS positions of both paths are compared.
+
+Usage (from back_end/):
+    uv run -m benchmarks.metadata [NUM_IMAGES | IMAGE_DIR]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import piexif
+from PIL import Image
+
+from modules.path_generation.metadata import ImageIndex, METADATA_FILE, IMAGE_EXTENSIONS, gps_from_exif
+
+# Synthetic images are small noise frames padded to a drone-sized file
+IMAGE_SIZE = (640, 480)
+FILE_BYTES = 8 * 1024 * 1024
+# Drone EXIF carries a maker note and an embedded thumbnail next to the GPS
+MAKER_NOTE_BYTES = 32 * 1024
+THUMBNAIL_SIZE = (160, 120)
+
+
+def to_rational(value, precision=10000):
+    return (int(round(value * precision)), precision)
+
+
+def gps_exif(lat, lon, alt, thumbnail=None):
+    def dms(value):
+        value = abs(value)
+        deg = int(value)
+        minutes = int((value - deg) * 60)
+        seconds = (value - deg - minutes / 60) * 3600
+        return ((deg, 1), (minutes, 1), to_rational(seconds))
+
+    return piexif.dump({
+        "0th": {piexif.ImageIFD.Make: b"DJI", piexif.ImageIFD.Model: b"FC3582"},
+        "Exif": {
+            piexif.ExifIFD.DateTimeOriginal: b"2024:05:01 10:00:00",
+            piexif.ExifIFD.MakerNote: bytes(MAKER_NOTE_BYTES),
+        },
+        "GPS": {
+            piexif.GPSIFD.GPSLatitudeRef: b"N" if lat >= 0 else b"S",
+            piexif.GPSIFD.GPSLatitude: dms(lat),
+            piexif.GPSIFD.GPSLongitudeRef: b"E" if lon >= 0 else b"W",
+            piexif.GPSIFD.GPSLongitude: dms(lon),
+            piexif.GPSIFD.GPSAltitude: to_rational(alt, 1000),
+        },
+        "1st": {piexif.ImageIFD.Compression: 6} if thumbnail else {},
+        "thumbnail": thumbnail,
+    })
+
+
+def write_images(image_dir, num_images, seed=0):
+    rng = np.random.default_rng(seed)
+    thumbnail = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0], 3), dtype=np.uint8)).save(thumbnail, "JPEG")
+    for i in range(num_images):
+        pixels = rng.integers(0, 256, (IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.uint8)
+        path = image_dir / f"DJI_{i:04d}.JPG"
+        Image.fromarray(pixels).save(path, exif=gps_exif(52.0 + i * 1e-5, 4.3 + i * 1e-5, 30.0 + i % 7, thumbnail.getvalue()))
+        # Pad after the end-of-image marker up to a realistic file size
+        with open(path, "ab") as f:
+            f.write(b"\0" * max(FILE_BYTES - path.stat().st_size, 0))
+
+
+def loop_gps(image_dir):
+    """The per-image read previously done: piexif.load on every file path."""
+    gps = {}
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        try:
+            gps[name] = gps_from_exif(piexif.load(str(image_dir / name)))
+        except Exception:
+            continue
+    return gps
+
+
+def run(image_dir):
+    (image_dir / METADATA_FILE).unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    reference = loop_gps(image_dir)
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = ImageIndex.open(image_dir)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = ImageIndex.open(image_dir)
+    reopen_seconds = time.perf_counter() - start
+
+    difference = max((np.abs(np.subtract(index.gps(name), gps)).max() for name, gps in reference.items()), default=0.0)
+    print(f"{len(index.entries)} images, {len(reference)} with GPS")
+    print(f"{'piexif loop':<14}{loop_seconds * 1000:>10.1f} ms")
+    print(f"{'index build':<14}{build_seconds * 1000:>10.1f} ms  ({loop_seconds / build_seconds:.1f}x)")
+    print(f"{'index reopen':<14}{reopen_seconds * 1000:>10.1f} ms  ({loop_seconds / reopen_seconds:.0f}x)")
+    print(f"max GPS difference: {difference:.2e}")
+
+
+def main(arg):
+    if arg is not None and os.path.isdir(arg):
+        run(Path(arg))
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        write_images(Path(tmp), int(arg or 200))
+        run(Path(tmp))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,66 @@
+"""
+Optimize the visiting order of a synthetic warehouse scan.
+
+Waypoints sit in front of the labels of several shelf faces, stacked in rows
+of different heights, and arrive in arbitrary (shuffled) order as they did from
+triangulation. Reported: route length and flight time under the speed model for
+the arbitrary order, the nearest-neighbour path alone and the optimized path,
+with the optimization time.
+
+Usage (from back_end/):
+    uv run -m benchmarks.route [NUM_WAYPOINTS] [TIME_BUDGET]
+"""
+import sys
+import time
+
+import numpy as np
+
+from modules.path_generation.route import (
+    optimize_route, route_cost, neighbour_lists, nearest_neighbour_route, FLIGHT_SPEED, VERTICAL_SPEED,
+    ROUTE_NEIGHBOURS, ROUTE_TIME_BUDGET,
+)
+
+NUM_FACES = 6
+FACE_SPACING = 2.5  # Meters between neighbouring shelf faces
+SHELF_LENGTH = 60.0
+SHELF_LEVELS = (0.3, 1.8, 3.3, 4.8, 6.3)  # Label heights (meters)
+
+
+def synthetic_waypoints(num_waypoints, seed=0):
+    rng = np.random.default_rng(seed)
+    face = rng.integers(0, NUM_FACES, num_waypoints)
+    return np.column_stack([
+        face * FACE_SPACING + rng.normal(0, 0.05, num_waypoints),
+        rng.uniform(0, SHELF_LENGTH, num_waypoints),
+        np.array(SHELF_LEVELS)[rng.integers(0, len(SHELF_LEVELS), num_waypoints)] + rng.normal(0, 0.05, num_waypoints),
+    ])
+
+
+def describe(name, points, order, seconds=None):
+    distance = route_cost(points, order, "distance")
+    flight = route_cost(points, order, "time")
+    timing = f"   ({seconds * 1000:.0f} ms)" if seconds is not None else ""
+    print(f"{name:<18}{distance:>10.0f} m {flight / 60:>8.1f} min{timing}")
+
+
+def main(num_waypoints, time_budget):
+    points = synthetic_waypoints(num_waypoints)
+    print(f"{num_waypoints} waypoints on {NUM_FACES} shelf faces, time budget {time_budget:.1f} s")
+    describe("arbitrary order", points, np.arange(num_waypoints))
+
+    start = time.perf_counter()
+    neighbours = neighbour_lists(points, ROUTE_NEIGHBOURS, "time", FLIGHT_SPEED, VERTICAL_SPEED)
+    order = nearest_neighbour_route(points, neighbours, 0, "time", FLIGHT_SPEED, VERTICAL_SPEED)
+    describe("nearest neighbour", points, order, time.perf_counter() - start)
+
+    for objective in ("distance", "time"):
+        start = time.perf_counter()
+        order = optimize_route(points, objective, time_budget=time_budget)
+        seconds = time.perf_counter() - start
+        assert sorted(order.tolist()) == list(range(num_waypoints))
+        describe(f"optimized ({objective})", points, order, seconds)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         float(sys.argv[2]) if len(sys.argv) > 2 else ROUTE_TIME_BUDGET)
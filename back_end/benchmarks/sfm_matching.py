@@ -0,0 +1,77 @@
+"""
+Compare SIFT pair matching strategies for the sparse reconstruction.
+
+Features are extracted once; every mode then matches a copy of that database and
+runs incremental mapping from it. Reported per mode: verified image pairs, matching
+time, mapping time and the share of images registered in the largest model.
+
+Usage (from back_end/):
+    uv run -m benchmarks.sfm_matching [IMAGE_DIR]
+"""
+import contextlib
+import io
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pycolmap
+
+from modules.path_generation.sfm_matching import SFM_MATCHING_MODES, VOCAB_TREE_PATH, match_features
+
+WORKING_DIR = Path(__file__).resolve().parents[1]
+IMAGE_DIR = WORKING_DIR / "data" / "test" / "images"
+
+
+def num_matched_pairs(database_path):
+    database = pycolmap.Database(database_path)
+    try:
+        return database.num_verified_image_pairs
+    finally:
+        database.close()
+
+
+def run_mode(mode, base_database, image_dir, work_dir):
+    database_path = work_dir / f"{mode}.db"
+    shutil.copyfile(base_database, database_path)
+
+    start = time.perf_counter()
+    match_features(database_path, image_dir, mode)
+    match_seconds = time.perf_counter() - start
+
+    sfm_path = work_dir / mode
+    sfm_path.mkdir()
+    start = time.perf_counter()
+    # Silence COLMAP's per-image output while timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        reconstructions = pycolmap.incremental_mapping(database_path, image_dir, sfm_path)
+    map_seconds = time.perf_counter() - start
+
+    registered = max((rec.num_reg_images() for rec in reconstructions.values()), default=0)
+    return num_matched_pairs(database_path), match_seconds, map_seconds, registered
+
+
+def main(image_dir):
+    image_dir = Path(image_dir)
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        base_database = work_dir / "features.db"
+
+        print(f"Extracting features from {image_dir}...")
+        pycolmap.set_random_seed(0)
+        pycolmap.extract_features(base_database, image_dir)
+        num_images = pycolmap.Database(base_database).num_images
+
+        print(f"{'mode':<12}{'pairs':>8}{'match s':>10}{'map s':>10}{'registered':>12}")
+        for mode in SFM_MATCHING_MODES:
+            if mode == "vocabtree" and not VOCAB_TREE_PATH:
+                print(f"{mode:<12}{'skipped (set VOCAB_TREE_PATH)':>40}")
+                continue
+            pairs, match_seconds, map_seconds, registered = run_mode(mode, base_database, image_dir, work_dir)
+            print(f"{mode:<12}{pairs:>8}{match_seconds:>10.2f}{map_seconds:>10.2f}"
+                  f"{f'{registered}/{num_images}':>12}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else IMAGE_DIR)
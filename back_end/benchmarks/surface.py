@@ -0,0 +1,123 @@
+"""
+Fit label surfaces in a synthetic multi-aisle warehouse, against the single
+plane and per-point loop previously in generate_kmz.
+
+Shelf faces line both sides of each aisle; the sparse cloud holds the faces and
+the floor, with noise and clutter. Labels sit on the faces and are seen from
+cameras flying down the aisles. Reported: timings, the distance of the offset
+waypoints from the intended stand-off position in front of their face, and how
+many waypoints end up on the wrong side of it (inside the shelf).
+
+Usage (from back_end/):
+    uv run -m benchmarks.surface [NUM_LABELS]
+"""
+import sys
+import time
+
+import numpy as np
+
+from modules.path_generation.surface import fit_surfaces
+
+NUM_AISLES = 3
+AISLE_WIDTH = 3.0  # Between the two faces of an aisle (meters)
+SHELF_DEPTH = 1.2  # Back to back shelves between aisles
+SHELF_LENGTH = 40.0
+SHELF_HEIGHT = 8.0
+CLOUD_POINTS = 200000
+LABEL_NOISE = 0.02  # Triangulation noise (meters)
+STANDOFF = 0.5
+
+
+def synthetic_warehouse(num_labels, seed=0):
+    rng = np.random.default_rng(seed)
+    # Face planes x = const, facing into their aisle (+x or -x)
+    faces, facing, aisle_centers = [], [], []
+    x = 0.0
+    for _ in range(NUM_AISLES):
+        faces += [x, x + AISLE_WIDTH]
+        facing += [1.0, -1.0]
+        aisle_centers.append(x + AISLE_WIDTH / 2)
+        x += AISLE_WIDTH + SHELF_DEPTH
+    faces, facing = np.array(faces), np.array(facing)
+
+    def on_faces(n, noise):
+        face = rng.integers(0, len(faces), n)
+        points = np.column_stack([
+            faces[face] + rng.normal(0, noise, n), rng.uniform(0, SHELF_LENGTH, n), rng.uniform(0, SHELF_HEIGHT, n),
+        ])
+        return face, points
+
+    # Cloud: shelf faces, floor, and unstructured clutter
+    _, face_cloud = on_faces(int(CLOUD_POINTS * 0.7), 0.01)
+    floor = np.column_stack([
+        rng.uniform(-1, x, CLOUD_POINTS // 5), rng.uniform(0, SHELF_LENGTH, CLOUD_POINTS // 5),
+        rng.normal(0, 0.01, CLOUD_POINTS // 5),
+    ])
+    clutter = rng.uniform([-1, 0, 0], [x, SHELF_LENGTH, SHELF_HEIGHT], (CLOUD_POINTS // 10, 3))
+    cloud = np.vstack([face_cloud, floor, clutter])
+
+    face, labels = on_faces(num_labels, LABEL_NOISE)
+    # Cameras in the aisle the label faces, at label height
+    aisle = np.where(facing[face] > 0, face // 2, face // 2)
+    viewpoints = np.column_stack([np.array(aisle_centers)[aisle], labels[:, 1], labels[:, 2]])
+    expected = np.column_stack([faces[face] + STANDOFF * facing[face], labels[:, 1], labels[:, 2]])
+    return labels, cloud, viewpoints, expected
+
+
+def single_plane_loop(points):
+    """
+    The plane fit, projection and shift previously in generate_kmz. The SVD there
+    also computed the full n x n U (3.2 GB at 20000 labels); it is skipped here so
+    the baseline runs at all.
+    """
+    best_points = points.reshape(-1, 3, 1)
+    A = np.hstack([best_points.reshape(-1, 3), np.ones((len(best_points), 1))])
+    _, _, V = np.linalg.svd(A, full_matrices=False)
+    plane = V[-1, :]
+    plane /= np.linalg.norm(plane[:3])
+
+    best_points_proj = []
+    normal = plane[:3]
+    d = plane[3]
+    for pt in best_points.reshape(-1, 3):
+        dist = (np.dot(normal, pt) + d) / np.linalg.norm(normal)
+        pt_proj = pt - dist * (normal / np.linalg.norm(normal))
+        best_points_proj.append(pt_proj)
+    best_points_proj = np.array(best_points_proj).reshape(-1, 3, 1)
+
+    plane_normal = plane[:3]
+    plane_normal /= np.linalg.norm(plane_normal)
+    return (best_points_proj + STANDOFF * (plane_normal.reshape(3, 1))).reshape(-1, 3)
+
+
+def summarize(name, seconds, waypoints, expected, labels):
+    error = np.linalg.norm(waypoints - expected, axis=1)
+    # Inside the shelf: the waypoint is not on the label's aisle side of its face
+    inside = np.sign(waypoints[:, 0] - expected[:, 0] + STANDOFF * np.sign(expected[:, 0] - labels[:, 0])) != \
+        np.sign(expected[:, 0] - labels[:, 0])
+    print(f"{name:<16}{seconds * 1000:>10.1f} ms   median error {np.median(error):.3f} m, "
+          f"max {error.max():.2f} m, {inside.mean():.1%} inside the shelf")
+
+
+def main(num_labels):
+    labels, cloud, viewpoints, expected = synthetic_warehouse(num_labels)
+    print(f"{num_labels} labels on {2 * NUM_AISLES} shelf faces, {len(cloud)} cloud points")
+
+    start = time.perf_counter()
+    waypoints = single_plane_loop(labels)
+    summarize("single plane", time.perf_counter() - start, waypoints, expected, labels)
+
+    start = time.perf_counter()
+    planes = fit_surfaces(labels, viewpoints=viewpoints, max_planes=0)
+    waypoints = planes.offset(labels, STANDOFF)
+    summarize("label RANSAC", time.perf_counter() - start, waypoints, expected, labels)
+
+    start = time.perf_counter()
+    planes = fit_surfaces(labels, cloud, viewpoints, max_planes=2 * NUM_AISLES + 1)
+    waypoints = planes.offset(labels, STANDOFF)
+    summarize("cloud segments", time.perf_counter() - start, waypoints, expected, labels)
+    print(f"{len(planes)} planes")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,69 @@
+"""
+Compare candidate image pair scheduling against exhaustive label matching.
+
+Detection runs once, then tracks are built with every pair mode and with the global
+ANN clustering (which matches no pairs), and compared with the exhaustive tracks:
+two detections "agree" when both runs put them in the same object track.
+Precision/recall are over those same-object detection pairs.
+
+Usage (from back_end/):
+    uv run -m benchmarks.track_matching [IMAGE_DIR]
+"""
+import sys
+import time
+from collections import defaultdict
+from itertools import combinations
+from pathlib import Path
+
+from modules.barcode_detection.detection import detect_labels, list_images
+from modules.barcode_detection.matching import build_object_tracks
+from modules.barcode_detection.ann import cluster_object_tracks
+from modules.barcode_detection.pairs import PAIR_MODES, candidate_pairs
+
+WORKING_DIR = Path(__file__).resolve().parents[1]
+IMAGE_DIR = WORKING_DIR / "data" / "test" / "images"
+
+
+def same_object_pairs(bbox_to_object_id):
+    members = defaultdict(list)
+    for key, object_id in bbox_to_object_id.items():
+        members[object_id].append(key)
+    return {tuple(sorted(pair)) for keys in members.values() for pair in combinations(keys, 2)}
+
+
+def run_mode(mode, image_paths, all_features, all_bboxes):
+    start = time.perf_counter()
+    if mode == "ann":
+        _, bbox_to_object_id = cluster_object_tracks(all_features, all_bboxes)
+        return 0, time.perf_counter() - start, bbox_to_object_id
+
+    pairs = candidate_pairs(mode, image_paths, all_features)
+    _, bbox_to_object_id = build_object_tracks(all_features, all_bboxes, pairs)
+    return len(pairs), time.perf_counter() - start, bbox_to_object_id
+
+
+def main(image_dir):
+    image_paths = list_images(image_dir)
+    print(f"Detecting labels in {len(image_paths)} images...")
+    all_features, all_bboxes, _ = detect_labels(image_paths)
+
+    num_pairs, seconds, reference = run_mode("exhaustive", image_paths, all_features, all_bboxes)
+    reference_pairs = same_object_pairs(reference)
+    num_objects = len(set(reference.values()))
+    print(f"{'mode':<12}{'pairs':>8}{'seconds':>10}{'objects':>9}{'precision':>11}{'recall':>8}")
+    print(f"{'exhaustive':<12}{num_pairs:>8}{seconds:>10.3f}{num_objects:>9}{1.0:>11.3f}{1.0:>8.3f}")
+
+    for mode in PAIR_MODES + ("ann",):
+        if mode == "exhaustive":
+            continue
+        num_pairs, seconds, result = run_mode(mode, image_paths, all_features, all_bboxes)
+        result_pairs = same_object_pairs(result)
+        agreed = len(result_pairs & reference_pairs)
+        precision = agreed / len(result_pairs) if result_pairs else 1.0
+        recall = agreed / len(reference_pairs) if reference_pairs else 1.0
+        num_objects = len(set(result.values()))
+        print(f"{mode:<12}{num_pairs:>8}{seconds:>10.3f}{num_objects:>9}{precision:>11.3f}{recall:>8.3f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else IMAGE_DIR)
@@ -0,0 +1,130 @@
+"""
+Time batched label triangulation against the per-detection loop it replaced.
+
+A synthetic flight is generated: cameras along a wall facing labels on it, each
+label seen by the nearest cameras with pixel noise. Both implementations
+triangulate every label; the maximum difference between their points is reported
+alongside the timings. Robust triangulation is then timed on the same flight with
+mismatched detections.
+
+Usage (from back_end/):
+    uv run -m benchmarks.triangulation [NUM_DETECTIONS]
+"""
+import sys
+import time
+
+import numpy as np
+
+from modules.path_generation.triangulation import Observations, triangulate_points, robust_triangulate
+
+IMAGE_SIZE = (4000, 3000)
+FOCAL_LENGTH = 3000.0
+VIEWS_PER_LABEL = 8
+# Share of detections assigned to the wrong label, as a bad match would
+MISMATCH_RATE = 0.1
+# Mean distance between labels along the wall (meters)
+LABEL_SPACING = 0.5
+
+
+def look_at(center, target):
+    """cam_from_world rotation of a camera at center looking at target (y down)."""
+    z = target - center
+    z /= np.linalg.norm(z)
+    x = np.cross([0.0, 0.0, 1.0], z)
+    if np.linalg.norm(x) < 1e-6:
+        x = np.array([1.0, 0.0, 0.0])
+    x /= np.linalg.norm(x)
+    y = np.cross(z, x)
+    return np.stack([x, y, z])
+
+
+def synthetic_flight(num_detections, seed=0):
+    rng = np.random.default_rng(seed)
+    num_labels = max(num_detections // VIEWS_PER_LABEL, 1)
+    wall_length = num_labels * LABEL_SPACING
+    labels = np.column_stack([
+        rng.uniform(0, wall_length, num_labels), np.zeros(num_labels), rng.uniform(0, 10, num_labels),
+    ])
+    K = np.array([[FOCAL_LENGTH, 0, IMAGE_SIZE[0] / 2], [0, FOCAL_LENGTH, IMAGE_SIZE[1] / 2], [0, 0, 1]])
+
+    # Cameras every meter along the wall, facing it
+    camera_x = np.arange(0, wall_length + 1, 1.0)
+    centers = np.column_stack([camera_x, -rng.uniform(8, 12, len(camera_x)), rng.uniform(3, 7, len(camera_x))])
+    Rs = np.array([look_at(center, np.array([center[0], 0.0, center[2]])) for center in centers])
+    ts = -np.einsum('kij,kj->ki', Rs, centers)
+
+    class_ids, image_index, pixels = [], [], []
+    for label_id, label in enumerate(labels):
+        # Each label is seen by the cameras closest to it
+        for idx in np.argsort(np.abs(camera_x - label[0]))[:VIEWS_PER_LABEL]:
+            projected = K @ (Rs[idx] @ label + ts[idx])
+            class_ids.append(label_id)
+            image_index.append(idx)
+            pixels.append(projected[:2] / projected[2] + rng.normal(0, 1.0, 2))
+    Ks = np.repeat(K[None], len(centers), axis=0)
+    return np.array(class_ids), np.array(image_index), np.array(pixels), Ks, Rs, ts
+
+
+def loop_triangulation(class_ids, image_index, pixels, Ks, Rs, ts):
+    """The per-detection implementation previously in generate_kmz."""
+    class_to_lines = {}
+    for class_id, idx, (x, y) in zip(class_ids, image_index, pixels):
+        K, R, t = Ks[idx], Rs[idx], ts[idx]
+        C = -R.T @ t
+        ray_cam = np.linalg.inv(K) @ np.array([x, y, 1.0])
+        ray_world = R.T @ ray_cam
+        ray_world /= np.linalg.norm(ray_world)
+        class_to_lines.setdefault(int(class_id), []).append((C, ray_world))
+
+    points = {}
+    for class_id, rays in class_to_lines.items():
+        A, b = [], []
+        for C, d in rays:
+            P = np.eye(3) - np.outer(d, d)
+            A.append(P)
+            b.append(P @ C)
+        points[class_id] = np.linalg.lstsq(np.sum(A, axis=0), np.sum(b, axis=0), rcond=None)[0]
+    return points
+
+
+def main(num_detections):
+    flight = synthetic_flight(num_detections)
+    print(f"{len(flight[0])} detections of {len(set(flight[0]))} labels")
+
+    start = time.perf_counter()
+    reference = loop_triangulation(*flight)
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    observations = Observations(*flight)
+    classes, points = triangulate_points(observations.origins, observations.directions, observations.class_ids)
+    batch_seconds = time.perf_counter() - start
+
+    difference = max(np.abs(points[i] - reference[c]).max() for i, c in enumerate(classes))
+    print(f"{'loop':<8}{loop_seconds * 1000:>10.1f} ms")
+    print(f"{'batched':<8}{batch_seconds * 1000:>10.1f} ms  ({loop_seconds / batch_seconds:.0f}x)")
+    print(f"max point difference: {difference:.2e} m")
+
+    # Robust triangulation with mismatched detections, against the clean least-squares points
+    rng = np.random.default_rng(1)
+    class_ids = flight[0].copy()
+    mismatched = rng.random(len(class_ids)) < MISMATCH_RATE
+    class_ids[mismatched] = rng.integers(0, class_ids.max() + 1, mismatched.sum())
+    observations = Observations(class_ids, *flight[1:])
+
+    start = time.perf_counter()
+    result = robust_triangulate(observations)
+    robust_seconds = time.perf_counter() - start
+    _, plain = triangulate_points(observations.origins, observations.directions, observations.class_ids)
+
+    plain_error = np.array([np.linalg.norm(plain[i] - reference[c]) for i, c in enumerate(result.classes)])
+    robust_error = np.array([np.linalg.norm(result.points[i] - reference[c]) for i, c in enumerate(result.classes)])
+    print(f"\nWith {MISMATCH_RATE:.0%} mismatched detections:")
+    print(f"{'robust':<8}{robust_seconds * 1000:>10.1f} ms, "
+          f"{(~result.inliers & mismatched).sum()}/{mismatched.sum()} mismatches rejected, "
+          f"{(~result.inliers & ~mismatched).sum()} good detections rejected")
+    print(f"median error: least squares {np.median(plain_error):.3f} m, robust {np.median(robust_error):.4f} m")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,93 @@
+"""
+Measure upload write throughput in MB/s: the streaming SessionUpload writer against
+plain synchronous writes (the previous behaviour, which blocked the event loop for
+the duration of every write).
+
+Also checks that a writer failing on a full queue (e.g. disk full) surfaces its
+error to the sender and that abort() removes the session folder, instead of the
+sender waiting forever for room in the queue.
+
+Usage (from back_end/):
+    uv run -m benchmarks.upload_throughput [TOTAL_MB] [FILE_MB] [CHUNK_KB]
+"""
+import asyncio
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from uploads import SessionUpload
+
+
+async def run_streaming(upload_dir, num_files, chunks_per_file, chunk):
+    upload = SessionUpload(upload_dir)
+    for i in range(num_files):
+        await upload.open_file(f"image_{i:04d}.jpg")
+        for _ in range(chunks_per_file):
+            await upload.write(chunk)
+    return await upload.finish()
+
+
+async def run_failing_writer(upload_dir, chunk, fail_after=4):
+    """Write through an upload whose disk fills up; returns the exception write() raised."""
+    upload = SessionUpload(upload_dir, queue_chunks=2)
+    apply = upload._apply
+    calls = 0
+
+    def failing_apply(actions):
+        nonlocal calls
+        calls += 1
+        if calls > fail_after:
+            # Stall first, so the sender fills the queue and is waiting for room when the writer dies
+            time.sleep(0.2)
+            raise OSError(errno.ENOSPC, "No space left on device")
+        return apply(actions)
+
+    upload._apply = failing_apply
+    await upload.open_file("image_0000.jpg")
+    try:
+        for _ in range(1000):
+            await asyncio.wait_for(upload.write(chunk), timeout=10)
+    except OSError as e:
+        error = e
+    else:
+        raise AssertionError("write() did not report the writer's disk error")
+    finally:
+        await upload.abort()
+    assert not upload.session_dir.exists(), "abort() left the session folder behind"
+    return error
+
+
+def run_synchronous(upload_dir, num_files, chunks_per_file, chunk):
+    start = time.perf_counter()
+    for i in range(num_files):
+        with open(os.path.join(upload_dir, f"image_{i:04d}.jpg"), "wb") as f:
+            for _ in range(chunks_per_file):
+                f.write(chunk)
+    return time.perf_counter() - start
+
+
+def main(total_mb=2048, file_mb=8, chunk_kb=1024):
+    chunk = os.urandom(chunk_kb * 1024)
+    chunks_per_file = max(1, file_mb * 1024 // chunk_kb)
+    num_files = max(1, total_mb // file_mb)
+    total = num_files * chunks_per_file * len(chunk) / (1024 * 1024)
+
+    upload_dir = tempfile.mkdtemp(prefix="upload_bench_")
+    try:
+        seconds = run_synchronous(upload_dir, num_files, chunks_per_file, chunk)
+        print(f"synchronous: {total:.0f} MB in {seconds:.2f}s = {total / seconds:.1f} MB/s")
+
+        stats = asyncio.run(run_streaming(upload_dir, num_files, chunks_per_file, chunk))
+        print(f"streaming:   {total:.0f} MB in {stats['seconds']:.2f}s = {stats['mb_per_second']:.1f} MB/s")
+
+        error = asyncio.run(run_failing_writer(upload_dir, chunk))
+        print(f"failing writer: write() raised {error!r}, session folder removed")
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
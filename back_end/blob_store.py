@@ -0,0 +1,158 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+
+# Read size used when hashing blobs
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Seconds an unclaimed partial blob is kept for a client to resume it
+PARTIAL_RETENTION_SECONDS = int(os.getenv("PARTIAL_RETENTION_SECONDS", str(24 * 3600)))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def check_sha256(sha256):
+    sha256 = str(sha256).lower()
+    if not SHA256_PATTERN.match(sha256):
+        raise ValueError(f"Invalid sha256: {sha256!r}")
+    return sha256
+
+
+class BlobStore:
+    """
+    Content-addressed store for uploaded files.
+
+    Complete blobs live at blobs/<first two hex digits>/<sha256>; blobs still being
+    uploaded live at partial/<sha256> and can be resumed from their current size.
+    Session folders are assembled from blobs with hardlinks, so re-uploading the
+    same images costs neither transfer nor copies.
+
+    A partial blob is written by one connection at a time: the connection claims
+    its sha256 first, and releases it when the blob is stored or the connection
+    ends. Partials nobody claims and nobody touched for a while are collected.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.partial_dir = self.root / "partial"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.partial_dir.mkdir(parents=True, exist_ok=True)
+        # sha256 -> owner (e.g. a connection) currently writing its partial
+        self._claims = {}
+        self._claims_lock = threading.Lock()
+
+    def blob_path(self, sha256):
+        sha256 = check_sha256(sha256)
+        return self.blob_dir / sha256[:2] / sha256
+
+    def partial_path(self, sha256):
+        return self.partial_dir / check_sha256(sha256)
+
+    def claim(self, sha256, owner):
+        """Reserve a partial blob for owner; False if another owner is writing it."""
+        sha256 = check_sha256(sha256)
+        with self._claims_lock:
+            if self._claims.setdefault(sha256, owner) is not owner:
+                return False
+        return True
+
+    def release(self, sha256, owner):
+        with self._claims_lock:
+            if self._claims.get(sha256) is owner:
+                del self._claims[sha256]
+
+    def release_all(self, owner):
+        """Release every claim of owner, e.g. when its connection closes."""
+        with self._claims_lock:
+            for sha256 in [sha256 for sha256, claimant in self._claims.items() if claimant is owner]:
+                del self._claims[sha256]
+
+    def is_claimed(self, sha256):
+        with self._claims_lock:
+            return check_sha256(sha256) in self._claims
+
+    def has(self, sha256):
+        return self.blob_path(sha256).exists()
+
+    def received(self, sha256):
+        """Bytes already stored for an unfinished blob (0 if none)."""
+        path = self.partial_path(sha256)
+        return path.stat().st_size if path.exists() else 0
+
+    def missing(self, entries):
+        """
+        For a manifest of {"name", "sha256", "size"} entries, return what still has
+        to be sent: one {"sha256", "offset"} per blob not yet in the store, where
+        offset is where an interrupted upload resumes.
+        """
+        missing = []
+        seen = set()
+        for entry in entries:
+            sha256 = check_sha256(entry["sha256"])
+            if sha256 in seen or self.has(sha256):
+                continue
+            seen.add(sha256)
+            offset = self.received(sha256)
+            if offset > int(entry["size"]) and not self.is_claimed(sha256):
+                # Longer than the blob can be: corrupt, start over
+                self.partial_path(sha256).unlink()
+                offset = 0
+            missing.append({"sha256": sha256, "offset": offset})
+        return missing
+
+    def commit(self, sha256):
+        """Verify a fully received partial blob and move it into the store."""
+        partial = self.partial_path(sha256)
+        actual = file_sha256(partial)
+        if actual != sha256:
+            partial.unlink()
+            raise ValueError(f"Blob {sha256} failed verification (got {actual})")
+
+        destination = self.blob_path(sha256)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(partial, destination)
+        # Blobs are shared by every session linking them, never modify them in place
+        os.chmod(destination, 0o444)
+        return destination
+
+    def link_into(self, sha256, destination):
+        """Place a blob at destination with a hardlink, copying if linking is not possible."""
+        source = self.blob_path(sha256)
+        destination = Path(destination)
+        if destination.exists():
+            destination.unlink()
+        try:
+            os.link(source, destination)
+        except OSError:
+            # Different filesystem or no hardlink support
+            shutil.copyfile(source, destination)
+        return destination
+
+    def collect_partials(self, max_age=PARTIAL_RETENTION_SECONDS):
+        """Remove unclaimed partial blobs not written to for max_age seconds. Returns the removed paths."""
+        removed = []
+        now = time.time()
+        for path in self.partial_dir.iterdir():
+            if not SHA256_PATTERN.match(path.name) or self.is_claimed(path.name):
+                continue
+            try:
+                if now - path.stat().st_mtime > max_age:
+                    path.unlink()
+                    removed.append(path)
+            except FileNotFoundError:
+                # Committed or removed meanwhile
+                continue
+        return removed
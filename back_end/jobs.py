@@ -0,0 +1,282 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from modules import drone_object_detection, generate_kmz, model_stats, SFM_MATCHING_MODES, ROUTE_OBJECTIVES, PAIR_MODES
+
+# Maximum number of pipelines (detection + reconstruction) running at once; further jobs wait in the queue
+MAX_CONCURRENT_RECONSTRUCTIONS = int(os.getenv("MAX_CONCURRENT_RECONSTRUCTIONS", "2"))
+
+# Seconds a finished job (and its event log) stays queryable before it is evicted
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(3600)))
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+ERROR = "error"
+
+# Event types that end a job
+TERMINAL_EVENTS = ("job_done", "job_error")
+
+# Pipeline options a client may set per request (OPTIONS: message), by pipeline stage
+REQUEST_OPTIONS = {
+    "detection": ("metric", "matching", "pair_mode", "pair_k", "pair_window", "pair_max_distance"),
+    "kmz": ("use_pose_priors", "robust_triangulation", "reprojection_threshold", "robust_similarity", "standoff", "segment_surfaces", "max_planes", "route_objective", "route_time_budget", "max_mission_waypoints", "max_mission_time", "max_mission_distance", "sfm_matching", "max_neighbors", "max_distance", "overlap", "num_images"),
+}
+
+
+def parse_options(text):
+    """Split a flat JSON object of request options into per-stage pipeline options."""
+    values = json.loads(text)
+    if not isinstance(values, dict):
+        raise ValueError("Options must be a JSON object")
+
+    options = {stage: {} for stage in REQUEST_OPTIONS}
+    for key, value in values.items():
+        stage = next((stage for stage, keys in REQUEST_OPTIONS.items() if key in keys), None)
+        if stage is None:
+            raise ValueError(f"Unknown option {key!r}")
+        options[stage][key] = value
+
+    # Fail here rather than minutes later in a worker
+    pair_mode = options["detection"].get("pair_mode")
+    if pair_mode is not None and pair_mode not in PAIR_MODES:
+        raise ValueError(f"Unknown pair mode {pair_mode!r}, expected one of {PAIR_MODES}")
+    sfm_matching = options["kmz"].get("sfm_matching")
+    if sfm_matching is not None and sfm_matching not in SFM_MATCHING_MODES:
+        raise ValueError(f"Unknown SfM matching mode {sfm_matching!r}, expected one of {SFM_MATCHING_MODES}")
+    route_objective = options["kmz"].get("route_objective", "time")
+    if route_objective is not None and route_objective not in ROUTE_OBJECTIVES:
+        raise ValueError(f"Unknown route objective {route_objective!r}, expected one of {ROUTE_OBJECTIVES} or null")
+    for key in ("max_mission_waypoints", "max_mission_time", "max_mission_distance"):
+        limit = options["kmz"].get(key)
+        if limit is not None and (isinstance(limit, bool) or not isinstance(limit, (int, float)) or limit <= 0):
+            raise ValueError(f"Option {key!r} must be a positive number or null")
+    return options
+
+
+def run_pipeline(job_id, image_dir, label_dir, output_dir, events, options):
+    """
+    Run detection and KMZ generation for one job. Executed in a worker process;
+    progress is reported through the shared `events` queue and always ends with a
+    job_done or job_error event.
+    """
+    def emit(event_type, data):
+        events.put({"job_id": job_id, "type": event_type, "data": data})
+
+    try:
+        emit("job_started", {"pid": os.getpid()})
+
+        emit("drone_object_detection", "Drone object detection in progress...")
+        drone_object_detection(image_dir, label_dir, **options.get("detection", {}))
+
+        emit("kmz_generation", "KMZ generation in progress...")
+        generate_kmz(image_dir, label_dir, output_dir, **options.get("kmz", {}))
+
+        emit("job_done", {"output_dir": str(output_dir), "pid": os.getpid(), "model_stats": model_stats()})
+    except Exception as e:
+        traceback.print_exc()
+        emit("job_error", f"Processing error: {str(e)}")
+
+
+class Job:
+    def __init__(self, job_id, image_dir, output_dir):
+        self.id = job_id
+        self.image_dir = image_dir
+        self.output_dir = output_dir
+        self.status = QUEUED
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self.subscribers = []
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "events": self.events,
+        }
+
+
+class JobManager:
+    """
+    Runs pipelines in a bounded pool of worker processes, off the event loop.
+
+    Workers push progress events into one multiprocessing queue; a pump thread
+    forwards them onto the event loop, where they are recorded on the job and fanned
+    out to every subscriber of that job.
+    """
+
+    def __init__(self, max_workers=MAX_CONCURRENT_RECONSTRUCTIONS, initializer=None, retention=JOB_RETENTION_SECONDS):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.retention = retention
+        self.jobs = {}
+        self.worker_stats = {}
+        self._executor = None
+        self._context = None
+        self._manager = None
+        self._events = None
+        self._loop = None
+        self._pump = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+
+        # Spawn rather than fork: the server process holds threads and torch state
+        self._context = multiprocessing.get_context("spawn")
+        self._manager = self._context.Manager()
+        self._events = self._manager.Queue()
+        self._executor = self._create_executor()
+
+        self._pump = threading.Thread(target=self._pump_events, name="job-events", daemon=True)
+        self._pump.start()
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._context,
+            initializer=self.initializer,
+        )
+
+    def _replace_executor(self, broken):
+        """
+        Swap a pool broken by a dead worker (out of memory, segfault) for a fresh one.
+        ProcessPoolExecutor never recovers by itself: every later submit would raise.
+        """
+        if self._executor is not broken:
+            # Already replaced
+            return
+        print("A worker process died, restarting the worker pool")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._create_executor()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._events is not None:
+            # Wake the pump thread so it can exit
+            self._events.put(None)
+        if self._manager is not None:
+            self._manager.shutdown()
+
+    def _pump_events(self):
+        while True:
+            try:
+                event = self._events.get()
+            except (EOFError, OSError):
+                return
+            if event is None:
+                return
+            self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event):
+        job = self.jobs.get(event["job_id"])
+        if job is None or job.status in (DONE, ERROR):
+            return
+
+        if event["type"] == "job_started":
+            job.status = RUNNING
+        elif event["type"] == "job_done":
+            job.status = DONE
+            self.worker_stats[event["data"]["pid"]] = event["data"]["model_stats"]
+        elif event["type"] == "job_error":
+            job.status = ERROR
+
+        if event["type"] in TERMINAL_EVENTS:
+            job.finished = time.time()
+
+        job.events.append(event)
+        for subscriber in job.subscribers:
+            subscriber.put_nowait(event)
+
+    def submit(self, image_dir, label_dir, output_dir, options=None):
+        """Queue a pipeline run and return its job ID."""
+        self.collect_finished()
+        job_id = uuid.uuid4().hex
+        job = Job(job_id, str(image_dir), str(output_dir))
+        self.jobs[job_id] = job
+
+        self._run(job_id, (run_pipeline, job_id, str(image_dir), str(label_dir), str(output_dir), self._events,
+                           options or {}))
+        return job_id
+
+    def _run(self, job_id, args):
+        """Submit a job's pipeline call to the current pool."""
+        executor = self._executor
+        try:
+            future = executor.submit(*args)
+        except BrokenProcessPool:
+            # A worker died since the last job finished
+            self._replace_executor(executor)
+            executor = self._executor
+            future = executor.submit(*args)
+
+        def on_done(future):
+            # Only reached with an exception if the worker itself died (e.g. out of memory)
+            if future.cancelled() or future.exception() is None:
+                return
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                self._loop.call_soon_threadsafe(self._on_broken_pool, job_id, args, executor, error)
+                return
+            event = {"job_id": job_id, "type": "job_error", "data": f"Worker failed: {error}"}
+            self._loop.call_soon_threadsafe(self._dispatch, event)
+
+        future.add_done_callback(on_done)
+
+    def _on_broken_pool(self, job_id, args, executor, error):
+        """
+        A worker died and took its pool down: restart the pool, run jobs that had not
+        started yet again, and fail the started ones (which of them killed the
+        worker can't be told apart).
+        """
+        self._replace_executor(executor)
+        job = self.jobs.get(job_id)
+        if job is not None and job.status == QUEUED:
+            self._run(job_id, args)
+            return
+        event = {"job_id": job_id, "type": "job_error", "data": f"Worker process died (e.g. out of memory): {error}"}
+        self._dispatch(event)
+
+    def collect_finished(self, max_age=None):
+        """Forget jobs that finished more than max_age seconds ago and have no subscribers. Returns their IDs."""
+        max_age = self.retention if max_age is None else max_age
+        now = time.time()
+        removed = [job_id for job_id, job in self.jobs.items()
+                   if job.status in (DONE, ERROR) and not job.subscribers and now - job.finished > max_age]
+        for job_id in removed:
+            del self.jobs[job_id]
+        return removed
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    async def events(self, job_id):
+        """Yield every event of a job (past and future) until it finishes."""
+        job = self.jobs[job_id]
+        subscriber = asyncio.Queue()
+        job.subscribers.append(subscriber)
+        try:
+            for event in list(job.events):
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+
+            while True:
+                event = await subscriber.get()
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+        finally:
+            job.subscribers.remove(subscriber)
@@ -1,5 +1,5 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
 from typing import List, Dict, Optional
 import shutil
 from pathlib import Path
@@ -7,8 +7,13 @@ import asyncio
 import json
 import os
 from fastapi.middleware.cors import CORSMiddleware
-from modules import process_user_input, generate_kmz, drone_object_detection
-import base64
+from modules import process_user_input, warm_up_models, model_stats, collect_garbage, TRIANGULATION_REPORT, ImageIndex, KMZ_FILENAME, MISSIONS_FILENAME
+from jobs import JobManager, parse_options
+from uploads import SessionUpload, safe_filename
+from blob_store import BlobStore, check_sha256
+from results import result_dir, file_etag, parse_range, iter_file, media_type
+from middleware.file_size import LimitUploadSizeMiddleware
+from starlette.websockets import WebSocketState
 
 app = FastAPI()
 # Allow frontend running on localhost:3000
@@ -20,62 +25,136 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+# Upload limits, enforced on websocket frames by LimitUploadSizeMiddleware
+MAX_UPLOAD_FILE_SIZE = int(os.getenv("MAX_UPLOAD_FILE_SIZE", str(200 * 1024 * 1024)))
+MAX_UPLOAD_SESSION_SIZE = int(os.getenv("MAX_UPLOAD_SESSION_SIZE", str(20 * 1024 * 1024 * 1024)))
+
+app.add_middleware(
+    LimitUploadSizeMiddleware,
+    max_upload_size=MAX_UPLOAD_SESSION_SIZE,
+    max_file_size=MAX_UPLOAD_FILE_SIZE,
+)
+
 # Get the current working directory
 BASE_DIR = Path(__file__).resolve().parent
 
 UPLOAD_DIR = BASE_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-async def process_uploads(websocket: WebSocket, upload_dir: str, prompt: str, files: List[str]):
-    """Simple function to process uploaded files and send updates via websocket"""
+# Content-addressed store of every uploaded image; session folders are hardlinked from it
+blob_store = BlobStore(UPLOAD_DIR / "store")
+
+# Load detection models when a worker process starts instead of on its first job (set to "false" to load lazily)
+WARM_UP_MODELS = os.getenv("WARM_UP_MODELS", "true").lower() == "true"
+
+# Pipelines run in a bounded pool of worker processes (size: MAX_CONCURRENT_RECONSTRUCTIONS)
+job_manager = JobManager(initializer=warm_up_models if WARM_UP_MODELS else None)
+
+# How often expired COLMAP workspaces (retention: WORKSPACE_RETENTION_SECONDS), finished jobs and
+# abandoned partial blobs are removed
+WORKSPACE_GC_INTERVAL_SECONDS = int(os.getenv("WORKSPACE_GC_INTERVAL_SECONDS", "3600"))
+
+async def collect_workspaces_periodically():
+    while True:
+        removed = await asyncio.to_thread(collect_garbage)
+        if removed:
+            print(f"Removed {len(removed)} expired workspaces")
+        removed = await asyncio.to_thread(blob_store.collect_partials)
+        if removed:
+            print(f"Removed {len(removed)} abandoned partial blobs")
+        # Finished jobs are also evicted on submit; this covers an idle server
+        job_manager.collect_finished()
+        await asyncio.sleep(WORKSPACE_GC_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_job_manager():
+    job_manager.start()
+    asyncio.create_task(collect_workspaces_periodically())
+
+@app.on_event("shutdown")
+async def stop_job_manager():
+    job_manager.shutdown()
+
+def parse_manifest(text: str) -> List[Dict]:
+    """Validate a MANIFEST: payload, a JSON list of {"name", "sha256", "size"} entries."""
+    entries = json.loads(text)
+    if not isinstance(entries, list):
+        raise ValueError("Manifest must be a list")
+    return [
+        {
+            "name": safe_filename(entry["name"]),
+            "sha256": check_sha256(entry["sha256"]),
+            "size": int(entry["size"]),
+        }
+        for entry in entries
+    ]
+
+def link_manifest(manifest: List[Dict], session_dir: Path):
+    for entry in manifest:
+        blob_store.link_into(entry["sha256"], session_dir / entry["name"])
+    # The blob hashes are the images' content hashes: the reconstruction cache need not read them again
+    ImageIndex.open(session_dir).add_digests({entry["name"]: entry["sha256"] for entry in manifest})
+
+def result_url(websocket: WebSocket, session_id: str, filename: str) -> str:
+    """HTTP URL of a result file, on the same host the websocket client connected to."""
+    scheme = {"ws": "http", "wss": "https"}.get(websocket.url.scheme, websocket.url.scheme)
+    return str(websocket.url.replace(scheme=scheme, path=f"/results/{session_id}/{filename}", query=""))
+
+async def process_uploads(websocket: WebSocket, upload_dir: str, prompt: str, files: List[str], options: Optional[Dict] = None):
+    """Queue the uploaded files for processing and relay job progress via websocket"""
     try:
-        # Send processing started message
-        
-        # Add your actual processing logic here
-        # This is where you'd handle the files based on the prompt
         print(f"Processing files: {files} with prompt: {prompt}")
         print(f"Files are located in: {upload_dir}")
-        # replace print and add after it
 
         image_dir = Path(upload_dir)
         label_dir = image_dir  / "labels"
-        output_dir = image_dir.parent / "output"
+        # One output folder per session so concurrent jobs never overwrite each other's KMZ
+        output_dir = image_dir.parent / f"{image_dir.name}_output"
 
         label_dir.mkdir(exist_ok=True)
         output_dir.mkdir(exist_ok=True)
 
-        # Payload
-        payload = {
-            "type": "drone_object_detection",
-            "data": "Drone object detection in progress..."
-        }
+        # EXIF GPS, capture time and sizes are read once here; detection and path generation query the index
+        await asyncio.to_thread(ImageIndex.open, image_dir)
 
-        await websocket.send_text(json.dumps(payload))
+        # Detection and KMZ generation run in a worker process, the event loop stays free
+        job_id = job_manager.submit(image_dir, label_dir, output_dir, options)
 
-        drone_object_detection(image_dir, label_dir)
+        await websocket.send_text(json.dumps({
+            "type": "job",
+            "data": {"job_id": job_id, "status": job_manager.get(job_id).status}
+        }))
 
-        # Payload
-        payload = {
-            "type": "kmz_generation",
-            "data": "KMZ generation in progress..."
-        }
+        async for event in job_manager.events(job_id):
+            if event["type"] == "job_started":
+                await websocket.send_text(json.dumps({"type": "status", "data": f"Job {job_id} started"}))
 
-        await websocket.send_text(json.dumps(payload))
+            elif event["type"] == "job_error":
+                await websocket.send_text(json.dumps({"type": "error", "data": event["data"]}))
 
-        # Generate KMZ file
-        generate_kmz(image_dir, label_dir, output_dir)
+            elif event["type"] == "job_done":
+                # Only the location is sent; the client downloads the file over HTTP
+                output_file = output_dir / KMZ_FILENAME
+                result = {
+                    "url": result_url(websocket, image_dir.name, output_file.name),
+                    "filename": output_file.name,
+                    "size": output_file.stat().st_size,
+                }
+                # Per-label inlier counts and uncertainty, when robust triangulation ran
+                report_file = output_dir / TRIANGULATION_REPORT
+                if report_file.exists():
+                    result["report_url"] = result_url(websocket, image_dir.name, report_file.name)
+                # One KMZ per mission and their manifest, when the route was split
+                missions_file = output_dir / MISSIONS_FILENAME
+                if missions_file.exists():
+                    result["missions_url"] = result_url(websocket, image_dir.name, missions_file.name)
 
-        output_file = output_dir / "Group14.kmz"
-        
-        with open(output_file, "rb") as f:
-            encoded = base64.b64encode(f.read()).decode()
+                await websocket.send_text(json.dumps({"type": "result_ready", "data": result}))
 
-        await websocket.send_text(json.dumps({
-            "type": "data",
-            "data": encoded
-        }))
+            else:
+                # Progress events (drone_object_detection, kmz_generation, ...)
+                await websocket.send_text(json.dumps({"type": event["type"], "data": event["data"]}))
 
-        
     except Exception as e:
         await websocket.send_text(json.dumps({
             "status": "error",
@@ -83,20 +162,39 @@ async def process_uploads(websocket: WebSocket, upload_dir: str, prompt: str, fi
             "upload_dir": upload_dir
         }))
 
+async def store_blob(websocket: WebSocket, upload: SessionUpload, blob: Dict):
+    """Move a fully received blob into the store once its hash checks out."""
+    await upload.flush()
+    try:
+        await asyncio.to_thread(blob_store.commit, blob["sha256"])
+    except ValueError as e:
+        await websocket.send_text(json.dumps({"type": "error", "data": str(e)}))
+    else:
+        await websocket.send_text(json.dumps({"type": "blob_stored", "data": blob["sha256"]}))
+    finally:
+        blob_store.release(blob["sha256"], websocket)
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
 
     prompt = ""
-    current_file: Optional[str] = None
-    file_writer = None
-    uploaded_files: List[str] = []
+    # Pipeline options of this connection's jobs (OPTIONS: message)
+    options: Dict = {}
+    # Files of the current batch are streamed straight into their session folder
+    upload: Optional[SessionUpload] = None
+    # Content-addressed batch: the announced files, and the blob currently being received
+    manifest: Optional[List[Dict]] = None
+    blob: Optional[Dict] = None
     
     try:
         while True:
             message = await websocket.receive()
 
-            if "text" in message:
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            if message.get("text") is not None:
                 # Handle metadata text message
                 data = message["text"]
                 
@@ -111,38 +209,87 @@ async def websocket_endpoint(websocket: WebSocket):
 
                     await websocket.send_text(json.dumps(payload))
                 
+                elif data.startswith("OPTIONS:"):
+                    # JSON object of pipeline options, e.g. {"sfm_matching": "spatial", "max_distance": 50}
+                    try:
+                        options = parse_options(data.replace("OPTIONS:", "", 1))
+                    except ValueError as e:
+                        await websocket.send_text(json.dumps({"type": "error", "data": f"Invalid options: {e}"}))
+                        continue
+                    await websocket.send_text(json.dumps({"type": "options", "data": options}))
+
                 elif data.startswith("FILENAME:"):
-                    # Close any previously open file writer
-                    if file_writer:
-                        file_writer.close()
-                        file_writer = None
-                        uploaded_files.append(current_file)
-                    
+                    # The first file of a batch creates its session folder
+                    if upload is None:
+                        upload = SessionUpload(UPLOAD_DIR)
+
                     filename = data.replace("FILENAME:", "").strip()
-                    save_path = UPLOAD_DIR / filename
-                    file_writer = save_path.open("wb")
-                    current_file = filename
+                    try:
+                        await upload.open_file(filename)
+                    except ValueError as e:
+                        await websocket.send_text(json.dumps({"type": "error", "data": str(e)}))
                 
+                elif data.startswith("MANIFEST:"):
+                    # The client announces the batch by hash and gets back only what it still has to send
+                    try:
+                        manifest = parse_manifest(data.replace("MANIFEST:", "", 1))
+                    except (ValueError, KeyError, TypeError) as e:
+                        manifest = None
+                        await websocket.send_text(json.dumps({"type": "error", "data": f"Invalid manifest: {e}"}))
+                        continue
+
+                    missing = await asyncio.to_thread(blob_store.missing, manifest)
+                    await websocket.send_text(json.dumps({"type": "missing", "data": missing}))
+
+                elif data.startswith("BLOB:"):
+                    # BLOB:<sha256>:<offset>, followed by the blob's bytes from offset on
+                    try:
+                        _, sha256, offset = data.split(":")
+                        sha256, offset = check_sha256(sha256), int(offset)
+                        sizes = {entry["sha256"]: entry["size"] for entry in manifest or []}
+                        if sha256 not in sizes:
+                            raise ValueError(f"Blob {sha256} is not in the manifest")
+                        if not blob_store.claim(sha256, websocket):
+                            raise ValueError(f"Blob {sha256} is being uploaded by another connection")
+                        if not 0 <= offset <= blob_store.received(sha256):
+                            blob_store.release(sha256, websocket)
+                            raise ValueError(f"Cannot resume blob {sha256} at offset {offset}")
+                    except ValueError as e:
+                        await websocket.send_text(json.dumps({"type": "error", "data": str(e)}))
+                        continue
+
+                    if upload is None:
+                        upload = SessionUpload(UPLOAD_DIR)
+                    await upload.open_path(blob_store.partial_path(sha256), offset)
+                    blob = {"sha256": sha256, "size": sizes[sha256], "received": offset}
+                    if blob["size"] == offset:
+                        await store_blob(websocket, upload, blob)
+                        blob = None
+
                 elif data == "UPLOAD_COMPLETE":
-                    # Close the current file if one is open
-                    if file_writer:
-                        file_writer.close()
-                        file_writer = None
-                        if current_file:
-                            uploaded_files.append(current_file)
-                            current_file = None
-                    
-                    # Create a session folder for this upload batch
-                    session_id = f"session_{int(asyncio.get_event_loop().time())}"
-                    session_dir = os.path.join(str(UPLOAD_DIR.absolute()), session_id)
-                    os.makedirs(session_dir, exist_ok=True)
-                    
-                    # Move uploaded files to the session directory
-                    for file in uploaded_files:
-                        source = os.path.join(str(UPLOAD_DIR.absolute()), file)
-                        destination = os.path.join(session_dir, file)
-                        shutil.move(source, destination)
-                    
+                    if upload is None:
+                        upload = SessionUpload(UPLOAD_DIR)
+
+                    if manifest is not None:
+                        missing = await asyncio.to_thread(blob_store.missing, manifest)
+                        if missing:
+                            # Not everything arrived (e.g. a failed blob), ask for the rest again
+                            await websocket.send_text(json.dumps({"type": "missing", "data": missing}))
+                            continue
+
+                        # Assemble the session folder from the store without copying
+                        await asyncio.to_thread(link_manifest, manifest, upload.session_dir)
+                        for entry in manifest:
+                            upload.add_file(entry["name"])
+                        manifest = None
+
+                    # Flush and close every file of the batch
+                    stats = await upload.finish()
+                    session_dir = str(upload.session_dir)
+                    uploaded_files = upload.files
+                    upload = None
+                    print(f"Received {stats['files']} files ({stats['bytes'] / (1024 * 1024):.1f} MB) at {stats['mb_per_second']:.1f} MB/s")
+
                     # Send initial response
                     await websocket.send_text(json.dumps({
                         "type": "success",
@@ -150,15 +297,17 @@ async def websocket_endpoint(websocket: WebSocket):
                     }))
                     
                     # Process uploads directly (no background task)
-                    await process_uploads(websocket, session_dir, prompt, uploaded_files)
+                    await process_uploads(websocket, session_dir, prompt, uploaded_files, options)
                 
-            elif "bytes" in message and file_writer is not None:
-                # Handle binary file chunk
-                chunk = message["bytes"]
-                try:
-                    file_writer.write(chunk)
-                except Exception as e:
-                    await websocket.send_text(f"Error writing file: {str(e)}")
+            elif message.get("bytes") is not None and upload is not None and upload.is_open:
+                # Handle binary file chunk; waits while the disk writer catches up
+                await upload.write(message["bytes"])
+
+                if blob is not None:
+                    blob["received"] += len(message["bytes"])
+                    if blob["received"] >= blob["size"]:
+                        await store_blob(websocket, upload, blob)
+                        blob = None
             
             else:
                 await websocket.send_text("Unknown message type or no file currently open")
@@ -169,10 +318,13 @@ async def websocket_endpoint(websocket: WebSocket):
         print(f"Error in WebSocket connection: {str(e)}")
         await websocket.send_text(f"Error: {str(e)}")
     finally:
-        # Ensure any open file is properly closed
-        if file_writer:
-            file_writer.close()
-        await websocket.close()
+        # Drop any unfinished batch
+        if upload is not None:
+            await upload.abort()
+        # Partial blobs stay resumable by the next connection
+        blob_store.release_all(websocket)
+        if websocket.client_state != WebSocketState.DISCONNECTED:
+            await websocket.close()
 
 # create an api to call llm model
 @app.post("/ai_chat")
@@ -188,6 +340,66 @@ async def ai_chat(user_query: str):
 async def health_check():
     return {"status": "healthy"}
 
+# Report loaded models and memory use, for sizing workers
+@app.get("/models/stats")
+async def get_model_stats():
+    return {"server": model_stats(), "workers": job_manager.worker_stats}
+
+# Report the status and progress events of a processing job
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+# Download a processing result, streamed from disk with Range and ETag support
+@app.get("/results/{session_id}/{filename}")
+async def get_result(session_id: str, filename: str, request: Request):
+    try:
+        path = result_dir(UPLOAD_DIR, session_id) / safe_filename(filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not path.is_file():
+        raise HTTPException(status_code=404, detail="Result not found")
+
+    size = path.stat().st_size
+    etag = file_etag(path)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{path.name}"',
+    }
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    # A Range is only honoured if the file has not changed since the client's copy
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range != etag:
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        start, end, status_code = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        iter_file(path, start, end),
+        status_code=status_code,
+        media_type=media_type(path),
+        headers=headers,
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -1,21 +1,103 @@
-from fastapi import FastAPI
-from starlette.middleware import Middleware
-from starlette.middleware.trustedhost import TrustedHostMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+import json
+
 from starlette.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Close code for "message too big" (RFC 6455)
+WS_1009_MESSAGE_TOO_BIG = 1009
+
+def blob_offset(text):
+    """Resume offset of a "BLOB:<sha256>:<offset>" message; 0 if malformed (the application rejects those)."""
+    try:
+        return max(int(text.split(":")[2]), 0)
+    except (IndexError, ValueError):
+        return 0
+
+class LimitUploadSizeMiddleware:
+    """
+    Reject uploads above a size limit.
 
-class LimitUploadSizeMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, max_upload_size: int):
-        super().__init__(app)
+    - HTTP: requests whose Content-Length exceeds max_upload_size get a 413.
+    - WebSocket: binary frames are counted per upload batch (max_upload_size) and per
+      file (max_file_size, reset on every "FILENAME:" message, and set to the resume offset
+      on every "BLOB:" message, so a resumed blob counts what it already holds). When a limit is
+      exceeded the client gets an error message and the socket is closed with 1009,
+      and the application sees a disconnect.
+    """
+
+    def __init__(self, app: ASGIApp, max_upload_size: int, max_file_size: int = None):
+        self.app = app
         self.max_upload_size = max_upload_size  # in bytes
+        self.max_file_size = max_file_size  # in bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            await self.limit_http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self.limit_websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
 
-    async def dispatch(self, request: Request, call_next):
-        if request.headers.get('content-length') is not None:
-            content_length = int(request.headers['content-length'])
+    async def limit_http(self, scope: Scope, receive: Receive, send: Send):
+        headers = dict(scope["headers"])
+        if headers.get(b'content-length') is not None:
+            content_length = int(headers[b'content-length'])
             if content_length > self.max_upload_size:
-                return Response(
+                response = Response(
                     content="Request too large",
                     status_code=413
                 )
-        return await call_next(request)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    async def limit_websocket(self, scope: Scope, receive: Receive, send: Send):
+        session_bytes = 0
+        file_bytes = 0
+        closed = False
+
+        async def limited_receive():
+            nonlocal session_bytes, file_bytes, closed
+            message = await receive()
+            if message["type"] != "websocket.receive":
+                return message
+
+            text = message.get("text")
+            if text is not None:
+                if text.startswith("FILENAME:"):
+                    file_bytes = 0
+                elif text.startswith("BLOB:"):
+                    # BLOB:<sha256>:<offset> resumes a partial blob that already holds offset bytes;
+                    # counting from zero would let repeated resumes grow it past the limit
+                    file_bytes = blob_offset(text)
+                elif text == "UPLOAD_COMPLETE":
+                    # The next batch starts from zero
+                    session_bytes = 0
+                    file_bytes = 0
+                return message
+
+            size = len(message.get("bytes") or b"")
+            session_bytes += size
+            file_bytes += size
+
+            error = None
+            if session_bytes > self.max_upload_size:
+                error = f"Upload exceeds the limit of {self.max_upload_size} bytes"
+            elif self.max_file_size is not None and file_bytes > self.max_file_size:
+                error = f"File exceeds the limit of {self.max_file_size} bytes"
+
+            if error is not None:
+                await send({"type": "websocket.send", "text": json.dumps({"type": "error", "data": error})})
+                await send({"type": "websocket.close", "code": WS_1009_MESSAGE_TOO_BIG})
+                closed = True
+                return {"type": "websocket.disconnect", "code": WS_1009_MESSAGE_TOO_BIG}
+
+            return message
+
+        async def guarded_send(message):
+            # Once we closed the socket the application can no longer send on it
+            if closed:
+                return
+            await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
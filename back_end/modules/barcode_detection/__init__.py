@@ -1 +1,3 @@
-from .detection import drone_object_detection
\ No newline at end of file
+from .detection import drone_object_detection
+from .pairs import PAIR_MODES
+from .models import warm_up_models, model_stats
\ No newline at end of file
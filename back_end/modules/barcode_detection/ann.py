@@ -0,0 +1,174 @@
+import numpy as np
+from collections import defaultdict
+
+from .matching import pairwise_distances
+
+
+class IVFFlatIndex:
+    """
+    In-memory IVF-flat approximate nearest-neighbour index built on NumPy.
+
+    Vectors are partitioned into `n_lists` inverted lists by k-means; a query only
+    scans the `n_probe` lists whose centroids are closest to it, with exact
+    distances inside those lists.
+    """
+
+    def __init__(self, n_lists=None, n_probe=4, metric="euclidean", kmeans_iterations=10, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.metric = metric
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self.vectors = None
+        self.centroids = None
+        self.lists = []
+
+    def build(self, vectors):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        n = len(self.vectors)
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = min(n_lists, max(n, 1))
+
+        # k-means coarse quantizer, seeded from a random subset of the data
+        rng = np.random.default_rng(self.seed)
+        self.centroids = self.vectors[rng.choice(n, n_lists, replace=False)].copy() if n else np.empty((0, self.vectors.shape[1]), dtype=np.float32)
+        assignment = np.zeros(n, dtype=np.int64)
+        for _ in range(self.kmeans_iterations if n else 0):
+            assignment = pairwise_distances(self.vectors, self.centroids, self.metric).argmin(axis=1)
+            counts = np.bincount(assignment, minlength=n_lists)
+            non_empty = counts > 0
+            # Sum each cluster's members as contiguous runs of the sorted assignment
+            order = np.argsort(assignment, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[non_empty]
+            sums = np.add.reduceat(self.vectors[order].astype(np.float64), starts, axis=0)
+            # Empty lists keep their previous centroid
+            self.centroids[non_empty] = sums / counts[non_empty, None]
+
+        if n:
+            assignment = pairwise_distances(self.vectors, self.centroids, self.metric).argmin(axis=1)
+        self.lists = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+        return self
+
+    def search(self, queries, k):
+        """
+        Return (distances, indices), each of shape (n_queries, k), sorted by distance.
+        Missing neighbours (fewer than k candidates in the probed lists) are padded
+        with distance inf and index -1.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        distances = np.full((len(queries), k), np.inf)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if len(queries) == 0 or len(self.vectors) == 0:
+            return distances, indices
+
+        n_probe = min(self.n_probe, len(self.lists))
+        probes = np.argsort(pairwise_distances(queries, self.centroids, self.metric), axis=1)[:, :n_probe]
+
+        # Scan one inverted list at a time against every query probing it, merging
+        # each block into the running top-k
+        for c, members in enumerate(self.lists):
+            query_ids = np.flatnonzero((probes == c).any(axis=1))
+            if len(members) == 0 or len(query_ids) == 0:
+                continue
+            block = pairwise_distances(queries[query_ids], self.vectors[members], self.metric)
+            merged_d = np.concatenate([distances[query_ids], block], axis=1)
+            merged_i = np.concatenate([indices[query_ids], np.broadcast_to(members, block.shape)], axis=1)
+            top = np.argsort(merged_d, axis=1, kind="stable")[:, :k]
+            distances[query_ids] = np.take_along_axis(merged_d, top, axis=1)
+            indices[query_ids] = np.take_along_axis(merged_i, top, axis=1)
+
+        return distances, indices
+
+
+def cluster_object_tracks(all_features, all_bboxes, k=10, max_distance=None, distance_ratio=2.0, metric="euclidean", n_lists=None, n_probe=4):
+    """
+    Assign global object IDs by clustering all crop embeddings at once instead of
+    matching image pairs.
+
+    Every detection queries its k approximate nearest neighbours; the resulting edges
+    are merged shortest-first with union-find, and two clusters are only merged if
+    they share no image (a label appears at most once per image). Cost is roughly
+    linear in the number of detections.
+
+    Edges longer than max_distance are ignored. Without an explicit max_distance it
+    defaults to distance_ratio times the median nearest cross-image neighbour
+    distance, which separates re-observations of one label from different labels.
+
+    Returns (object_tracks, bbox_to_object_id) in the same format as
+    matching.build_object_tracks. Bboxes of image 0 seed the first object IDs;
+    other detections that end up alone are dropped, like unmatched bboxes in the
+    pairwise mode.
+    """
+    image_of = np.concatenate([np.full(len(features), i) for i, features in enumerate(all_features)]).astype(np.int64)
+    bbox_of = np.concatenate([np.arange(len(features)) for features in all_features]).astype(np.int64)
+    features = [np.asarray(f, dtype=np.float32).reshape(len(f), -1) for f in all_features if len(f) > 0]
+    vectors = np.concatenate(features) if features else np.empty((0, 0), dtype=np.float32)
+    n = len(vectors)
+
+    edges = np.empty((0, 3))
+    if n > 1:
+        index = IVFFlatIndex(n_lists=n_lists, n_probe=n_probe, metric=metric).build(vectors)
+        distances, neighbours = index.search(vectors, k + 1)
+
+        # Flatten into (distance, a, b) candidate edges between different images
+        a = np.repeat(np.arange(n), neighbours.shape[1])
+        b = neighbours.reshape(-1)
+        d = distances.reshape(-1)
+        keep = (b >= 0) & (a != b)
+        a, b, d = a[keep], b[keep], d[keep]
+        keep = image_of[a] != image_of[b]
+        a, b, d = a[keep], b[keep], d[keep]
+
+        if max_distance is None and len(d):
+            # Neighbours are sorted, so the first kept edge of each detection is its nearest
+            _, first = np.unique(a, return_index=True)
+            max_distance = distance_ratio * np.median(d[first])
+        if max_distance is not None:
+            keep = d <= max_distance
+            a, b, d = a[keep], b[keep], d[keep]
+
+        # Each undirected edge once, shortest first
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        _, unique = np.unique(lo * n + hi, return_index=True)
+        edges = np.stack([d[unique], lo[unique], hi[unique]], axis=1)
+        edges = edges[np.argsort(edges[:, 0], kind="stable")]
+
+    # Union-find over detections, tracking which images each cluster covers
+    parent = np.arange(n)
+    images = [{int(image_of[i])} for i in range(n)]
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for _, a, b in edges:
+        root_a, root_b = find(int(a)), find(int(b))
+        if root_a == root_b or images[root_a] & images[root_b]:
+            continue
+        if len(images[root_a]) < len(images[root_b]):
+            root_a, root_b = root_b, root_a
+        parent[root_b] = root_a
+        images[root_a] |= images[root_b]
+
+    clusters = defaultdict(list)
+    for i in range(n):
+        clusters[find(i)].append(i)
+
+    # Image 0 clusters first (in bbox order), then the rest by first detection
+    ordered = sorted(clusters.values(), key=lambda members: (image_of[members[0]] != 0, members[0]))
+
+    bbox_to_object_id = dict()
+    object_tracks = defaultdict(list)
+    object_id_counter = 0
+    for members in ordered:
+        if len(members) < 2 and image_of[members[0]] != 0:
+            continue
+        for i in sorted(members, key=lambda i: (image_of[i], bbox_of[i])):
+            image_idx, bbox_idx = int(image_of[i]), int(bbox_of[i])
+            bbox_to_object_id[(image_idx, bbox_idx)] = object_id_counter
+            object_tracks[object_id_counter].append((image_idx, all_bboxes[image_idx][bbox_idx]))
+        object_id_counter += 1
+
+    return object_tracks, bbox_to_object_id
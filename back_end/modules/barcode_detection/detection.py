@@ -1,123 +1,246 @@
-from ultralytics import RTDETR
 import cv2
 import torch
 import numpy as np
-from scipy.optimize import linear_sum_assignment
-from collections import defaultdict
 import os
+import queue
 import shutil
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Dummy feature extractor using a simple CNN backbone (replace with ResNet if needed)
-import torchvision.models as models
-import torchvision.transforms as transforms
-
-from pathlib import Path
-
-# Get the current working directory
-BASE_PATH = Path(__file__).resolve().parent
+from .models import get_detector, get_feature_extractor, get_transform, get_device
+from .matching import build_object_tracks
+from .pairs import candidate_pairs, DEFAULT_PAIR_MODE
+from .ann import cluster_object_tracks
+from ..image_headers import read_image_size
 
 # Define all constants here
-MODEL_CKPT = BASE_PATH / 'model' / 'object_detection_model.pt'
-
-def drone_object_detection(IMAGE_DIR, OUTPUT_DIR):
-    # --- Set up feature extractor ---
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    feature_extractor_model = models.resnet18(pretrained=True)
-    feature_extractor_model = torch.nn.Sequential(*list(feature_extractor_model.children())[:-1])  # Remove final layer
-    feature_extractor_model.eval()
-    feature_extractor_model.to(device)
-
-    transform = transforms.Compose([
-        transforms.ToPILImage(),
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-    ])
-
-    # --- Set up RTDETR model ---
-    def run_object_detection(image_path):
-        # Load the model
-        model = RTDETR(MODEL_CKPT)
-
-        model.to(device)
-        
-        # Predict on the unlabeled images
-        detections = model.predict(source=image_path, 
-                    save=False, 
-                    save_txt=False, 
-                    show_labels=False,
-                    save_crop=False,
-                    name='predictions_rtdetrl_matching', 
-                    conf=0.25)  # Predict on the unlabeled images
-        
-        return detections
-
-
-    # --- Set up matching function ---
-    def crop_from_image(image, bbox):
-        # Crop the bounding box from the image
-        x1, y1, x2, y2 = map(int, bbox)
-        return image[y1:y2, x1:x2]
-
-    def extract_feature(crop):
-        # Extract a feature vector from the crop
-        input_tensor = transform(crop).unsqueeze(0).to(device)
+MATCHING_MODES = ("hungarian", "ann")
+DETECTION_BATCH_SIZE = 8  # Images per RT-DETR forward pass
+PREFETCH_BATCHES = 2  # Decoded batches buffered ahead of inference
+EMBEDDING_BATCH_SIZE = 64  # Crops per ResNet forward pass
+EMBEDDING_DIM = 512  # ResNet-18 pooled feature size
+
+
+def iter_image_batches(image_paths, batch_size=DETECTION_BATCH_SIZE, prefetch=PREFETCH_BATCHES):
+    """
+    Yield (paths, images) batches of decoded BGR images.
+
+    Decoding runs in a background thread that stays up to `prefetch` batches ahead,
+    so JPEG decoding overlaps with inference on the previous batch.
+    """
+    batches = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Block while the queue is full, but give up once the consumer has stopped
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def decode():
+        try:
+            for start in range(0, len(image_paths), batch_size):
+                paths = image_paths[start:start + batch_size]
+                images = []
+                for path in paths:
+                    image = cv2.imread(path)
+                    if image is None:
+                        raise ValueError(f"Could not read image: {path}")
+                    images.append(image)
+                if not put((paths, images)):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    thread = threading.Thread(target=decode, name="image-prefetch", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = batches.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def extract_features(crops, batch_size=EMBEDDING_BATCH_SIZE):
+    """
+    Embed a list of crops with the shared ResNet-18 backbone.
+
+    Crops are resized and stacked into batches so each batch needs a single forward
+    pass. Returns a contiguous float32 array of shape (n_crops, 512).
+    """
+    if len(crops) == 0:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    device = get_device()
+    feature_extractor_model = get_feature_extractor()
+    transform = get_transform()
+
+    features = np.empty((len(crops), EMBEDDING_DIM), dtype=np.float32)
+    for start in range(0, len(crops), batch_size):
+        batch = torch.stack([transform(crop) for crop in crops[start:start + batch_size]]).to(device)
         with torch.no_grad():
-            feature = feature_extractor_model(input_tensor)
-        feature = feature.view(-1).cpu().numpy()
-        return feature
+            output = feature_extractor_model(batch)
+        features[start:start + len(batch)] = output.reshape(len(batch), -1).cpu().numpy()
 
-    def compute_cost_matrix(features1, features2):
-        # Compute the cost matrix (euclidean distance between features)
-        cost_matrix = np.zeros((len(features1), len(features2)))
-        for i, f1 in enumerate(features1):
-            for j, f2 in enumerate(features2):
-                cost_matrix[i, j] = np.linalg.norm(f1 - f2)
-        return cost_matrix
+    return features
 
 
-    # --- Main process ---
+def run_object_detection(images):
+    model = get_detector()
+
+    # Predict on a batch of decoded images, one result per image
+    detections = model.predict(source=images, 
+                save=False, 
+                save_txt=False, 
+                show_labels=False,
+                save_crop=False,
+                name='predictions_rtdetrl_matching', 
+                conf=0.25)  # Predict on the unlabeled images
+    
+    return detections
+
+
+def crop_from_image(image, bbox):
+    # Crop the bounding box from the image
+    x1, y1, x2, y2 = map(int, bbox)
+    return image[y1:y2, x1:x2]
 
-    image_paths = [os.path.join(IMAGE_DIR, img) for img in os.listdir(IMAGE_DIR) if img.lower().endswith(('.jpeg', '.jpg', '.png'))]
 
-    # Store features and bounding boxes
+def detect_labels(image_paths, batch_size=DETECTION_BATCH_SIZE):
+    """
+    Run RT-DETR over the images and embed every detected label.
+
+    Returns (all_features, all_bboxes, all_sizes), aligned with image_paths: one
+    (n_labels, 512) feature array, one list of xyxy bboxes and one (height, width)
+    per image.
+    """
     all_features = []
     all_bboxes = []
+    all_sizes = []
+
+    target_class_id = 1  # example: assuming 'Label' class is class ID 1
+
+    for paths, images in iter_image_batches(image_paths, batch_size):
+        # Run object detection on the whole batch
+        detections = run_object_detection(images)
+
+        for image, det in zip(images, detections):
+            crops = []
+            bboxes = []
+
+            detected_classes = det.boxes.cls.cpu().numpy()
+            xyxy = det.boxes.xyxy.cpu().numpy()
+            for i, class_id in enumerate(detected_classes):
 
-    # Track object IDs and which bbox belongs to which object
-    bbox_to_object_id = dict()
-    object_id_counter = 0
+                if class_id == target_class_id:
+                    bbox = xyxy[i]
+                    crops.append(crop_from_image(image, bbox))
+                    bboxes.append(bbox)
 
-    # Final output: object_id -> list of (image_idx, bbox coordinates)
-    object_tracks = defaultdict(list)
+            # Embed all crops of this image at once: (n_crops, 512) float32
+            features = extract_features(crops)
+
+            all_features.append(features)
+            all_bboxes.append(bboxes)
+            all_sizes.append(image.shape[:2])
+
+    return all_features, all_bboxes, all_sizes
+
+
+def save_yolo_format(all_images, object_tracks, output_dir, all_sizes=None, workers=None):
+    """
+    Save object tracks as one YOLO label file per image, in a single pass.
+
+    Arguments:
+    - all_images: Image file paths, indexed like the image_idx in object_tracks.
+    - object_tracks: A dictionary of object tracks with object IDs.
+    - output_dir: Directory to save the label files.
+    - all_sizes: Optional (height, width) per image; read from the file headers if missing.
+    - workers: Write files with this many threads (sequential if None or 1).
+    """
+    # Ensure the output directory exists
+    os.makedirs(output_dir, exist_ok=True)
+
+    if all_sizes is None:
+        all_sizes = [read_image_size(image) for image in all_images]
+
+    # Index detections by image once, keeping object/track order within each file
+    detections_per_image = [[] for _ in all_images]
+    for object_id, track in object_tracks.items():
+        for img_idx, bbox in track:
+            detections_per_image[img_idx].append((object_id, bbox))
+
+    def write_labels(image_idx):
+        image = all_images[image_idx]
+        height, width = all_sizes[image_idx]
+
+        # Get the image name without extension
+        image_name = os.path.splitext(os.path.basename(image))[0]
+
+        lines = []
+        for object_id, bbox in detections_per_image[image_idx]:
+            # Convert bbox coordinates from (x_min, y_min, x_max, y_max) to YOLO format
+            x_min, y_min, x_max, y_max = bbox
+
+            # Normalize the bounding box coordinates
+            x_center = (x_min + x_max) / 2 / width
+            y_center = (y_min + y_max) / 2 / height
+            w = (x_max - x_min) / width
+            h = (y_max - y_min) / height
+
+            lines.append(f"{object_id} {x_center} {y_center} {w} {h}\n")
+
+        label_file_path = os.path.join(output_dir, f"{image_name}.txt")
+        with open(label_file_path, 'w') as label_file:
+            label_file.write("".join(lines))
+
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(write_labels, range(len(all_images))))
+    else:
+        for image_idx in range(len(all_images)):
+            write_labels(image_idx)
+
+
+def list_images(image_dir):
+    return [os.path.join(image_dir, img) for img in os.listdir(image_dir) if img.lower().endswith(('.jpeg', '.jpg', '.png'))]
+
+
+def drone_object_detection(IMAGE_DIR, OUTPUT_DIR, batch_size=DETECTION_BATCH_SIZE, metric="euclidean", matching="hungarian",
+                           pair_mode=DEFAULT_PAIR_MODE, pair_k=8, pair_window=3, pair_max_distance=None):
+    """
+    Detect labels in every image of IMAGE_DIR, link them across images into object
+    tracks and write one YOLO label file per image to OUTPUT_DIR.
+
+    matching="hungarian" matches image pairs chosen by pair_mode (see
+    pairs.candidate_pairs, which gets pair_k, pair_window and pair_max_distance as
+    its k, window and max_distance); matching="ann" clusters all crop embeddings globally through
+    an approximate nearest-neighbour index instead (see ann.cluster_object_tracks).
+    """
+    if matching not in MATCHING_MODES:
+        raise ValueError(f"Unknown matching mode '{matching}', expected one of {MATCHING_MODES}")
+
+    # --- Main process ---
+
+    image_paths = list_images(IMAGE_DIR)
 
     # --- Start extracting features and running object detection ---
-    for image_path in image_paths:
-        # Read the image
-        image = cv2.imread(image_path)
-        
-        # Run object detection
-        detections = run_object_detection(image_path)
-
-        features = []
-        bboxes = []
-        if detections is not None:
-            target_class_id = 1  # example: assuming 'Label' class is class ID 1
-
-            for det in detections:
-                detected_classes = det.boxes.cls.cpu().numpy()
-                for i, class_id in enumerate(detected_classes):
-
-                    if class_id == target_class_id:
-                        bbox = det.boxes.xyxy[i].cpu().numpy()
-                        crop = crop_from_image(image, bbox)
-                        feature_vector = extract_feature(crop)                
-                
-                        features.append(feature_vector)
-                        bboxes.append(bbox)
-
-        all_features.append(features)
-        all_bboxes.append(bboxes)
+    all_features, all_bboxes, all_sizes = detect_labels(image_paths, batch_size)
 
     # Step 1: Find the image with the most bounding boxes
     num_images = len(all_features)
@@ -129,93 +252,20 @@ def drone_object_detection(IMAGE_DIR, OUTPUT_DIR):
     all_bboxes = [all_bboxes[image_with_max_bboxes]] + [all_bboxes[i] for i in range(num_images) if i != image_with_max_bboxes]
     all_features = [all_features[image_with_max_bboxes]] + [all_features[i] for i in range(num_images) if i != image_with_max_bboxes]
     all_images = [image_paths[image_with_max_bboxes]] + [image_paths[i] for i in range(len(image_paths)) if i != image_with_max_bboxes]
+    all_sizes = [all_sizes[image_with_max_bboxes]] + [all_sizes[i] for i in range(num_images) if i != image_with_max_bboxes]
 
+    if matching == "ann":
+        # Step 3/4: Cluster all detections at once with a per-image uniqueness constraint
+        print(f"Clustering {sum(len(f) for f in all_features)} detections with an ANN index")
+        object_tracks, bbox_to_object_id = cluster_object_tracks(all_features, all_bboxes, metric=metric)
+    else:
+        # Step 3: Pick the image pairs likely to share labels
+        pairs = candidate_pairs(pair_mode, all_images, all_features, k=pair_k, max_distance=pair_max_distance,
+                                window=pair_window)
+        print(f"Matching {len(pairs)} image pairs ({pair_mode})")
 
-    # Step 3: Assign initial object IDs to bboxes from first image
-    for idx, bbox in enumerate(all_bboxes[0]):
-        bbox_to_object_id[(0, idx)] = object_id_counter
-        object_tracks[object_id_counter].append((0, bbox))
-        object_id_counter += 1
-
-    # Step 4: Iterate through the rest of the images and match bboxes
-    # Now match each image with all future images
-    for i in range(num_images):
-        # if i != image_with_max_bboxes:  # Skip initial assignment for the image with max bbox count
-            
-            for j in range(i + 1, num_images):
-                print(f"\nMatching Image {i} with Image {j}")
-
-                features_image1 = all_features[i]
-                features_image2 = all_features[j]
-
-                cost_matrix = compute_cost_matrix(features_image1, features_image2)
-                row_ind, col_ind = linear_sum_assignment(cost_matrix)
-
-                for idx1, idx2 in zip(row_ind, col_ind):
-                    key_i = (i, idx1)
-                    key_j = (j, idx2)
-
-                    # If bbox from image i is already assigned an object ID
-                    if key_i in bbox_to_object_id:
-                        object_id = bbox_to_object_id[key_i]
-                    else:
-                        # New object
-                        object_id = object_id_counter
-                        object_id_counter += 1
-                        bbox_to_object_id[key_i] = object_id
-                        object_tracks[object_id].append((i, all_bboxes[i][idx1]))
-
-                    # # Assign the same object ID to the matched bbox in image j
-                    if key_j not in bbox_to_object_id:
-                        bbox_to_object_id[key_j] = object_id
-                        object_tracks[object_id].append((j, all_bboxes[j][idx2]))
+        # Step 4: Seed object IDs from the first image and match bboxes over the candidate pairs
+        object_tracks, bbox_to_object_id = build_object_tracks(all_features, all_bboxes, pairs, metric)
 
     # --- Save the results ---
-    def save_yolo_format(image, object_tracks, output_dir, all_bboxes):
-        """
-        Save object detection results in YOLO format (both image and label files).
-        
-        Arguments:
-        - image: The image file path.
-        - object_tracks: A dictionary of object tracks with object IDs.
-        - output_dir: Directory to save the images and labels.
-        - all_bboxes: List of bounding boxes for each image, corresponding to the reordered images.
-        """
-        
-        # Ensure the output directory exists
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Get the image name without extension
-        image_name = os.path.splitext(os.path.basename(image))[0]
-        
-        # Load the image to get its dimensions
-        img = cv2.imread(image)  # OpenCV can be used to load images
-        height, width, _ = img.shape
-        
-        # Get the index of the image from the reordered list
-        image_idx = all_images.index(image)
-
-        # Open the label file for this image
-        label_file_path = os.path.join(output_dir, f"{image_name}.txt")
-        with open(label_file_path, 'w') as label_file:
-            
-            # Loop over each object ID and its bounding boxes across all images
-            for object_id, track in object_tracks.items():
-                for img_idx, bbox in track:
-                    # Only save bounding boxes that correspond to this image
-                    if img_idx == image_idx:
-                        # Convert bbox coordinates from (x_min, y_min, x_max, y_max) to YOLO format
-                        x_min, y_min, x_max, y_max = bbox
-                        
-                        # Normalize the bounding box coordinates
-                        x_center = (x_min + x_max) / 2 / width
-                        y_center = (y_min + y_max) / 2 / height
-                        w = (x_max - x_min) / width
-                        h = (y_max - y_min) / height
-                        
-                        
-                        # Write the bounding box to the label file in YOLO format
-                        label_file.write(f"{object_id} {x_center} {y_center} {w} {h}\n")
-
-    for image in all_images:
-        save_yolo_format(image, object_tracks, OUTPUT_DIR, all_bboxes)
\ No newline at end of file
+    save_yolo_format(all_images, object_tracks, OUTPUT_DIR, all_sizes)
@@ -0,0 +1,91 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
+from collections import defaultdict
+
+# Supported distances for the label matching cost matrix
+METRICS = ("euclidean", "cosine")
+
+
+def pairwise_distances(features1, features2, metric="euclidean"):
+    """
+    Compute the (len(features1), len(features2)) distance matrix between two stacks
+    of feature vectors with scipy's cdist, which evaluates every pair exactly
+    (no expanded-norm shortcut that could reorder near ties).
+
+    - euclidean: ||f1 - f2||
+    - cosine: 1 - cos(f1, f2), zero vectors get a distance of 1 to everything
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+
+    if len(features1) == 0 or len(features2) == 0:
+        return np.zeros((len(features1), len(features2)))
+
+    features1 = np.asarray(features1, dtype=np.float64).reshape(len(features1), -1)
+    features2 = np.asarray(features2, dtype=np.float64).reshape(len(features2), -1)
+
+    if metric == "cosine":
+        # cdist leaves the cosine distance of zero vectors undefined
+        zero1 = ~features1.any(axis=1)
+        zero2 = ~features2.any(axis=1)
+        distances = cdist(np.where(zero1[:, None], 1.0, features1), np.where(zero2[:, None], 1.0, features2), "cosine")
+        distances[zero1] = 1.0
+        distances[:, zero2] = 1.0
+        return distances
+
+    return cdist(features1, features2, "euclidean")
+
+
+def build_object_tracks(all_features, all_bboxes, pairs, metric="euclidean"):
+    """
+    Link bounding boxes across images into object tracks with Hungarian matching.
+
+    Bboxes of image 0 seed the first object IDs, then every (i, j) pair in `pairs`
+    (processed in order) propagates IDs from image i to unassigned bboxes of image j.
+
+    Returns (object_tracks, bbox_to_object_id) where object_tracks maps
+    object_id -> list of (image_idx, bbox) and bbox_to_object_id maps
+    (image_idx, bbox_idx) -> object_id.
+    """
+    # Track object IDs and which bbox belongs to which object
+    bbox_to_object_id = dict()
+    object_id_counter = 0
+
+    # Final output: object_id -> list of (image_idx, bbox coordinates)
+    object_tracks = defaultdict(list)
+
+    # Assign initial object IDs to bboxes from first image
+    for idx, bbox in enumerate(all_bboxes[0]):
+        bbox_to_object_id[(0, idx)] = object_id_counter
+        object_tracks[object_id_counter].append((0, bbox))
+        object_id_counter += 1
+
+    for i, j in pairs:
+        # Nothing to match if either image has no detections
+        if len(all_features[i]) == 0 or len(all_features[j]) == 0:
+            continue
+
+        cost_matrix = pairwise_distances(all_features[i], all_features[j], metric)
+        row_ind, col_ind = linear_sum_assignment(cost_matrix)
+
+        for idx1, idx2 in zip(row_ind, col_ind):
+            key_i = (i, idx1)
+            key_j = (j, idx2)
+
+            # If bbox from image i is already assigned an object ID
+            if key_i in bbox_to_object_id:
+                object_id = bbox_to_object_id[key_i]
+            else:
+                # New object
+                object_id = object_id_counter
+                object_id_counter += 1
+                bbox_to_object_id[key_i] = object_id
+                object_tracks[object_id].append((i, all_bboxes[i][idx1]))
+
+            # Assign the same object ID to the matched bbox in image j
+            if key_j not in bbox_to_object_id:
+                bbox_to_object_id[key_j] = object_id
+                object_tracks[object_id].append((j, all_bboxes[j][idx2]))
+
+    return object_tracks, bbox_to_object_id
@@ -0,0 +1,126 @@
+from ultralytics import RTDETR
+import torch
+import numpy as np
+import threading
+import resource
+import time
+
+import torchvision.models as models
+import torchvision.transforms as transforms
+
+from pathlib import Path
+
+# Get the current working directory
+BASE_PATH = Path(__file__).resolve().parent
+
+# Define all constants here
+MODEL_CKPT = BASE_PATH / 'model' / 'object_detection_model.pt'
+
+# --- Process-wide model registry ---
+# Models are loaded once per process (lazily or via warm_up_models) and shared by
+# every image, session and websocket connection handled by that process.
+_lock = threading.Lock()
+_registry = {}
+_stats = {}
+
+
+def get_device():
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+def _load_once(name, loader):
+    # Double-checked so concurrent callers never load the same weights twice
+    model = _registry.get(name)
+    if model is not None:
+        return model
+
+    with _lock:
+        model = _registry.get(name)
+        if model is None:
+            start = time.perf_counter()
+            model = loader()
+            _stats[name] = {"load_seconds": time.perf_counter() - start}
+            _registry[name] = model
+    return model
+
+
+def _load_detector():
+    model = RTDETR(MODEL_CKPT)
+    model.to(get_device())
+    return model
+
+
+def _load_feature_extractor():
+    feature_extractor_model = models.resnet18(pretrained=True)
+    feature_extractor_model = torch.nn.Sequential(*list(feature_extractor_model.children())[:-1])  # Remove final layer
+    feature_extractor_model.eval()
+    feature_extractor_model.to(get_device())
+    return feature_extractor_model
+
+
+def get_detector():
+    """Return the shared RT-DETR detector, loading it on first use."""
+    return _load_once("detector", _load_detector)
+
+
+def get_feature_extractor():
+    """Return the shared ResNet-18 backbone (classifier removed), loading it on first use."""
+    return _load_once("feature_extractor", _load_feature_extractor)
+
+
+def get_transform():
+    """Return the preprocessing applied to every crop before feature extraction."""
+    return _load_once("transform", lambda: transforms.Compose([
+        transforms.ToPILImage(),
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+    ]))
+
+
+def warm_up_models(image_size=640):
+    """
+    Load both models and run one dummy forward pass through each so the first real
+    request does not pay for lazy initialisation (weight loading, kernel selection).
+    """
+    device = get_device()
+    detector = get_detector()
+    feature_extractor = get_feature_extractor()
+
+    start = time.perf_counter()
+    dummy_image = np.zeros((image_size, image_size, 3), dtype=np.uint8)
+    detector.predict(source=dummy_image, save=False, verbose=False)
+    _stats["detector"]["warm_up_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        feature_extractor(torch.zeros((1, 3, 224, 224), device=device))
+    _stats["feature_extractor"]["warm_up_seconds"] = time.perf_counter() - start
+
+    return model_stats()
+
+
+def _parameter_bytes(module):
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def model_stats():
+    """Report which models are loaded in this process, their load/warm-up times and memory use."""
+    stats = {"device": str(get_device()), "models": {}}
+
+    for name in ("detector", "feature_extractor"):
+        model = _registry.get(name)
+        entry = {"loaded": model is not None}
+        if model is not None:
+            module = model.model if name == "detector" else model
+            entry.update(_stats.get(name, {}))
+            entry["parameter_bytes"] = _parameter_bytes(module)
+        stats["models"][name] = entry
+
+    # ru_maxrss is reported in kilobytes on Linux
+    stats["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    if torch.cuda.is_available():
+        stats["cuda_memory_allocated"] = torch.cuda.memory_allocated()
+        stats["cuda_memory_reserved"] = torch.cuda.memory_reserved()
+
+    return stats
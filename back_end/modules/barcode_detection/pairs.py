@@ -0,0 +1,147 @@
+import os
+import re
+import numpy as np
+
+from ..path_generation.metadata import ImageIndex
+from ..path_generation.geodesy import geodetic_to_ecef
+
+# Candidate image pair strategies for label matching
+PAIR_MODES = ("exhaustive", "sequential", "gps", "descriptor")
+# GPS neighbours scale to large flights; images without GPS fall back to capture order
+DEFAULT_PAIR_MODE = os.getenv("PAIR_MODE", "gps")
+
+# DJI_<YYYYMMDDhhmmss>_<sequence>_<suffix>
+DJI_FILENAME_PATTERN = re.compile(r"DJI_(\d{14})_(\d+)")
+
+
+def exhaustive_pairs(num_images):
+    """Every image against every later image: N * (N - 1) / 2 pairs."""
+    return [(i, j) for i in range(num_images) for j in range(i + 1, num_images)]
+
+
+def capture_order(image_paths):
+    """
+    Order images by capture time and sequence number parsed from DJI filenames.
+    Images with other names are ordered by filename after the DJI ones.
+    """
+    def key(idx):
+        name = os.path.basename(image_paths[idx])
+        match = DJI_FILENAME_PATTERN.search(name)
+        if match:
+            return (0, match.group(1), int(match.group(2)), name)
+        return (1, "", 0, name)
+
+    return sorted(range(len(image_paths)), key=key)
+
+
+def sequential_pairs(image_paths, window=3):
+    """Pair each image with the next `window` images in capture order."""
+    order = capture_order(image_paths)
+    pairs = set()
+    for pos, i in enumerate(order):
+        for j in order[pos + 1:pos + 1 + window]:
+            pairs.add((min(i, j), max(i, j)))
+    return sorted(pairs)
+
+
+def nearest_neighbour_pairs(points, k, max_distance=None):
+    """
+    Pair each point with its k nearest neighbours (optionally within max_distance),
+    using a dense distance matrix, which is cheap for a few thousand images.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    n = len(points)
+    if n < 2:
+        return []
+
+    sq = np.einsum('ij,ij->i', points, points)
+    dist = np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2.0 * (points @ points.T), 0))
+    np.fill_diagonal(dist, np.inf)
+
+    k = min(k, n - 1)
+    neighbours = np.argpartition(dist, k - 1, axis=1)[:, :k]
+
+    pairs = set()
+    for i in range(n):
+        for j in neighbours[i]:
+            if max_distance is not None and dist[i, j] > max_distance:
+                continue
+            pairs.add((min(i, int(j)), max(i, int(j))))
+    return pairs
+
+
+def gps_pairs(image_paths, k=8, max_distance=None, window=3):
+    """
+    Pair images whose EXIF GPS positions are among each other's k nearest
+    neighbours (and within max_distance metres if given). Images without GPS fall
+    back to capture-order adjacency.
+    """
+    # One index per folder, read from the metadata built at upload time
+    indexes = {}
+    gps = []
+    with_gps = []
+    for idx, path in enumerate(image_paths):
+        folder = os.path.dirname(path)
+        if folder not in indexes:
+            indexes[folder] = ImageIndex.open(folder or ".")
+        try:
+            gps.append(indexes[folder].gps(path))
+        except KeyError:
+            continue
+        with_gps.append(idx)
+    positions = geodetic_to_ecef(*np.array(gps).reshape(-1, 3).T)
+
+    pairs = set()
+    for a, b in nearest_neighbour_pairs(positions, k, max_distance):
+        i, j = with_gps[a], with_gps[b]
+        pairs.add((min(i, j), max(i, j)))
+
+    missing = set(range(len(image_paths))) - set(with_gps)
+    if missing:
+        print(f"No GPS for {len(missing)} images, pairing them by capture order")
+        for i, j in sequential_pairs(image_paths, window):
+            if i in missing or j in missing:
+                pairs.add((i, j))
+
+    return sorted(pairs)
+
+
+def descriptor_pairs(all_features, k=8):
+    """
+    Pair images whose global descriptors (L2-normalised mean of their crop
+    embeddings) are among each other's k nearest neighbours. Images without any
+    detections have nothing to match and are left out.
+    """
+    indices = [i for i, features in enumerate(all_features) if len(features) > 0]
+    if len(indices) < 2:
+        return []
+
+    descriptors = np.stack([np.asarray(all_features[i], dtype=np.float64).mean(axis=0) for i in indices])
+    norms = np.linalg.norm(descriptors, axis=1, keepdims=True)
+    descriptors /= np.where(norms == 0, 1, norms)
+
+    pairs = set()
+    for a, b in nearest_neighbour_pairs(descriptors, k):
+        i, j = indices[a], indices[b]
+        pairs.add((min(i, j), max(i, j)))
+    return sorted(pairs)
+
+
+def candidate_pairs(mode, image_paths, all_features, k=8, max_distance=None, window=3):
+    """
+    Return the sorted (i, j), i < j, image pairs to run label matching on.
+
+    - exhaustive: all pairs (reference behaviour, O(N^2))
+    - sequential: capture-time adjacency from DJI filenames, `window` images ahead
+    - gps: k nearest EXIF GPS neighbours, optionally within `max_distance` metres
+    - descriptor: k nearest neighbours by global crop-embedding descriptor
+    """
+    if mode == "exhaustive":
+        return exhaustive_pairs(len(image_paths))
+    if mode == "sequential":
+        return sequential_pairs(image_paths, window)
+    if mode == "gps":
+        return gps_pairs(image_paths, k, max_distance, window)
+    if mode == "descriptor":
+        return descriptor_pairs(all_features, k)
+    raise ValueError(f"Unknown pair mode '{mode}', expected one of {PAIR_MODES}")
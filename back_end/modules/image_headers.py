@@ -0,0 +1,70 @@
+import struct
+
+import cv2
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic)
+SOF_MARKERS = (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF)
+APP1_MARKER = 0xE1
+SOS_MARKER = 0xDA
+
+
+def read_jpeg_header(f):
+    """
+    Walk the JPEG marker segments of an open file (positioned after SOI) up to the
+    scan data. Returns (app1, size): the raw Exif APP1 payload (or None) and
+    (height, width) from the start-of-frame header (or None). Everything but the
+    APP1 segment is skipped with a seek, so the pixel data is never read.
+    """
+    app1, size = None, None
+    while size is None or app1 is None:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] == SOS_MARKER:
+            break
+        # Fill bytes and standalone markers carry no length
+        if marker[1] == 0xFF:
+            f.seek(-1, 1)
+            continue
+        if marker[1] in (0x01, 0xD8) or 0xD0 <= marker[1] <= 0xD7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if marker[1] in SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', f.read(5))
+            size = (height, width)
+            f.seek(length - 7, 1)
+        elif marker[1] == APP1_MARKER and app1 is None:
+            payload = f.read(length - 2)
+            # XMP also lives in APP1; only the Exif one is parsed
+            if payload.startswith(b"Exif\x00\x00"):
+                app1 = payload
+        else:
+            f.seek(length - 2, 1)
+    return app1, size
+
+
+def read_image_header(image_path):
+    """(app1, size) of an image from its headers; see read_jpeg_header. PNGs carry no Exif here."""
+    with open(image_path, 'rb') as f:
+        head = f.read(2)
+        if head == b'\xff\xd8':
+            return read_jpeg_header(f)
+        if head == b'\x89P':
+            data = f.read(22)
+            if data[:6] == b'NG\r\n\x1a\n' and data[10:14] == b'IHDR':
+                width, height = struct.unpack('>II', data[14:22])
+                return None, (height, width)
+    return None, None
+
+
+def read_image_size(image_path):
+    """
+    Return (height, width) from the JPEG SOF or PNG IHDR header without decoding
+    the pixels, falling back to a full decode for anything else.
+    """
+    _, size = read_image_header(image_path)
+    if size is not None:
+        return size
+
+    img = cv2.imread(str(image_path))
+    if img is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    return img.shape[:2]
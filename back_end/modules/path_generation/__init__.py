@@ -1 +1,6 @@
-from .main import generate_kmz
\ No newline at end of file
+from .main import generate_kmz, TRIANGULATION_REPORT
+from .workspace import Workspace, collect_garbage
+from .sfm_matching import SFM_MATCHING_MODES
+from .route import ROUTE_OBJECTIVES
+from .dji_exporter import KMZ_FILENAME, MISSIONS_FILENAME
+from .metadata import ImageIndex, METADATA_FILE
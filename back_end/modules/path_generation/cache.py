@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pycolmap
+
+from .utils import OUTPUT_DIR
+from .priors import PriorFrame
+from .metadata import ImageIndex
+
+# Finished reconstructions, keyed by the content of the image set they were built from
+RECONSTRUCTION_CACHE_DIR = OUTPUT_DIR / "reconstruction_cache"
+
+# Number of cached reconstructions kept; the least recently used are dropped first
+RECONSTRUCTION_CACHE_ENTRIES = int(os.getenv("RECONSTRUCTION_CACHE_ENTRIES", "16"))
+
+MANIFEST_FILE = "images.json"
+# Options the entry's database and model were built with; entries are only reused under the same ones
+SETTINGS_FILE = "settings.json"
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def image_manifest(image_path, workers=8):
+    """
+    Map every image name in a folder to the sha256 of its content. Digests are
+    kept in the folder's ImageIndex, so only images added or modified since they
+    were last hashed (or seeded from the upload's blob hashes) are read.
+    """
+    index = ImageIndex.open(image_path)
+    names = sorted(index.entries)
+    unhashed = [name for name in names if index.entries[name].get("sha256") is None]
+    if unhashed:
+        # hashlib releases the GIL, so hashing scales with threads
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            hashes = pool.map(file_sha256, [os.path.join(image_path, name) for name in unhashed])
+        index.add_digests(dict(zip(unhashed, hashes)))
+    return {name: index.entries[name]["sha256"] for name in names}
+
+
+def manifest_key(manifest, settings=None):
+    digest = hashlib.sha256()
+    for name in sorted(manifest):
+        digest.update(f"{name}\0{manifest[name]}\n".encode())
+    if settings is not None:
+        digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.database_path = self.root / "database.db"
+        self.model_path = self.root / "model"
+
+    @property
+    def manifest(self):
+        with open(self.root / MANIFEST_FILE) as f:
+            return json.load(f)
+
+    @property
+    def settings(self):
+        try:
+            with open(self.root / SETTINGS_FILE) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load(self):
+        self.touch()
+        return pycolmap.Reconstruction(self.model_path)
+
+    def restore_database(self, database_path):
+        """Copy the cached feature database into a workspace, to extend it with new images."""
+        self.touch()
+        shutil.copyfile(self.database_path, database_path)
+        # Keep the pose prior frame, so new priors line up with the cached model
+        if PriorFrame.path_for(self.database_path).exists():
+            shutil.copyfile(PriorFrame.path_for(self.database_path), PriorFrame.path_for(database_path))
+
+    def touch(self):
+        # The directory mtime is the last-used time for eviction
+        os.utime(self.root)
+
+
+class ReconstructionCache:
+    """
+    Cache of COLMAP feature databases and sparse models, keyed by the content hashes
+    of the image set and the settings (matching strategy, pose priors) they were
+    built with.
+
+    lookup() returns an exact match when the same images were reconstructed before,
+    otherwise the largest cached set the request contains, so only the new images
+    need features, matches and registration.
+    """
+
+    def __init__(self, root=RECONSTRUCTION_CACHE_DIR, max_entries=RECONSTRUCTION_CACHE_ENTRIES):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def entries(self):
+        for path in self.root.iterdir():
+            if path.is_dir() and (path / MANIFEST_FILE).exists():
+                yield CacheEntry(path)
+
+    def lookup(self, manifest, settings=None):
+        """
+        Find the cached reconstruction to start from, among those built with the
+        same settings.
+
+        Returns (entry, new_images): entry is None on a miss, and new_images lists the
+        images of `manifest` the entry does not contain yet (empty on an exact hit).
+        """
+        exact = CacheEntry(self.root / manifest_key(manifest, settings))
+        if (exact.model_path / "images.bin").exists():
+            return exact, []
+
+        best, best_size = None, 0
+        for entry in self.entries():
+            try:
+                cached = entry.manifest
+            except (OSError, ValueError):
+                continue
+            # Only reusable if built the same way and every cached image is part of this set, unchanged
+            if entry.settings != settings:
+                continue
+            if len(cached) > best_size and all(manifest.get(name) == sha for name, sha in cached.items()):
+                best, best_size = entry, len(cached)
+
+        if best is None:
+            return None, list(manifest)
+        cached = best.manifest
+        return best, [name for name in manifest if name not in cached]
+
+    def store(self, manifest, database_path, reconstruction, settings=None):
+        """Add a finished reconstruction, built with settings, to the cache."""
+        target = self.root / manifest_key(manifest, settings)
+        if target.exists():
+            CacheEntry(target).touch()
+            return target
+
+        # Build in a temporary folder and rename, so readers never see a partial entry
+        staging = self.root / f".{uuid.uuid4().hex}"
+        entry = CacheEntry(staging)
+        entry.model_path.mkdir(parents=True)
+        shutil.copyfile(database_path, entry.database_path)
+        if PriorFrame.path_for(database_path).exists():
+            shutil.copyfile(PriorFrame.path_for(database_path), PriorFrame.path_for(entry.database_path))
+        reconstruction.write(entry.model_path)
+        with open(staging / SETTINGS_FILE, "w") as f:
+            json.dump(settings, f)
+        with open(staging / MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f)
+
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another worker stored the same image set first
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.prune()
+        return target
+
+    def prune(self):
+        entries = sorted(self.entries(), key=lambda entry: entry.root.stat().st_mtime, reverse=True)
+        for entry in entries[self.max_entries:]:
+            shutil.rmtree(entry.root, ignore_errors=True)
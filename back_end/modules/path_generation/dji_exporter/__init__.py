@@ -1 +1 @@
-from .kmz_gen import waypoints_to_kmz
\ No newline at end of file
+from .kmz_gen import waypoints_to_kmz, build_kmz, missions_to_zip, KMZ_FILENAME, MISSIONS_FILENAME
@@ -1,5 +1,9 @@
-import zipfile
+import io
+import json
 import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from .lib import *
 
@@ -13,52 +17,133 @@ TEMPLATE_WAYLINES_FILE = TEMPLATE_KML_PATH / "wpmz" / "waylines.wpml"
 
 OUTPUT_PATH = BASE_DIR / "wpmz"
 
-KMZ_FINAL_FILE = BASE_DIR / "output" / "Group14.kmz"
+# Mission file name, and the folder its KML/WPML files live in inside the archive
+KMZ_FILENAME = "Group14.kmz"
+KMZ_FOLDER = "wpmz"
+KMZ_FINAL_FILE = BASE_DIR / "output" / KMZ_FILENAME
+
+AUTHOR_NAME = "Binh Pham"
+
+# Bundle of a route split into several missions, and the manifest describing them inside it
+MISSIONS_FILENAME = "missions.zip"
+MISSIONS_MANIFEST = "manifest.json"
 
-# Read in template KML
+# Missions built at once (the zlib compression releases the GIL)
+MISSION_WORKERS = int(os.getenv("MISSION_WORKERS", "4"))
+
+# Read in and parse the templates once; every mission reuses the trees
 with open(TEMPLATE_KML_FILE, "r", encoding="utf-8") as f:
-    kml_template = f.read()
+    kml_template = DjiTemplate(f.read())
 
 with open(TEMPLATE_WAYLINES_FILE, "r", encoding="utf-8") as f:
-    waylines_template = f.read()
+    waylines_template = DjiTemplate(f.read())
+
+def render_dji_files(waypoints, author_name=AUTHOR_NAME):
+    """The archive members of a mission: {name: encoded content}."""
+    return {
+        "template.kml": kml_template.render(waypoints, author_name),
+        "waylines.wpml": waylines_template.render(waypoints, author_name),
+    }
+
+def zip_to_kmz(files, fileobj):
+    """Zip rendered mission files into a binary file object (file, BytesIO, stream)."""
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as kmz:
+        for name, data in files.items():
+            kmz.writestr(f"{KMZ_FOLDER}/{name}", data)
 
-def generate_dji_files_from_waypoints(waypoints, output_path):
-    kml_data = edit_dji_kml_placemarks(kml_template, waypoints, "Binh Pham")
-    waylines_data = edit_dji_kml_placemarks(waylines_template, waypoints, "Binh Pham")
-    save_kml(kml_data, output_path / "template.kml")
-    save_kml(waylines_data, output_path / "waylines.wpml")
+def build_kmz(waypoints, author_name=AUTHOR_NAME):
+    """The mission KMZ of waypoints as bytes, built in memory."""
+    buffer = io.BytesIO()
+    zip_to_kmz(render_dji_files(waypoints, author_name), buffer)
+    return buffer.getvalue()
 
-def zip_to_kmz(output_path, folder_name):
-    with zipfile.ZipFile(output_path / "Group14.kmz", 'w', zipfile.ZIP_DEFLATED) as kmz:
-        for file_path in output_path.glob("*"):
-            kmz.write(file_path, arcname=f"{folder_name}/{file_path.name}")
+def waypoints_to_kmz(waypoints, output_path=None, filename=KMZ_FILENAME, save_files=False):
+    """
+    Build the mission KMZ of waypoints in memory and return its bytes. With
+    output_path, it is also saved there as filename (replaced atomically, so a
+    download never sees a half-written file); save_files additionally writes the
+    loose template.kml and waylines.wpml next to it.
+    """
+    files = render_dji_files(waypoints)
+    buffer = io.BytesIO()
+    zip_to_kmz(files, buffer)
+    data = buffer.getvalue()
+    if output_path is None:
+        return data
 
-def waypoints_to_kmz(waypoints, output_path):
-    generate_dji_files_from_waypoints(waypoints, output_path)
-    zip_to_kmz(output_path, "wpmz")
+    output_path = Path(output_path)
+    kmz_path = output_path / filename
+    write_atomic(kmz_path, data)
 
-    print(f"KMZ file generated at: {output_path / 'Group14.kmz'}")
+    if save_files:
+        for name, content in files.items():
+            (output_path / name).write_bytes(content)
+
+    print(f"KMZ file generated at: {kmz_path}")
+    return data
+
+def write_atomic(path, data):
+    # A unique temporary name, so concurrent writers of the same file don't share one
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def mission_filename(index):
+    return f"mission_{index + 1:02d}.kmz"
+
+def missions_to_zip(missions, output_path, details=None, filename=MISSIONS_FILENAME):
+    """
+    Build one KMZ per mission (a list of waypoint lists) in parallel and bundle
+    them into a zip at output_path / filename, with a manifest.json listing each
+    mission's file and waypoint count, extended by details (one dict per
+    mission). Returns the manifest.
+    """
+    with ThreadPoolExecutor(MISSION_WORKERS) as pool:
+        kmzs = list(pool.map(build_kmz, missions))
+
+    details = details if details is not None else [{} for _ in missions]
+    manifest = {"missions": [
+        {"mission": index + 1, "filename": mission_filename(index), "num_waypoints": len(waypoints), **detail}
+        for index, (waypoints, detail) in enumerate(zip(missions, details))
+    ]}
+    buffer = io.BytesIO()
+    # The KMZs are compressed already
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as bundle:
+        bundle.writestr(MISSIONS_MANIFEST, json.dumps(manifest, indent=2))
+        for index, data in enumerate(kmzs):
+            bundle.writestr(mission_filename(index), data)
+
+    bundle_path = Path(output_path) / filename
+    write_atomic(bundle_path, buffer.getvalue())
+    print(f"{len(missions)} mission KMZs bundled at: {bundle_path}")
+    return manifest
 
 # If main
 if __name__ == "__main__":
     # Define waypoints with actions
     input_waypoints = [
         {
-            'lat': 1, 
-            'lng': 2, 
+            'lat': 1,
+            'lng': 2,
             'alt': 3,
         },
         {
-            'lat':4, 
-            'lng': 5, 
+            'lat':4,
+            'lng': 5,
             'alt': 6,
         },
         {
-            'lat': 7, 
-            'lng': 8, 
+            'lat': 7,
+            'lng': 8,
             'alt': 9,
         }
     ]
-    
+
     # Create output directory if it doesn't exist
-    waypoints_to_kmz(input_waypoints, OUTPUT_PATH)
\ No newline at end of file
+    OUTPUT_PATH.mkdir(exist_ok=True)
+    waypoints_to_kmz(input_waypoints, OUTPUT_PATH, save_files=True)
@@ -1,162 +1,139 @@
 import xml.etree.ElementTree as ET
 from zipfile import ZipFile
 import copy
+import re
+import threading
+from xml.sax.saxutils import escape
 from datetime import datetime
 from typing import List, Dict, Any
 
-def edit_dji_kml_placemarks(kml_string, waypoints, author_name="Binh Pham"):
+NAMESPACES = {'kml': 'http://www.opengis.net/kml/2.2',
+              'wpml': 'http://www.dji.com/wpmz/1.0.6'}
+
+
+class DjiTemplate:
     """
-    Edit only the Placemark elements in a DJI KML file with new waypoints and actions,
-    preserving all other elements and their values (including takeoff reference point)
-    
+    A DJI template KML/WPML parsed once and reused for every mission.
+
+    The Document, the waypoint Folder and the Placemark cloned per waypoint are
+    looked up when the template is loaded, and the template's own Placemarks are
+    removed from the tree. render() fills in the author, timestamps and new
+    Placemarks, serializes, and takes the Placemarks out again.
+
     Parameters:
     -----------
     kml_string : str
         XML string content of the template KML file
-    waypoints : list of dict
-        List of waypoint dictionaries with format:
-        [{
-            'lat': 48.123, 
-            'lng': 11.456, 
-            'height': 20,  # optional
-        }, ...]
-    author_name : str
-        Name of the author to set in the KML file
-        
-    Returns:
-    --------
-    str
-        Modified KML file content as a string
     """
-    # Parse the KML XML
-    root = ET.fromstring(kml_string)
-    
-    # Register namespaces
-    ns = {'kml': 'http://www.opengis.net/kml/2.2', 
-          'wpml': 'http://www.dji.com/wpmz/1.0.6'}
-    for prefix, uri in ns.items():
-        ET.register_namespace(prefix if prefix != 'kml' else '', uri)
-    
-    # Update author and timestamps
-    now = int(datetime.now().timestamp() * 1000)  # Current time in milliseconds
-    
-    # Find the Document element - try with namespace first, then without
-    document = None
-    if root.tag.endswith('kml'):
-        document = root.find('./kml:Document', ns)
+
+    def __init__(self, kml_string):
+        # Parse the KML XML
+        root = ET.fromstring(kml_string)
+        ns = NAMESPACES
+
+        # Register namespaces
+        for prefix, uri in ns.items():
+            ET.register_namespace(prefix if prefix != 'kml' else '', uri)
+
+        # Find the Document element - try with namespace first, then without
+        document = None
+        if root.tag.endswith('kml'):
+            document = root.find('./kml:Document', ns)
+            if document is None:
+                document = root.find('./Document')
+        else:
+            document = root
+
         if document is None:
-            document = root.find('./Document')
-    else:
-        document = root
-    
-    if document is None:
-        raise ValueError("Invalid KML structure: Document element not found")
-    
-    # Update author
-    author_elem = document.find('./wpml:author', ns)
-    if author_elem is not None:
-        author_elem.text = author_name
-    
-    # Update timestamps
-    create_time = document.find('./wpml:createTime', ns)
-    update_time = document.find('./wpml:updateTime', ns)
-    if create_time is not None:
-        create_time.text = str(now)
-    if update_time is not None:
-        update_time.text = str(now)
-    
-    # Find the Folder containing waypoints - try multiple approaches
-    folder = None
-    
-    # Try with namespace first
-    folder = document.find('./kml:Folder', ns)
-    
-    # Then try without namespace
-    if folder is None:
-        folder = document.find('./Folder')
-    
-    # If still not found, try all children to find a Folder element
-    if folder is None:
-        for child in document:
-            if child.tag.endswith('Folder'):
-                folder = child
-                break
-    
-    if folder is None:
-        raise ValueError("Invalid KML structure: Folder element not found")
-    
-    # Get the template placemark for cloning - try multiple approaches
-    template_placemark = None
-    
-    # Try with namespace
-    template_placemark = folder.find('./kml:Placemark', ns)
-    
-    # Try without namespace
-    if template_placemark is None:
-        template_placemark = folder.find('./Placemark')
-    
-    # Try direct children
-    if template_placemark is None:
-        for child in folder:
+            raise ValueError("Invalid KML structure: Document element not found")
+
+        # Find the Folder containing waypoints - try multiple approaches
+        folder = None
+
+        # Try with namespace first
+        folder = document.find('./kml:Folder', ns)
+
+        # Then try without namespace
+        if folder is None:
+            folder = document.find('./Folder')
+
+        # If still not found, try all children to find a Folder element
+        if folder is None:
+            for child in document:
+                if child.tag.endswith('Folder'):
+                    folder = child
+                    break
+
+        if folder is None:
+            raise ValueError("Invalid KML structure: Folder element not found")
+
+        # Get the template placemark for cloning - try multiple approaches
+        template_placemark = None
+
+        # Try with namespace
+        template_placemark = folder.find('./kml:Placemark', ns)
+
+        # Try without namespace
+        if template_placemark is None:
+            template_placemark = folder.find('./Placemark')
+
+        # Try direct children
+        if template_placemark is None:
+            for child in folder:
+                if child.tag.endswith('Placemark'):
+                    template_placemark = child
+                    break
+
+        if template_placemark is None:
+            raise ValueError("Invalid KML structure: No Placemark found to use as template")
+
+        # Get global height setting
+        global_height_elem = folder.find('./wpml:globalHeight', ns)
+        global_height = 20  # Default
+        if global_height_elem is not None:
+            try:
+                global_height = float(global_height_elem.text)
+            except:
+                pass
+
+        # Remove all existing Placemarks; render() appends the new ones after the remaining children
+        for child in list(folder):
             if child.tag.endswith('Placemark'):
-                template_placemark = child
-                break
-    
-    if template_placemark is None:
-        raise ValueError("Invalid KML structure: No Placemark found to use as template")
-    
-    # Get global height setting
-    global_height_elem = folder.find('./wpml:globalHeight', ns)
-    global_height = 20  # Default
-    if global_height_elem is not None:
-        try:
-            global_height = float(global_height_elem.text)
-        except:
-            pass
-    
-    # Find all existing Placemarks using multiple approaches
-    existing_placemarks = []
-    
-    # Try with namespace
-    ns_placemarks = folder.findall('./kml:Placemark', ns)
-    if ns_placemarks:
-        existing_placemarks.extend(ns_placemarks)
-    
-    # Try without namespace
-    non_ns_placemarks = folder.findall('./Placemark')
-    if non_ns_placemarks:
-        existing_placemarks.extend([p for p in non_ns_placemarks if p not in existing_placemarks])
-    
-    # Try direct children
-    for child in folder:
-        if child.tag.endswith('Placemark') and child not in existing_placemarks:
-            existing_placemarks.append(child)
-    
-    # Remove all existing Placemarks
-    for placemark in existing_placemarks:
-        folder.remove(placemark)
-    
-    # Add new placemarks for each waypoint
-    for idx, waypoint in enumerate(waypoints):
-        new_placemark = copy.deepcopy(template_placemark)
-        
+                folder.remove(child)
+
+        self.root = root
+        self.folder = folder
+        self.template_placemark = template_placemark
+        self.global_height = global_height
+        self.author_elem = document.find('./wpml:author', ns)
+        self.create_time = document.find('./wpml:createTime', ns)
+        self.update_time = document.find('./wpml:updateTime', ns)
+        # The tree is shared between renders
+        self._lock = threading.Lock()
+        self._compiled = self.compile()
+
+    def placemark(self, idx, waypoint):
+        """A copy of the template Placemark for one waypoint."""
+        ns = NAMESPACES
+        new_placemark = copy.deepcopy(self.template_placemark)
+
         # Update coordinates - try multiple approaches
         point = None
-        
+
         # Try with namespace
         point = new_placemark.find('./kml:Point/kml:coordinates', ns)
-        
+
         # Try without namespace
         if point is None:
             point = new_placemark.find('./Point/coordinates')
-        
+
         # Try direct path
         if point is None:
             for point_elem in new_placemark.findall('.//*'):
                 if point_elem.tag.endswith('coordinates'):
                     point = point_elem
                     break
-        
+
         if point is not None:
             point.text = f"\n            {waypoint['lng']},{waypoint['lat']}\n          "
         else:
@@ -164,17 +141,17 @@ def edit_dji_kml_placemarks(kml_string, waypoints, author_name="Binh Pham"):
             point_elem = ET.SubElement(new_placemark, 'Point')
             coords_elem = ET.SubElement(point_elem, 'coordinates')
             coords_elem.text = f"\n            {waypoint['lng']},{waypoint['lat']}\n          "
-        
+
         # Update index
         index_elem = new_placemark.find('./wpml:index', ns)
         if index_elem is not None:
             index_elem.text = str(idx)
-        
+
         # Update height if provided and element exists
         height_elem = new_placemark.find('./wpml:height', ns)
         if height_elem is not None:
-            height_elem.text = str(global_height)
-        
+            height_elem.text = str(self.global_height)
+
         # Set ellipsoidHeight from waypoint['alt']
         ellipsoid_elem = new_placemark.find('./wpml:ellipsoidHeight', ns)
         if ellipsoid_elem is not None:
@@ -184,18 +161,150 @@ def edit_dji_kml_placemarks(kml_string, waypoints, author_name="Binh Pham"):
         execute_height_elem = new_placemark.find('./wpml:executeHeight', ns)
         if execute_height_elem is not None:
             execute_height_elem.text = str(waypoint['alt'])
-        
-        # Add the new placemark
-        folder.append(new_placemark)
-    
-    # Convert back to string with proper XML declaration
-    xml_declaration = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    xml_content = ET.tostring(root, encoding='utf-8', method='xml').decode('utf-8')
-    
-    # Some versions of ElementTree omit the XML declaration, so add it if needed
-    if not xml_content.startswith('<?xml'):
-        return xml_declaration + xml_content
-    return xml_content
+
+        return new_placemark
+
+    def render_tree(self, waypoints, author_name="Binh Pham", now=None):
+        """render() by filling in and serializing the element tree; the reference for compile()."""
+        if now is None:
+            now = int(datetime.now().timestamp() * 1000)  # Current time in milliseconds
+        placemarks = [self.placemark(idx, waypoint) for idx, waypoint in enumerate(waypoints)]
+        return self._serialize(placemarks, author_name, str(now))
+
+    def _serialize(self, placemarks, author_name, now):
+        with self._lock:
+            # Update author and timestamps
+            if self.author_elem is not None:
+                self.author_elem.text = author_name
+            if self.create_time is not None:
+                self.create_time.text = now
+            if self.update_time is not None:
+                self.update_time.text = now
+
+            count = len(self.folder)
+            self.folder.extend(placemarks)
+            try:
+                xml_content = ET.tostring(self.root, encoding='utf-8', method='xml')
+            finally:
+                del self.folder[count:]
+
+        # Some versions of ElementTree omit the XML declaration, so add it if needed
+        if not xml_content.startswith(b'<?xml'):
+            return b'<?xml version="1.0" encoding="UTF-8"?>\n' + xml_content
+        return xml_content
+
+    def compile(self):
+        """
+        Serialize the template once with a single Placemark whose fields hold
+        sentinel values, and cut the output into byte formats: the document head
+        up to that Placemark, the Placemark itself (with its tail) and the rest.
+        Every Placemark serializes identically apart from its fields, so a
+        mission is the head, one Placemark format filled per waypoint, and the
+        rest. Returns False (render() then uses the tree) if the output cannot
+        be cut cleanly.
+        """
+        sentinels = {field: f"@@WPML_{field.upper()}@@" for field in ("author", "now", "index", "lng", "lat", "alt")}
+        placemark = self.placemark(sentinels["index"], sentinels)
+        xml_content = self._serialize([], sentinels["author"], sentinels["now"])
+        with_placemark = self._serialize([placemark], sentinels["author"], sentinels["now"])
+
+        # Both outputs agree up to the first difference, inside the Placemark's start tag
+        common = next((i for i, (a, b) in enumerate(zip(xml_content, with_placemark)) if a != b), len(xml_content))
+        start = with_placemark.rfind(b"<", 0, common + 1)
+        if start < 0 or not re.compile(rb"<(?:[\w.-]+:)?Placemark[\s>/]").match(with_placemark, start):
+            return False
+        # Everything the Placemark added to the document, i.e. the Placemark and its tail
+        end = start + len(with_placemark) - len(xml_content)
+        pattern = re.compile(b"(" + b"|".join(re.escape(value.encode()) for value in sentinels.values()) + b")")
+        head, body, rest = with_placemark[:start], with_placemark[start:end], with_placemark[end:]
+        if head + rest != xml_content:
+            return False
+
+        def to_format(data):
+            parts = pattern.split(data)
+            fields = tuple(next(field for field, value in sentinels.items() if value.encode() == part) for part in parts[1::2])
+            return b"%s".join(part.replace(b"%", b"%%") for part in parts[::2]), fields
+
+        self._head, self._head_fields = to_format(head)
+        self._placemark, self._placemark_fields = to_format(body)
+        self._rest, self._rest_fields = to_format(rest)
+        return True
+
+    def render(self, waypoints, author_name="Binh Pham", now=None):
+        """
+        The template with one Placemark per waypoint, as UTF-8 encoded XML.
+
+        Waypoints are substituted into the Placemark compiled once per template,
+        which gives the same bytes as filling in and serializing the tree.
+
+        Parameters:
+        -----------
+        waypoints : list of dict
+            List of waypoint dictionaries with format:
+            [{
+                'lat': 48.123,
+                'lng': 11.456,
+                'alt': 20,
+            }, ...]
+        author_name : str
+            Name of the author to set in the KML file
+        now : int, optional
+            Creation/update timestamp in milliseconds, the current time by default
+
+        Returns:
+        --------
+        bytes
+            Modified KML file content
+        """
+        # Without Placemarks the namespace declarations may differ; the tree handles that case
+        if not waypoints or not self._compiled:
+            return self.render_tree(waypoints, author_name, now)
+        if now is None:
+            now = int(datetime.now().timestamp() * 1000)  # Current time in milliseconds
+
+        meta = {"author": _text(author_name), "now": _text(now)}
+        fields = self._placemark_fields
+        placemark = self._placemark
+        parts = [self._head % tuple(meta[field] for field in self._head_fields)]
+        for idx, waypoint in enumerate(waypoints):
+            values = {"index": _text(idx), "lng": _text(waypoint['lng']), "lat": _text(waypoint['lat']),
+                      "alt": _text(waypoint['alt'])}
+            parts.append(placemark % tuple(values[field] for field in fields))
+        parts.append(self._rest % tuple(meta[field] for field in self._rest_fields))
+        return b"".join(parts)
+
+
+def _text(value):
+    """A value as ElementTree serializes element text."""
+    return escape(str(value)).encode('utf-8')
+
+
+def edit_dji_kml_placemarks(kml_string, waypoints, author_name="Binh Pham"):
+    """
+    Edit only the Placemark elements in a DJI KML file with new waypoints and actions,
+    preserving all other elements and their values (including takeoff reference point)
+
+    Parameters:
+    -----------
+    kml_string : str
+        XML string content of the template KML file
+    waypoints : list of dict
+        List of waypoint dictionaries with format:
+        [{
+            'lat': 48.123,
+            'lng': 11.456,
+            'height': 20,  # optional
+        }, ...]
+    author_name : str
+        Name of the author to set in the KML file
+
+    Returns:
+    --------
+    str
+        Modified KML file content as a string
+    """
+    # Templates used repeatedly should be kept as a DjiTemplate instead of re-parsed here
+    return DjiTemplate(kml_string).render(waypoints, author_name).decode('utf-8')
 
 
 def save_kml(kml_data, output_file_path):
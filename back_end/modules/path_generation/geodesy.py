@@ -0,0 +1,100 @@
+import numpy as np
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0  # Semi-major axis (m)
+WGS84_F = 1 / 298.257223563  # Flattening
+WGS84_E2 = WGS84_F * (2 - WGS84_F)  # First eccentricity squared
+WGS84_B = WGS84_A * (1 - WGS84_F)  # Semi-minor axis (m)
+WGS84_EP2 = WGS84_E2 / (1 - WGS84_E2)  # Second eccentricity squared
+
+
+def geodetic_to_ecef(lat, lon, alt):
+    """Latitude/longitude (degrees) and ellipsoidal height (m), any matching shapes, to ECEF (..., 3)."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    alt = np.asarray(alt, dtype=np.float64)
+
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+    N = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_lat ** 2)
+
+    x = (N + alt) * cos_lat * np.cos(lon)
+    y = (N + alt) * cos_lat * np.sin(lon)
+    z = (N * (1 - WGS84_E2) + alt) * sin_lat
+    return np.stack(np.broadcast_arrays(x, y, z), axis=-1)
+
+
+def ecef_to_geodetic(ecef, iterations=2):
+    """
+    ECEF (..., 3) to latitude/longitude (degrees) and ellipsoidal height (m).
+
+    Bowring's closed-form latitude is refined by fixed-point iterations, which
+    converge linearly, shrinking the error by about a factor of e^2 (~1/150) per
+    step: after two, round trips agree to a few nanometers (float64 resolution of
+    ECEF coordinates) from the surface to 50 km. The height uses a form that
+    stays stable at the poles.
+    """
+    ecef = np.asarray(ecef, dtype=np.float64)
+    x, y, z = ecef[..., 0], ecef[..., 1], ecef[..., 2]
+
+    lon = np.arctan2(y, x)
+    p = np.hypot(x, y)
+
+    # Bowring's initial estimate
+    theta = np.arctan2(z * WGS84_A, p * WGS84_B)
+    lat = np.arctan2(z + WGS84_EP2 * WGS84_B * np.sin(theta) ** 3, p - WGS84_E2 * WGS84_A * np.cos(theta) ** 3)
+
+    for _ in range(iterations):
+        N = WGS84_A / np.sqrt(1 - WGS84_E2 * np.sin(lat) ** 2)
+        lat = np.arctan2(z + WGS84_E2 * N * np.sin(lat), p)
+
+    sin_lat = np.sin(lat)
+    N = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_lat ** 2)
+    alt = p * np.cos(lat) + z * sin_lat - WGS84_A ** 2 / N
+
+    return np.degrees(lat), np.degrees(lon), alt
+
+
+def enu_rotation(lat, lon):
+    """Rotation(s) taking ECEF vectors to the local east/north/up frame at (lat, lon): (..., 3, 3)."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_lon, cos_lon = np.sin(lon), np.cos(lon)
+    zero = np.zeros_like(lat)
+    return np.stack([
+        np.stack([-sin_lon, cos_lon, zero], axis=-1),
+        np.stack([-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat], axis=-1),
+        np.stack([cos_lat * cos_lon, cos_lat * sin_lon, sin_lat], axis=-1),
+    ], axis=-2)
+
+
+class LocalFrame:
+    """East/north/up frame tangent to the ellipsoid at a reference point."""
+
+    def __init__(self, lat, lon, alt):
+        self.lat, self.lon, self.alt = float(lat), float(lon), float(alt)
+        self.rotation = enu_rotation(self.lat, self.lon)
+        self.origin = geodetic_to_ecef(self.lat, self.lon, self.alt)
+
+    def from_ecef(self, ecef):
+        return (np.asarray(ecef, dtype=np.float64) - self.origin) @ self.rotation.T
+
+    def to_ecef(self, enu):
+        return np.asarray(enu, dtype=np.float64) @ self.rotation + self.origin
+
+    def from_geodetic(self, lat, lon, alt):
+        return self.from_ecef(geodetic_to_ecef(lat, lon, alt))
+
+    def to_geodetic(self, enu):
+        return ecef_to_geodetic(self.to_ecef(enu))
+
+
+def similarity_to_ecef(points, scale, R, t):
+    """Apply scale * R @ p + t to points (..., 3)."""
+    return scale * np.asarray(points, dtype=np.float64) @ np.asarray(R).T + np.asarray(t).reshape(3)
+
+
+def similarity_to_geodetic(points, scale, R, t):
+    """Model points (..., 3) to latitude/longitude/height through a model-to-ECEF similarity."""
+    return ecef_to_geodetic(similarity_to_ecef(points, scale, R, t))
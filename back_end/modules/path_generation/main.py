@@ -1,150 +1,264 @@
+import inspect
+import json
+
 from .utils import *
+from .workspace import Workspace
+from .cache import ReconstructionCache, image_manifest
+from .sfm_matching import match_features, DEFAULT_SFM_MATCHING
+from .triangulation import collect_observations, triangulate_points, robust_triangulate, mean_viewpoints
+from .surface import fit_surfaces
+from .geodesy import LocalFrame, geodetic_to_ecef, ecef_to_geodetic, similarity_to_ecef
+from .route import optimize_route, route_cost, split_route, mission_cost, ROUTE_TIME_BUDGET
+from .dji_exporter import missions_to_zip, MISSIONS_FILENAME
+from .metadata import ImageIndex
+from .priors import PriorFrame, write_pose_priors, initial_pair_from_priors, prior_alignment_error, PRIOR_ALIGNMENT_TOLERANCE
 
-def generate_kmz(image_path, label_path, output_path):
-    # Load images and lables
-    print("Loading images and labels...")
-    image_bbox_list = []
-    for file in os.listdir(label_path):
-        if file.endswith('.txt'):
-            img_name = file.replace('.txt', '.jpeg')
-            with open(os.path.join(label_path, file), 'r') as f:
-                bboxes = []
-                for line in f:
-                    class_id, x, y, w_, h_ = map(float, line.strip().split())
-                    bboxes.append({"class_id": int(class_id), "x_center": x, "y_center": y, "width": w_, "height": h_})
-            image_bbox_list.append((img_name, bboxes))
+# Per-label inlier counts and uncertainty, written next to the KMZ
+TRIANGULATION_REPORT = "labels.json"
+
+# Distance (meters) waypoints are kept in front of the label surfaces
+STANDOFF_DISTANCE = 0.5
+
+def generate_kmz(image_path, label_path, output_path, workspace=None, **options):
+    # Each run gets an isolated COLMAP workspace (by default one per image folder / session)
+    if workspace is None:
+        workspace = Workspace.create(Path(image_path).name)
+
+    with workspace:
+        return _generate_kmz(image_path, label_path, output_path, workspace, **options)
+
+def map_with_priors(database_path, image_path, sfm_path, input_path=None):
+    """
+    Incremental mapping with the GPS pose priors in bundle adjustment, so the model
+    comes out in the prior frame. New models start from a GPS-chosen initial pair,
+    falling back to COLMAP's own choice if that pair does not initialize.
+    """
+    options = pycolmap.IncrementalPipelineOptions()
+    options.use_prior_position = True
+    options.use_robust_loss_on_prior_position = True
+
+    initial_pair = None if input_path else initial_pair_from_priors(database_path)
+    if initial_pair is not None:
+        options.init_image_id1, options.init_image_id2 = initial_pair
+
+    reconstructions = incremental_mapping_with_pbar(database_path, image_path, sfm_path, input_path, options)
+    if not reconstructions and initial_pair is not None:
+        print("GPS initial pair failed to initialize, retrying with automatic selection...")
+        options.init_image_id1, options.init_image_id2 = -1, -1
+        reconstructions = incremental_mapping_with_pbar(database_path, image_path, sfm_path, input_path, options)
+    return reconstructions
+
+def mapping_settings(use_pose_priors, sfm_matching, matching_options):
+    """The options a reconstruction depends on, with defaults filled in, as a cache key."""
+    arguments = inspect.signature(match_features).bind(None, None, sfm_matching, **matching_options)
+    arguments.apply_defaults()
+    settings = {name: value for name, value in arguments.arguments.items()
+                if name not in ("database_path", "image_path", "frame")}
+    return {"use_pose_priors": use_pose_priors, **settings}
+
+def reconstruct(image_path, workspace, use_cache=True, use_pose_priors=True,
+                sfm_matching=DEFAULT_SFM_MATCHING, **matching_options):
+    """
+    Sparse reconstruction of an image folder. Image sets seen before are loaded from
+    the reconstruction cache; when only new images were added, just those are
+    extracted, matched and registered into the cached model.
+
+    Returns the reconstruction and the PriorFrame its GPS priors were written in
+    (None if mapped without priors).
+    """
+    cache, entry = None, None
+    if use_cache:
+        cache = ReconstructionCache()
+        manifest = image_manifest(image_path)
+        settings = mapping_settings(use_pose_priors, sfm_matching, matching_options)
+        entry, new_images = cache.lookup(manifest, settings)
+
+    if entry is not None and not new_images:
+        print("Reusing cached reconstruction...")
+        return entry.load(), PriorFrame.load(entry.database_path)
 
-    # Extracting SIFT Features
-    print("Extracting SIFT features...")
     pycolmap.set_random_seed(0)
-    pycolmap.extract_features(DATABASE_PATH, image_path)
+    # A re-run of the session (after a crash, or without the cache) must not build on its old database and model
+    workspace.reset()
+    if entry is not None:
+        print(f"Extending cached reconstruction with {len(new_images)} new images...")
+        entry.restore_database(workspace.database_path)
+
+        # Only the new images need features; pairs already in the database are not matched again
+        print("Extracting SIFT features...")
+        pycolmap.extract_features(workspace.database_path, image_path, image_names=new_images)
+        input_path = entry.model_path
+    else:
+        # Extracting SIFT Features
+        print("Extracting SIFT features...")
+        pycolmap.extract_features(workspace.database_path, image_path)
+        input_path = None
+
+    # EXIF GPS as pose priors in a local metric frame, for spatial matching and mapping
+    frame = write_pose_priors(workspace.database_path, image_path) if use_pose_priors else None
 
-    # Match Sift Features
-    print("Matching SIFT features...")
-    pycolmap.match_exhaustive(DATABASE_PATH)
+    # Match Sift Features between candidate pairs
+    print(f"Matching SIFT features ({sfm_matching})...")
+    match_features(workspace.database_path, image_path, sfm_matching, frame, **matching_options)
 
     # Incremental Mapping for Sparse Reconstruction
-    print("Incremental Mapping for Sparse Reconstruction...")
-    reconstruction = incremental_mapping_with_pbar(DATABASE_PATH, image_path, RECONSTRUCTION_PATH)[0]
-
-    # If you already have a reconstruction, you can load it
-    # reconstruction = pycolmap.Reconstruction(os.path.join(RECONSTRUCTION_PATH, "0"))
-
-    # Triangulate candidate points
-    print("Triangulating candidate points...")
-    points_2d = [] # Storing 2D center of bounding boxes
-    intrinsics = [] # Storing camera intrinsics
-    extrinsics = [] # Storing camera extrinsics
-    image_id_list = [] # Storing image ids for each point
-
-    for (filename, bboxes) in image_bbox_list:
-        image = reconstruction.find_image_with_name(filename)
-        camera = reconstruction.cameras[image.camera_id]
-
-        K = camera.calibration_matrix()
-        ext = image.cam_from_world.matrix()
-
-        img_points = []
-        for bbox in bboxes:
-            x = bbox['x_center'] * camera.width
-            y = bbox['y_center'] * camera.height
-            img_points.append((x, y))
-
-        points_2d.append(img_points)
-        intrinsics.append(K)
-        extrinsics.append(ext)
-        
-        image_id_list.append([image.image_id] * len(img_points))  # One image_id per point
-
-    # Flatten image_id_list
-    image_id_list = [id for sublist in image_id_list for id in sublist]
-
-    # Triangulate lines
-    print("Triangulating lines...")
-    class_to_lines = {}
-
-    for (filename, bboxes) in image_bbox_list:
-        image = reconstruction.find_image_with_name(filename)
-        ext = image.cam_from_world.matrix()
-        R, t = ext[:3, :3], ext[:3, 3]
-        C = -R.T @ t
-        camera = reconstruction.cameras[image.camera_id]
-        K = camera.calibration_matrix()
-
-        for bbox in bboxes:
-            class_id = bbox['class_id']
-            x = bbox['x_center'] * camera.width
-            y = bbox['y_center'] * camera.height
-            p_h = np.array([x, y, 1.0])
-            ray_cam = np.linalg.inv(K) @ p_h
-            ray_world = R.T @ ray_cam
-            ray_world /= np.linalg.norm(ray_world)
-
-            class_to_lines.setdefault(class_id, []).append((C, ray_world))
-
-    # Solve 3D point for each class
-    class_to_3d = {cls: fit_point_to_rays(lines) for cls, lines in class_to_lines.items()}
-
-    best_points = np.array([point.reshape(3, 1) for point in class_to_3d.values()])
-
-    # _______ Plane Fitting _______
-    # Fit general plane ax + by + cz + d = 0
-    A = np.hstack([best_points.reshape(-1, 3), np.ones((len(best_points), 1))])
-    _, _, V = np.linalg.svd(A)
-    plane = V[-1, :]  # [a, b, c, d]
-    plane /= np.linalg.norm(plane[:3])
-
-    # _______ Plane Projection
-    # Project points onto the plane
-    best_points_proj = []
-    normal = plane[:3]
-    d = plane[3]
-
-    for pt in best_points.reshape(-1, 3):
-        dist = (np.dot(normal, pt) + d) / np.linalg.norm(normal)
-        pt_proj = pt - dist * (normal / np.linalg.norm(normal))
-        best_points_proj.append(pt_proj)
-
-    best_points_proj = np.array(best_points_proj).reshape(-1, 3, 1)
-
-    # _______ Shift camera points
-    # Plane normal
-    plane_normal = plane[:3]
-    plane_normal /= np.linalg.norm(plane_normal)
-
-    # Shift points
-    best_points_shifted = best_points_proj + 0.5 * (plane_normal.reshape(3, 1))
+    if frame is not None:
+        print("Incremental Mapping with GPS pose priors...")
+        reconstructions = map_with_priors(workspace.database_path, image_path, workspace.reconstruction_path, input_path)
+    else:
+        print("Incremental Mapping for Sparse Reconstruction...")
+        reconstructions = incremental_mapping_with_pbar(workspace.database_path, image_path, workspace.reconstruction_path, input_path)
+    reconstruction = reconstructions[0]
 
+    if cache is not None:
+        cache.store(manifest, workspace.database_path, reconstruction, settings)
+    return reconstruction, frame
+
+def similarity_from_gps(reconstruction, image_path, robust=True, threshold=5.0):
     # Calculate projection centers of camera and ECEF coordinates
     print("Calculating projection centers and ECEF coordinates...")
     proj_centers = []
-    ecef_coords = []
+    gps_coords = []
 
+    index = ImageIndex.open(image_path)
     for image in reconstruction.images.values():
         if not reconstruction.is_image_registered(image.image_id):
             continue
         try:
-            lat, lon, alt = get_image_gps_from_file(image, image_path)
-        except:
+            gps_coords.append(index.gps(image.name))
+        except KeyError:
             continue
         proj_centers.append(image.projection_center())
-        ecef_coords.append(transform_gps_to_ecef(lat, lon, alt))
 
     proj_centers = np.array(proj_centers)
-    ecef_coords = np.array(ecef_coords)
+    ecef_coords = geodetic_to_ecef(*np.array(gps_coords).reshape(-1, 3).T)
     print(f"Projection Centers: {proj_centers.shape}, ECEF Coordinates: {ecef_coords.shape}")
 
-    # Calculate simularity transformation
-    scale, R, t = estimate_similarity_transform(proj_centers, ecef_coords)
+    # Calculate simularity transformation; RANSAC keeps GPS glitches from skewing it
+    scale = None
+    if robust:
+        try:
+            scale, R, t, inliers = ransac_similarity(proj_centers, ecef_coords, threshold=threshold)
+            print(f"Similarity from {inliers.sum()}/{len(inliers)} GPS positions ({len(inliers) - inliers.sum()} rejected)")
+        except RuntimeError as e:
+            print(f"Robust similarity failed ({e}), using all GPS positions")
+    if scale is None:
+        scale, R, t = estimate_similarity_transform(proj_centers, ecef_coords)
     print(f"Simularity Matrix: Scale: {scale}, Rotation:\n{R}, Translation:\n{t}")
-    
+    return scale, R, t
+
+def _generate_kmz(image_path, label_path, output_path, workspace, use_cache=True, use_pose_priors=True,
+                  robust_triangulation=True, reprojection_threshold=8.0, angle_threshold=2.0,
+                  robust_similarity=True, similarity_threshold=5.0, standoff=STANDOFF_DISTANCE,
+                  segment_surfaces=True, max_planes=4, plane_threshold=0.05, plane_distance=0.5,
+                  route_objective="time", route_time_budget=ROUTE_TIME_BUDGET, max_mission_waypoints=None,
+                  max_mission_time=None, max_mission_distance=None, sfm_matching=DEFAULT_SFM_MATCHING, **matching_options):
+    # Load images and lables
+    print("Loading images and labels...")
+    image_bbox_list = []
+    for file in os.listdir(label_path):
+        if file.endswith('.txt'):
+            img_name = file.replace('.txt', '.jpeg')
+            with open(os.path.join(label_path, file), 'r') as f:
+                bboxes = []
+                for line in f:
+                    class_id, x, y, w_, h_ = map(float, line.strip().split())
+                    bboxes.append({"class_id": int(class_id), "x_center": x, "y_center": y, "width": w_, "height": h_})
+            image_bbox_list.append((img_name, bboxes))
+
+    reconstruction, frame = reconstruct(image_path, workspace, use_cache, use_pose_priors,
+                                        sfm_matching, **matching_options)
+
+    # Triangulate label positions: every ray in one batch, every class in one solve
+    print("Triangulating label positions...")
+    observations = collect_observations(reconstruction, image_bbox_list)
+    result = None
+    if robust_triangulation:
+        # RANSAC + IRLS: mismatched detections are dropped instead of dragging the label off
+        result = robust_triangulate(observations, reprojection_threshold=reprojection_threshold,
+                                    angle_threshold=angle_threshold)
+        class_ids, class_points = result.classes, result.points
+        print(f"Triangulated {len(class_ids)} labels from {int(result.num_inliers.sum())}/{len(observations)} inlier detections")
+    else:
+        class_ids, class_points = triangulate_points(observations.origins, observations.directions, observations.class_ids)
+        print(f"Triangulated {len(class_ids)} labels from {len(observations)} detections")
+
+    # Georegistration: model coordinates to ECEF
+    if frame is not None and prior_alignment_error(reconstruction, frame, image_path) < PRIOR_ALIGNMENT_TOLERANCE:
+        # Mapped in the GPS prior frame already, no similarity to estimate
+        print("Reconstruction is georegistered by its GPS priors, skipping similarity transform")
+        scale, R, t = frame.model_to_ecef()
+    else:
+        scale, R, t = similarity_from_gps(reconstruction, image_path, robust_similarity, similarity_threshold)
+
+    # _______ Surface Fitting
+    # One plane per shelf face, segmented from the sparse cloud; distances are in meters, the model in units of scale
+    print("Fitting label surfaces...")
+    cloud = np.array([point.xyz for point in reconstruction.points3D.values()]).reshape(-1, 3) if segment_surfaces else None
+    viewpoints = mean_viewpoints(observations, class_ids, result.inliers if result is not None else None)
+    planes = fit_surfaces(class_points, cloud, viewpoints, threshold=plane_threshold / scale,
+                          max_distance=plane_distance / scale, max_planes=max_planes)
+    print(f"Fitted {len(planes)} planes to {len(class_ids)} labels")
+
+    # _______ Project onto the surfaces and shift camera points towards the cameras
+    best_points_shifted = planes.offset(class_points, standoff / scale)
+
+    # _______ Route: fly the waypoints in a short order instead of label order
+    waypoints_ecef = similarity_to_ecef(best_points_shifted, scale, R, t)
+    order = np.arange(len(waypoints_ecef))
+    missions = [order]
+    if len(order):
+        local = LocalFrame(*ecef_to_geodetic(waypoints_ecef.mean(axis=0)))
+        waypoints_local = local.from_ecef(waypoints_ecef)
+        # Where the survey flight started: the route begins at the end closer to it
+        first_image = min((image for image in reconstruction.images.values()
+                           if reconstruction.is_image_registered(image.image_id)), key=lambda image: image.name)
+        start = local.from_ecef(similarity_to_ecef(first_image.projection_center(), scale, R, t))
+        if route_objective is not None and len(order) > 2:
+            order = optimize_route(waypoints_local, route_objective, start, route_time_budget)
+            unit = "m" if route_objective == "distance" else "s"
+            print(f"Route {route_cost(waypoints_local, order, route_objective):.0f} {unit}, "
+                  f"label order {route_cost(waypoints_local, np.arange(len(order)), route_objective):.0f} {unit}")
+
+        # Missions: stretches of the route within one battery (flown from and back to the start) and one DJI mission
+        missions = split_route(waypoints_local, order, max_mission_waypoints, max_mission_time, max_mission_distance,
+                               home=start)
+
     # Convert to Waypoint format
     print("Saving to KMZ...")
-    input_waypoints = []
+    lat, lon, alt = ecef_to_geodetic(waypoints_ecef[order])
+    input_waypoints = [{'lat': la, 'lng': lo, 'alt': al} for la, lo, al in zip(lat.tolist(), lon.tolist(), alt.tolist())]
 
-    for pt in best_points_shifted:
-        lat, lon, alt = transform_proj_to_gps(pt, scale, R, t)
-        input_waypoints.append({'lat': lat, 'lng': lon, 'alt': alt})
-    
     waypoints_to_kmz(input_waypoints, output_path)
-    print(f"KMZ file saved to {output_path}")
\ No newline at end of file
+    print(f"KMZ file saved to {output_path}")
+
+    # Mission of every label
+    mission_of = np.zeros(len(order), dtype=np.int64)
+    for index, mission in enumerate(missions):
+        mission_of[mission] = index
+    bundle_path = Path(output_path) / MISSIONS_FILENAME
+    if len(missions) > 1:
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        labels = np.asarray(class_ids)
+        details = [{"labels": labels[mission].tolist(),
+                    "flight_time": round(mission_cost(waypoints_local, mission, "time", start), 1),
+                    "distance": round(mission_cost(waypoints_local, mission, "distance", start), 1)}
+                   for mission in missions]
+        missions_to_zip([[input_waypoints[i] for i in position[mission]] for mission in missions], output_path, details)
+    else:
+        # A rerun of the session that fits one mission must not leave an old bundle behind
+        bundle_path.unlink(missing_ok=True)
+
+    report_path = Path(output_path) / TRIANGULATION_REPORT
+    if result is not None:
+        # Per-label quality next to the KMZ, in waypoint order
+        stats = result.report(scale)
+        report = [{**stats[i], "plane": int(planes.assignment[i]), "mission": int(mission_of[i]), **waypoint}
+                  for i, waypoint in zip(order, input_waypoints)]
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2, allow_nan=False)
+        print(f"Triangulation report saved to {report_path}")
+    else:
+        # Without robust triangulation there is no report; an earlier run's must not be served as this one's
+        report_path.unlink(missing_ok=True)
\ No newline at end of file
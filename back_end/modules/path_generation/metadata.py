@@ -0,0 +1,258 @@
+import json
+import os
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import piexif
+
+from ..image_headers import read_image_header
+
+# Per-session image metadata index, stored next to the images
+METADATA_FILE = "metadata.json"
+METADATA_VERSION = 1
+
+# Threads reading image headers; the reads are small and I/O bound
+METADATA_WORKERS = int(os.getenv("METADATA_WORKERS", "16"))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+def gps_from_exif(exif):
+    """(lat, lon, alt) from a piexif dictionary; raises KeyError without a GPS fix."""
+    gps = exif.get("GPS", {})
+
+    def dms_to_deg(dms, ref):
+        deg = dms[0][0]/dms[0][1]
+        min = dms[1][0]/dms[1][1]
+        sec = dms[2][0]/dms[2][1]
+        sign = -1 if ref in ['S', 'W'] else 1
+        return sign * (deg + min/60 + sec/3600)
+
+    lat = dms_to_deg(gps[piexif.GPSIFD.GPSLatitude], gps[piexif.GPSIFD.GPSLatitudeRef].decode())
+    lon = dms_to_deg(gps[piexif.GPSIFD.GPSLongitude], gps[piexif.GPSIFD.GPSLongitudeRef].decode())
+    alt = gps.get(piexif.GPSIFD.GPSAltitude, (0,1))
+    alt = alt[0]/alt[1]
+    # Reference 1 means below sea level
+    if gps.get(piexif.GPSIFD.GPSAltitudeRef) == 1:
+        alt = -alt
+
+    return lat, lon, alt
+
+
+# Tags read into the index, by IFD; everything else in the APP1 segment is skipped
+INDEXED_TAGS = {
+    "0th": (piexif.ImageIFD.Make, piexif.ImageIFD.Model, piexif.ImageIFD.DateTime),
+    "Exif": (piexif.ExifIFD.DateTimeOriginal,),
+    "GPS": (
+        piexif.GPSIFD.GPSLatitudeRef, piexif.GPSIFD.GPSLatitude,
+        piexif.GPSIFD.GPSLongitudeRef, piexif.GPSIFD.GPSLongitude,
+        piexif.GPSIFD.GPSAltitudeRef, piexif.GPSIFD.GPSAltitude,
+    ),
+}
+
+# TIFF field types: struct format and size of one value (RATIONALs are two LONGs)
+TIFF_TYPES = {1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("L", 4), 5: ("L", 8), 7: ("s", 1), 9: ("l", 4), 10: ("l", 8)}
+
+
+def read_ifd(tiff, offset, endian, tags):
+    """Values of the wanted tags of the IFD at offset, shaped as piexif returns them."""
+    values = {}
+    count = struct.unpack_from(endian + "H", tiff, offset)[0]
+    for i in range(count):
+        tag, kind, num, value_offset = struct.unpack_from(endian + "HHL4s", tiff, offset + 2 + 12 * i)
+        if tag not in tags or kind not in TIFF_TYPES:
+            continue
+        fmt, size = TIFF_TYPES[kind]
+        # Values of up to four bytes are stored in the entry itself
+        data = value_offset if num * size <= 4 else tiff[struct.unpack(endian + "L", value_offset)[0]:][:num * size]
+        if kind == 2:
+            values[tag] = data[:num].rstrip(b"\x00")
+        elif fmt == "s":
+            values[tag] = data[:num]
+        elif kind in (5, 10):
+            numbers = struct.unpack(endian + fmt * (2 * num), data)
+            pairs = tuple(zip(numbers[::2], numbers[1::2]))
+            values[tag] = pairs[0] if num == 1 else pairs
+        else:
+            numbers = struct.unpack(endian + fmt * num, data[:num * size])
+            values[tag] = numbers[0] if num == 1 else numbers
+    return values
+
+
+def read_exif_tags(app1):
+    """
+    The INDEXED_TAGS of an Exif APP1 payload, as a piexif-style dictionary
+    ({"0th": {...}, "Exif": {...}, "GPS": {...}}). Only the three IFDs holding
+    them are walked; thumbnails and maker notes are never decoded.
+    """
+    tiff = app1[6:]
+    endian = "<" if tiff[:2] == b"II" else ">"
+    ifd0 = struct.unpack_from(endian + "L", tiff, 4)[0]
+    pointers = read_ifd(tiff, ifd0, endian, (piexif.ImageIFD.ExifTag, piexif.ImageIFD.GPSTag))
+
+    exif = {"0th": read_ifd(tiff, ifd0, endian, INDEXED_TAGS["0th"]), "Exif": {}, "GPS": {}}
+    if piexif.ImageIFD.ExifTag in pointers:
+        exif["Exif"] = read_ifd(tiff, pointers[piexif.ImageIFD.ExifTag], endian, INDEXED_TAGS["Exif"])
+    if piexif.ImageIFD.GPSTag in pointers:
+        exif["GPS"] = read_ifd(tiff, pointers[piexif.ImageIFD.GPSTag], endian, INDEXED_TAGS["GPS"])
+    return exif
+
+
+def read_image_gps(image_path):
+    """(lat, lon, alt) from the EXIF of an image; raises KeyError without a GPS fix."""
+    app1, _ = read_image_header(image_path)
+    if app1 is None:
+        raise KeyError(f"No EXIF in {image_path}")
+    return gps_from_exif(read_exif_tags(app1))
+
+
+def exif_text(value):
+    if value is None:
+        return None
+    return value.decode(errors="replace").strip("\x00 ") or None
+
+
+def read_image_metadata(image_path):
+    """Index entry of one image: GPS, capture time, size and camera model, from its headers only."""
+    stat = os.stat(image_path)
+    entry = {
+        "bytes": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "gps": None,
+        "timestamp": None,
+        "size": None,
+        "camera": None,
+    }
+
+    try:
+        app1, size = read_image_header(image_path)
+    except (struct.error, OSError, ValueError) as e:
+        # Truncated or corrupt headers: the image is indexed without size and GPS
+        print(f"Unreadable header in {image_path}: {e}")
+        return entry
+    entry["size"] = list(size) if size is not None else None
+    if app1 is None:
+        return entry
+
+    try:
+        exif = read_exif_tags(app1)
+    except (struct.error, IndexError) as e:
+        print(f"Unreadable EXIF in {image_path}: {e}")
+        return entry
+
+    try:
+        entry["gps"] = list(gps_from_exif(exif))
+    except (KeyError, IndexError, TypeError, ZeroDivisionError):
+        pass
+    entry["timestamp"] = exif_text(exif["Exif"].get(piexif.ExifIFD.DateTimeOriginal) or exif["0th"].get(piexif.ImageIFD.DateTime))
+    make = exif_text(exif["0th"].get(piexif.ImageIFD.Make))
+    model = exif_text(exif["0th"].get(piexif.ImageIFD.Model))
+    entry["camera"] = " ".join(part for part in (make, model) if part) or None
+    return entry
+
+
+class ImageIndex:
+    """
+    Metadata of every image of a folder, read once from the image headers and kept
+    in METADATA_FILE next to them. Detection and path generation query it instead
+    of reopening every image for its EXIF.
+
+    Entries remember the file size and modification time they were read at; open()
+    re-reads only the images that were added or changed since. A changed image also
+    loses the content sha256 remembered for it (add_digests).
+    """
+
+    def __init__(self, image_dir, entries=None):
+        self.image_dir = Path(image_dir)
+        self.entries = entries or {}
+
+    @property
+    def path(self):
+        return self.image_dir / METADATA_FILE
+
+    @classmethod
+    def load(cls, image_dir):
+        path = Path(image_dir) / METADATA_FILE
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cls(image_dir)
+        if data.get("version") != METADATA_VERSION:
+            return cls(image_dir)
+        return cls(image_dir, data.get("images", {}))
+
+    @classmethod
+    def open(cls, image_dir, workers=METADATA_WORKERS):
+        """Load the index of a folder, bringing it up to date with the images present."""
+        index = cls.load(image_dir)
+        if index.refresh(workers):
+            index.save()
+        return index
+
+    def refresh(self, workers=METADATA_WORKERS):
+        """Read the headers of new or modified images, drop removed ones; returns True if anything changed."""
+        names = sorted(
+            name for name in os.listdir(self.image_dir)
+            if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(self.image_dir / name)
+        )
+        stale = []
+        for name in names:
+            entry = self.entries.get(name)
+            if entry is None:
+                stale.append(name)
+                continue
+            stat = os.stat(self.image_dir / name)
+            if entry["bytes"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                stale.append(name)
+        removed = set(self.entries) - set(names)
+
+        for name in removed:
+            del self.entries[name]
+        if stale:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                entries = pool.map(read_image_metadata, [self.image_dir / name for name in stale])
+            self.entries.update(zip(stale, entries))
+            print(f"Indexed metadata of {len(stale)} images")
+        return bool(stale or removed)
+
+    def save(self):
+        # Written aside and renamed, so a concurrent reader never sees a partial file,
+        # under a unique temporary name, so concurrent jobs indexing the folder don't share one
+        fd, tmp_path = tempfile.mkstemp(dir=self.image_dir, prefix=".metadata.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": METADATA_VERSION, "images": self.entries}, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def add_digests(self, digests):
+        """Remember the content sha256 of images ({name: sha256}) with their entries; saves the index."""
+        changed = False
+        for name, sha256 in digests.items():
+            entry = self.entries.get(Path(name).name)
+            if entry is not None and entry.get("sha256") != sha256:
+                entry["sha256"] = sha256
+                changed = True
+        if changed:
+            self.save()
+
+    def __contains__(self, name):
+        return Path(name).name in self.entries
+
+    def gps(self, name):
+        """(lat, lon, alt) of an image by file name or path; raises KeyError without a GPS fix."""
+        gps = self.entries[Path(name).name]["gps"]
+        if gps is None:
+            raise KeyError(f"No GPS for {name}")
+        return tuple(gps)
+
+    def size(self, name):
+        """(height, width) of an image by file name or path; raises KeyError if unknown."""
+        size = self.entries[Path(name).name]["size"]
+        if size is None:
+            raise KeyError(f"No size for {name}")
+        return tuple(size)
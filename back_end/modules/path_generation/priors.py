@@ -0,0 +1,141 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pycolmap
+
+from .metadata import ImageIndex
+from .geodesy import LocalFrame
+
+# Reconstructions mapped with priors are accepted as georegistered (no similarity step)
+# when the camera centres are within this RMS distance (meters) of their GPS positions
+PRIOR_ALIGNMENT_TOLERANCE = 10.0
+
+# Standard deviation of the EXIF GPS position (meters): horizontal, horizontal, vertical
+GPS_POSITION_STD = (3.0, 3.0, 5.0)
+
+
+class PriorFrame(LocalFrame):
+    """
+    Local east/north/up frame the pose priors are written in, centred on the mean
+    GPS position of the flight. Models mapped with priors live in this frame, so
+    model_to_ecef() replaces the similarity transform fitted after mapping.
+
+    The reference is stored next to the feature database, so a database extended
+    later (reconstruction cache) keeps the same frame.
+    """
+
+    @staticmethod
+    def path_for(database_path):
+        return Path(database_path).with_suffix(".priors.json")
+
+    @classmethod
+    def load(cls, database_path):
+        path = cls.path_for(database_path)
+        if not path.exists():
+            return None
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    def save(self, database_path):
+        with open(self.path_for(database_path), "w") as f:
+            json.dump({"lat": self.lat, "lon": self.lon, "alt": self.alt}, f)
+
+    def model_to_ecef(self):
+        """(scale, R, t) taking model coordinates to ECEF, as estimate_similarity_transform returns."""
+        return 1.0, self.rotation.T, self.origin
+
+
+def read_gps_positions(database, image_path):
+    index = ImageIndex.open(image_path)
+    positions = {}
+    for image in database.read_all_images():
+        try:
+            positions[image.image_id] = index.gps(image.name)
+        except KeyError:
+            continue
+    return positions
+
+
+def write_pose_priors(database_path, image_path):
+    """
+    Write the EXIF GPS of every database image as a Cartesian pose prior in the
+    flight's PriorFrame. Returns the frame, or None when fewer than two images have GPS.
+    """
+    database = pycolmap.Database(database_path)
+    try:
+        positions = read_gps_positions(database, image_path)
+        if len(positions) < 2:
+            return None
+
+        frame = PriorFrame.load(database_path)
+        if frame is None:
+            frame = PriorFrame(*np.mean(list(positions.values()), axis=0).tolist())
+            frame.save(database_path)
+
+        covariance = np.diag(np.square(GPS_POSITION_STD))
+        local = frame.from_geodetic(*np.array(list(positions.values())).T)
+        for image_id, position in zip(positions, local):
+            prior = pycolmap.PosePrior(
+                position=position,
+                position_covariance=covariance,
+                coordinate_system=pycolmap.PosePriorCoordinateSystem.CARTESIAN,
+            )
+            # Priors extracted by COLMAP from EXIF are WGS84; replace them with ours
+            if database.exists_pose_prior(image_id):
+                database.update_pose_prior(image_id, prior)
+            else:
+                database.write_pose_prior(image_id, prior)
+    finally:
+        database.close()
+    return frame
+
+
+def initial_pair_from_priors(database_path):
+    """
+    Pick the initial image pair from GPS baselines: the image closest to the centre
+    of the flight (most neighbours to grow from) and the nearest image at least
+    half the typical neighbour spacing away (enough baseline for triangulation).
+    """
+    database = pycolmap.Database(database_path)
+    try:
+        ids, positions = [], []
+        for image in database.read_all_images():
+            if database.exists_pose_prior(image.image_id):
+                ids.append(image.image_id)
+                positions.append(np.asarray(database.read_pose_prior(image.image_id).position))
+    finally:
+        database.close()
+    if len(ids) < 2:
+        return None
+
+    positions = np.array(positions)
+    sq = np.einsum('ij,ij->i', positions, positions)
+    dist = np.sqrt(np.maximum(sq[:, None] + sq[None, :] - 2.0 * (positions @ positions.T), 0))
+    np.fill_diagonal(dist, np.inf)
+
+    min_baseline = 0.5 * np.median(dist.min(axis=1))
+    first = int(np.argmin(np.linalg.norm(positions - positions.mean(axis=0), axis=1)))
+    candidates = np.where(dist[first] >= min_baseline, dist[first], np.inf)
+    second = int(np.argmin(candidates))
+    if not np.isfinite(candidates[second]):
+        return None
+    return ids[first], ids[second]
+
+
+def prior_alignment_error(reconstruction, frame, image_path):
+    """RMS distance (meters) between the registered camera centres and their GPS positions."""
+    index = ImageIndex.open(image_path)
+    centers, gps = [], []
+    for image in reconstruction.images.values():
+        if not reconstruction.is_image_registered(image.image_id):
+            continue
+        try:
+            gps.append(index.gps(image.name))
+        except KeyError:
+            continue
+        centers.append(image.projection_center())
+    if not gps:
+        return np.inf
+    expected = frame.from_geodetic(*np.array(gps).T)
+    return float(np.sqrt(np.mean(np.sum((np.array(centers) - expected) ** 2, axis=1))))
@@ -0,0 +1,295 @@
+import math
+import os
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Route costs: flight distance (m) or flight time (s) under the speed model below
+ROUTE_OBJECTIVES = ("distance", "time")
+
+# Horizontal speed from the mission template (autoFlightSpeed), and climb/descent speed (m/s)
+FLIGHT_SPEED = 10.0
+VERTICAL_SPEED = 4.0
+
+# Wall-clock seconds the local search may spend improving a route
+ROUTE_TIME_BUDGET = float(os.getenv("ROUTE_TIME_BUDGET", "5.0"))
+
+# Candidate moves per waypoint: its nearest neighbours under the route cost
+ROUTE_NEIGHBOURS = 10
+
+# Longest segment Or-opt moves
+OR_OPT_SEGMENT = 3
+
+# Improvements smaller than this are ignored (guards against float cycling)
+EPSILON = 1e-9
+
+
+def leg_costs(a, b, objective="time", flight_speed=FLIGHT_SPEED, vertical_speed=VERTICAL_SPEED):
+    """
+    Cost of flying from points a to points b (..., 3), in a local east/north/up
+    frame. Under "time", horizontal and vertical motion happen together, so a leg
+    takes as long as the slower of the two.
+    """
+    delta = np.asarray(b, dtype=np.float64) - np.asarray(a, dtype=np.float64)
+    horizontal = np.hypot(delta[..., 0], delta[..., 1])
+    if objective == "distance":
+        return np.hypot(horizontal, delta[..., 2])
+    return np.maximum(horizontal / flight_speed, np.abs(delta[..., 2]) / vertical_speed)
+
+
+def route_cost(points, order, objective="time", flight_speed=FLIGHT_SPEED, vertical_speed=VERTICAL_SPEED):
+    """Total cost of visiting points in order (open path)."""
+    points = np.asarray(points, dtype=np.float64)[order]
+    return float(leg_costs(points[:-1], points[1:], objective, flight_speed, vertical_speed).sum())
+
+
+class _Route:
+    """
+    Open path as a cycle through a dummy node (index n) that costs nothing to
+    reach, so 2-opt and Or-opt can also move the path's endpoints.
+    """
+
+    def __init__(self, points, order, objective, flight_speed, vertical_speed):
+        self.n = len(points)
+        self.coords = points.tolist()
+        self.objective = objective
+        self.flight_speed = flight_speed
+        self.vertical_speed = vertical_speed
+        self.tour = np.append(order, self.n)
+        self.pos = np.empty(self.n + 1, dtype=np.int64)
+        self.pos[self.tour] = np.arange(self.n + 1)
+
+    def cost(self, a, b):
+        if a == self.n or b == self.n:
+            return 0.0
+        pa, pb = self.coords[a], self.coords[b]
+        horizontal = math.hypot(pb[0] - pa[0], pb[1] - pa[1])
+        if self.objective == "distance":
+            return math.hypot(horizontal, pb[2] - pa[2])
+        return max(horizontal / self.flight_speed, abs(pb[2] - pa[2]) / self.vertical_speed)
+
+    def succ(self, a):
+        return int(self.tour[(self.pos[a] + 1) % (self.n + 1)])
+
+    def pred(self, a):
+        return int(self.tour[self.pos[a] - 1])
+
+    def reverse(self, a, b):
+        """Reverse the path from a forward to b, or equivalently its shorter complement."""
+        m = self.n + 1
+        i, j = self.pos[a], self.pos[b]
+        length = (j - i) % m + 1
+        if 2 * length > m:
+            i, j, length = (j + 1) % m, (i - 1) % m, m - length
+        index = (i + np.arange(length)) % m
+        self.tour[index] = self.tour[index[::-1]]
+        self.pos[self.tour[index]] = index
+
+    def move_segment(self, first, last, after, reverse):
+        """Move the segment first..last (forward) to just after node after."""
+        m = self.n + 1
+        i, j = self.pos[first], self.pos[last]
+        index = (i + np.arange((j - i) % m + 1)) % m
+        segment = self.tour[index]
+        if reverse:
+            segment = segment[::-1]
+        rest = np.delete(self.tour, index)
+        at = int(np.flatnonzero(rest == after)[0]) + 1
+        self.tour = np.concatenate([rest[:at], segment, rest[at:]])
+        self.pos[self.tour] = np.arange(m)
+
+    def order(self):
+        """The path without the dummy node."""
+        i = self.pos[self.n]
+        return np.concatenate([self.tour[i + 1:], self.tour[:i]])
+
+
+def neighbour_lists(points, k, objective, flight_speed, vertical_speed):
+    """The k cheapest other waypoints of every waypoint, sorted by leg cost."""
+    # Under "time", scaling by the speeds makes Euclidean distance track the cost
+    scaled = points if objective == "distance" else points / [flight_speed, flight_speed, vertical_speed]
+    k = min(k, len(points) - 1)
+    _, neighbours = cKDTree(scaled).query(scaled, k + 1)
+    neighbours = neighbours[:, 1:].reshape(len(points), k)
+    costs = leg_costs(points[:, None], points[neighbours], objective, flight_speed, vertical_speed)
+    return np.take_along_axis(neighbours, np.argsort(costs, axis=1), axis=1)
+
+
+def nearest_neighbour_route(points, neighbours, start, objective, flight_speed, vertical_speed):
+    """Greedy path: always fly to the cheapest unvisited waypoint."""
+    n = len(points)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        candidates = neighbours[current][~visited[neighbours[current]]]
+        if len(candidates):
+            current = int(candidates[0])
+        else:
+            # All nearby waypoints visited: scan every unvisited one
+            unvisited = np.flatnonzero(~visited)
+            costs = leg_costs(points[current], points[unvisited], objective, flight_speed, vertical_speed)
+            current = int(unvisited[np.argmin(costs)])
+    return order
+
+
+def two_opt_move(route, a, neighbours):
+    """First improving 2-opt move from a; returns True if one was applied."""
+    for forward in (True, False):
+        b = route.succ(a) if forward else route.pred(a)
+        ab = route.cost(a, b)
+        for c in neighbours[a]:
+            ac = route.cost(a, c)
+            # Neighbours are sorted: no later c can shorten the tour
+            if ac >= ab:
+                break
+            d = route.succ(c) if forward else route.pred(c)
+            if c == b or d == a:
+                continue
+            if ac + route.cost(b, d) - ab - route.cost(c, d) < -EPSILON:
+                if forward:
+                    route.reverse(b, c)
+                else:
+                    route.reverse(c, b)
+                return True
+    return False
+
+
+def or_opt_move(route, a, neighbours):
+    """First improving move of a segment starting at a to next to a near waypoint."""
+    last = a
+    segment = {a}
+    for _ in range(OR_OPT_SEGMENT):
+        prev, nxt = route.pred(a), route.succ(last)
+        if nxt == a or prev == last:
+            return False
+        removed = route.cost(prev, a) + route.cost(last, nxt) - route.cost(prev, nxt)
+        for c in neighbours[a]:
+            if c in segment or c == prev:
+                continue
+            e = route.succ(c)
+            ce = route.cost(c, e)
+            # Either orientation of the segment between c and e
+            keep = route.cost(c, a) + route.cost(last, e) - ce
+            flip = route.cost(c, last) + route.cost(a, e) - ce
+            if min(keep, flip) - removed < -EPSILON:
+                route.move_segment(a, last, c, reverse=flip < keep)
+                return True
+        last = nxt
+        if last == route.n:
+            return False
+        segment.add(last)
+    return False
+
+
+def optimize_route(points, objective="time", start=None, time_budget=ROUTE_TIME_BUDGET,
+                   flight_speed=FLIGHT_SPEED, vertical_speed=VERTICAL_SPEED, k=ROUTE_NEIGHBOURS):
+    """
+    Order waypoints (n, 3) in a local metric frame into a short open path.
+
+    A nearest-neighbour path is improved by 2-opt and Or-opt moves over each
+    waypoint's k cheapest neighbours, until no move helps or time_budget seconds
+    have passed. When start (a position) is given, the path begins at the end
+    closer to it. Returns the visiting order.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    n = len(points)
+    if n < 3:
+        order = np.arange(n)
+    else:
+        deadline = time.perf_counter() + time_budget
+        neighbours = neighbour_lists(points, k, objective, flight_speed, vertical_speed)
+        # Start from an extreme waypoint, at one end of the survey area
+        first = int(np.argmax(np.linalg.norm(points - points.mean(axis=0), axis=1)))
+        route = _Route(points, nearest_neighbour_route(points, neighbours, first, objective, flight_speed, vertical_speed),
+                       objective, flight_speed, vertical_speed)
+        neighbours = neighbours.tolist()
+
+        # Don't-look bits: only waypoints whose surroundings changed are revisited
+        queue = list(range(n))
+        queued = np.ones(n, dtype=bool)
+        while queue and time.perf_counter() < deadline:
+            a = queue.pop()
+            queued[a] = False
+            before = (route.pred(a), route.succ(a))
+            if two_opt_move(route, a, neighbours) or or_opt_move(route, a, neighbours):
+                for b in (a, *before, route.pred(a), route.succ(a)):
+                    if b != n and not queued[b]:
+                        queued[b] = True
+                        queue.append(b)
+        if queue:
+            print(f"Route optimization stopped by its {time_budget:.1f} s budget")
+        order = route.order()
+
+    if start is not None and n > 1:
+        ends = leg_costs(np.asarray(start, dtype=np.float64), points[[order[0], order[-1]]], objective,
+                         flight_speed, vertical_speed)
+        if ends[1] < ends[0]:
+            order = order[::-1]
+    return np.asarray(order, dtype=np.int64)
+
+
+def mission_cost(points, indices, objective="time", home=None, flight_speed=FLIGHT_SPEED, vertical_speed=VERTICAL_SPEED):
+    """Cost of flying points[indices] in order, out from and back to home if given."""
+    path = np.asarray(points, dtype=np.float64).reshape(-1, 3)[indices]
+    if home is not None and len(path):
+        home = np.asarray(home, dtype=np.float64).reshape(1, 3)
+        path = np.concatenate([home, path, home])
+    return float(leg_costs(path[:-1], path[1:], objective, flight_speed, vertical_speed).sum())
+
+
+def split_route(points, order, max_waypoints=None, max_time=None, max_distance=None, home=None,
+                flight_speed=FLIGHT_SPEED, vertical_speed=VERTICAL_SPEED):
+    """
+    Cut a route (points in a local metric frame, visited in order) into missions
+    of consecutive waypoints, so each mission covers one compact stretch of the
+    route. A mission holds at most max_waypoints waypoints, and takes at most
+    max_time seconds and max_distance meters to fly, counting the legs out from
+    and back to home if given. Limits left None are not applied. Returns the
+    waypoint indices of each mission.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    order = np.asarray(order, dtype=np.int64)
+    n = len(order)
+    if n == 0:
+        return []
+    if max_waypoints is not None:
+        # Equally sized missions rather than full ones and a short remainder
+        max_waypoints = math.ceil(n / math.ceil(n / max_waypoints))
+
+    route = points[order]
+    budgets = [(objective, budget) for objective, budget in (("time", max_time), ("distance", max_distance))
+               if budget is not None]
+    legs, ends = {}, {}
+    for objective, _ in budgets:
+        legs[objective] = leg_costs(route[:-1], route[1:], objective, flight_speed, vertical_speed).tolist()
+        ends[objective] = (leg_costs(np.asarray(home, dtype=np.float64), route, objective, flight_speed, vertical_speed).tolist()
+                           if home is not None else [0.0] * n)
+
+    missions = []
+    first = 0
+    flown = {objective: 0.0 for objective, _ in budgets}
+    for i in range(1, n):
+        # The mission first..i-1 extended by waypoint i
+        extended = {objective: flown[objective] + legs[objective][i - 1] for objective, _ in budgets}
+        fits = (max_waypoints is None or i - first < max_waypoints) and all(
+            extended[objective] + ends[objective][first] + ends[objective][i] <= budget for objective, budget in budgets)
+        if fits:
+            flown = extended
+        else:
+            missions.append(order[first:i])
+            first = i
+            flown = {objective: 0.0 for objective, _ in budgets}
+    missions.append(order[first:])
+
+    for objective, budget in budgets:
+        over = sum(mission_cost(points, mission, objective, home, flight_speed, vertical_speed) > budget
+                   for mission in missions)
+        if over:
+            print(f"{over} single-waypoint missions exceed the {objective} budget of {budget:g}")
+    return missions
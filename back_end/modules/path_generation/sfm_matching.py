@@ -0,0 +1,66 @@
+import os
+from pathlib import Path
+
+import pycolmap
+
+from .priors import write_pose_priors
+
+# Image pair strategies for SIFT matching
+SFM_MATCHING_MODES = ("exhaustive", "spatial", "sequential", "vocabtree")
+DEFAULT_SFM_MATCHING = os.getenv("SFM_MATCHING", "spatial")
+
+# Vocabulary tree for "vocabtree" matching (e.g. vocab_tree_flickr100K_words32K.bin from the COLMAP site)
+VOCAB_TREE_PATH = os.getenv("VOCAB_TREE_PATH")
+
+
+def match_features(database_path, image_path, mode=DEFAULT_SFM_MATCHING, frame=None,
+                   max_neighbors=30, max_distance=100.0, overlap=10, vocab_tree_path=VOCAB_TREE_PATH,
+                   num_images=50):
+    """
+    Match SIFT features between candidate image pairs.
+
+    Parameters
+    ----------
+    mode : str
+        "exhaustive": every pair, O(N^2).
+        "spatial": the max_neighbors nearest images within max_distance meters of
+        each image, by EXIF GPS pose priors. Falls back to exhaustive without GPS.
+        "sequential": the next `overlap` images in filename (capture) order.
+        "vocabtree": the num_images most similar images by vocabulary-tree retrieval.
+    frame : PriorFrame, optional
+        Frame the pose priors were already written to the database in; spatial
+        matching writes them itself when not given.
+    """
+    if mode not in SFM_MATCHING_MODES:
+        raise ValueError(f"Unknown SfM matching mode {mode!r}, expected one of {SFM_MATCHING_MODES}")
+
+    if mode == "spatial":
+        if frame is None:
+            frame = write_pose_priors(database_path, image_path)
+        if frame is None:
+            print("Not enough images with GPS for spatial matching, matching exhaustively")
+            mode = "exhaustive"
+        else:
+            options = pycolmap.SpatialMatchingOptions()
+            options.max_num_neighbors = max_neighbors
+            options.max_distance = max_distance
+            options.ignore_z = False
+            pycolmap.match_spatial(database_path, matching_options=options)
+
+    if mode == "sequential":
+        options = pycolmap.SequentialMatchingOptions()
+        options.overlap = overlap
+        pycolmap.match_sequential(database_path, matching_options=options)
+
+    elif mode == "vocabtree":
+        if not vocab_tree_path or not Path(vocab_tree_path).exists():
+            raise ValueError("vocabtree matching needs a vocabulary tree (set VOCAB_TREE_PATH)")
+        options = pycolmap.VocabTreeMatchingOptions()
+        options.vocab_tree_path = str(vocab_tree_path)
+        options.num_images = num_images
+        pycolmap.match_vocabtree(database_path, matching_options=options)
+
+    elif mode == "exhaustive":
+        pycolmap.match_exhaustive(database_path)
+
+    return mode
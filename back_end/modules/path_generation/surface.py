@@ -0,0 +1,181 @@
+import numpy as np
+
+# Planes are fitted to at most this many sparse-cloud points, sampled at random
+MAX_SEGMENTATION_POINTS = 50000
+
+
+class Planes:
+    """
+    Planes n . x + d = 0 with unit normals (p, 3) and offsets (p,), and the plane
+    each label point is assigned to (-1 for none).
+    """
+
+    def __init__(self, normals, offsets, assignment):
+        self.normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.float64).reshape(-1)
+        self.assignment = np.asarray(assignment, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.normals)
+
+    def distances(self, points):
+        """Signed distance of every point to every plane: (n, p)."""
+        return np.asarray(points).reshape(-1, 3) @ self.normals.T + self.offsets
+
+    def project(self, points):
+        """Orthogonal projection of each point onto its assigned plane."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        normals = self.normals[self.assignment]
+        distance = np.einsum('ij,ij->i', points, normals) + self.offsets[self.assignment]
+        return points - distance[:, None] * normals
+
+    def offset(self, points, standoff):
+        """Project each point onto its plane and move it standoff along the plane normal."""
+        return self.project(points) + standoff * self.normals[self.assignment]
+
+
+def fit_plane(points, weights=None):
+    """Total least squares plane through points (n, 3): unit normal and offset."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if weights is None:
+        centroid = points.mean(axis=0)
+        centered = points - centroid
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        centroid = weights @ points / weights.sum()
+        centered = (points - centroid) * np.sqrt(weights)[:, None]
+    # Normal: direction of least variance
+    _, _, V = np.linalg.svd(centered, full_matrices=False)
+    normal = V[-1]
+    return normal, -normal @ centroid
+
+
+def ransac_plane(points, threshold, num_hypotheses=256, batch_size=64, seed=0):
+    """
+    Plane with the most points within threshold, from random point triplets
+    scored batch_size at a time, refitted on its inliers.
+    Returns (normal, offset, inliers), or None for fewer than three points.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(points) < 3:
+        return None
+    rng = np.random.default_rng(seed)
+
+    best_count, best_inliers = -1, None
+    for start in range(0, num_hypotheses, batch_size):
+        size = min(batch_size, num_hypotheses - start)
+        samples = points[rng.integers(0, len(points), size=(size, 3))]
+        normals = np.cross(samples[:, 1] - samples[:, 0], samples[:, 2] - samples[:, 0])
+        norms = np.linalg.norm(normals, axis=1)
+        # Collinear or repeated samples define no plane
+        valid = norms > 1e-12
+        if not valid.any():
+            continue
+        normals = normals[valid] / norms[valid, None]
+        offsets = -np.einsum('ij,ij->i', normals, samples[valid, 0])
+
+        inliers = np.abs(points @ normals.T + offsets) < threshold
+        counts = inliers.sum(axis=0)
+        best = int(np.argmax(counts))
+        if counts[best] > best_count:
+            best_count, best_inliers = counts[best], inliers[:, best]
+
+    if best_inliers is None or best_count < 3:
+        return None
+    # Refit on the inliers, then take the inliers of the refined plane
+    normal, offset = fit_plane(points[best_inliers])
+    inliers = np.abs(points @ normal + offset) < threshold
+    if inliers.sum() >= 3:
+        normal, offset = fit_plane(points[inliers])
+    return normal, offset, inliers
+
+
+def segment_planes(points, threshold, max_planes=4, min_inliers=100, num_hypotheses=256, seed=0):
+    """
+    Sequential RANSAC: take the best plane, remove its inliers, repeat until
+    max_planes are found or the best plane has fewer than min_inliers points.
+    Returns normals (p, 3) and offsets (p,).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    rng = np.random.default_rng(seed)
+    if len(points) > MAX_SEGMENTATION_POINTS:
+        points = points[rng.choice(len(points), MAX_SEGMENTATION_POINTS, replace=False)]
+
+    normals, offsets = [], []
+    remaining = points
+    while len(normals) < max_planes and len(remaining) >= min_inliers:
+        fit = ransac_plane(remaining, threshold, num_hypotheses, seed=int(rng.integers(1 << 31)))
+        if fit is None or fit[2].sum() < min_inliers:
+            break
+        normals.append(fit[0])
+        offsets.append(fit[1])
+        remaining = remaining[~fit[2]]
+    return np.array(normals).reshape(-1, 3), np.array(offsets)
+
+
+def orient_normals(planes, points, viewpoints):
+    """Flip plane normals to face the cameras that observed their points."""
+    if len(planes) == 0:
+        return planes
+    # Per plane, the summed side the viewpoints lie on
+    side = np.einsum('ij,ij->i', np.asarray(viewpoints).reshape(-1, 3) - np.asarray(points).reshape(-1, 3),
+                     planes.normals[planes.assignment])
+    votes = np.bincount(planes.assignment, weights=side, minlength=len(planes))
+    flip = np.where(votes < 0, -1.0, 1.0)
+    return Planes(planes.normals * flip[:, None], planes.offsets * flip, planes.assignment)
+
+
+def fit_surfaces(points, cloud=None, viewpoints=None, threshold=0.05, max_distance=0.5, max_planes=4,
+                 min_inliers=100, robust=True, seed=0):
+    """
+    Fit the surfaces label points lie on, e.g. one plane per shelf face.
+
+    Planes are segmented from the sparse reconstruction cloud (sequential RANSAC
+    with inlier threshold) and each label is assigned to the nearest one within
+    max_distance. Labels left over get planes fitted to themselves: RANSAC over
+    the leftovers when robust, otherwise a single least-squares plane, which is
+    the original single-plane behaviour when no cloud is given. Normals are
+    oriented towards viewpoints (e.g. the mean camera centre per label) if given.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    normals, offsets = np.empty((0, 3)), np.empty(0)
+    if cloud is not None and len(cloud) and max_planes > 0:
+        normals, offsets = segment_planes(cloud, threshold, max_planes, min_inliers, seed=seed)
+
+    assignment = np.full(len(points), -1)
+    if len(normals):
+        distance = np.abs(points @ normals.T + offsets)
+        nearest = np.argmin(distance, axis=1)
+        assignment = np.where(distance[np.arange(len(points)), nearest] < max_distance, nearest, -1)
+        # Cloud planes without labels (floor, ceiling, ...) are dropped
+        used = np.unique(assignment[assignment >= 0])
+        remap = np.full(len(normals), -1)
+        remap[used] = np.arange(len(used))
+        normals, offsets = normals[used], offsets[used]
+        assignment = np.where(assignment >= 0, remap[np.maximum(assignment, 0)], -1)
+
+    normals, offsets = list(normals), list(offsets)
+    leftover = np.flatnonzero(assignment < 0)
+    while robust and len(leftover) >= 3:
+        fit = ransac_plane(points[leftover], max_distance, seed=seed + len(normals))
+        if fit is None or fit[2].sum() < 3:
+            break
+        assignment[leftover[fit[2]]] = len(normals)
+        normals.append(fit[0])
+        offsets.append(fit[1])
+        leftover = leftover[~fit[2]]
+    if len(leftover):
+        # Too few for a plane of their own: one plane through all leftovers, or the nearest plane
+        if len(leftover) >= 3 or not normals:
+            normal, offset = fit_plane(points[leftover])
+            assignment[leftover] = len(normals)
+            normals.append(normal)
+            offsets.append(offset)
+        else:
+            distance = np.abs(points[leftover] @ np.array(normals).T + np.array(offsets))
+            assignment[leftover] = np.argmin(distance, axis=1)
+
+    planes = Planes(normals, offsets, assignment)
+    if viewpoints is not None:
+        planes = orient_normals(planes, points, viewpoints)
+    return planes
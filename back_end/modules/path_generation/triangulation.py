@@ -0,0 +1,359 @@
+import math
+
+import numpy as np
+
+# Ray systems with det(A) below this fraction of (trace(A) / 3)^3 are treated as
+# degenerate (single ray or near-parallel rays) and solved by pseudo-inverse
+DEGENERATE_DETERMINANT = 1e-12
+
+
+class Observations:
+    """
+    Label detections of a reconstruction, stacked across images.
+
+    Per image (k): intrinsics K, rotation R and translation t of cam_from_world.
+    Per detection (n): class_id, pixel position and the index of its image, from
+    which the viewing rays (origin = camera centre, unit direction) are built in
+    one batched product.
+    """
+
+    def __init__(self, class_ids, image_index, pixels, K, R, t, image_names=()):
+        self.class_ids = np.asarray(class_ids, dtype=np.int64)
+        self.image_index = np.asarray(image_index, dtype=np.int64)
+        self.pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        self.K = np.asarray(K, dtype=np.float64).reshape(-1, 3, 3)
+        self.R = np.asarray(R, dtype=np.float64).reshape(-1, 3, 3)
+        self.t = np.asarray(t, dtype=np.float64).reshape(-1, 3)
+        self.image_names = list(image_names)
+
+        # Camera centres C = -R^T t and pixel-to-world-direction maps R^T K^-1, once per image
+        self.centers = -np.einsum('kji,kj->ki', self.R, self.t)
+        self.pixel_to_world = np.matmul(self.R.transpose(0, 2, 1), np.linalg.inv(self.K))
+        # Projection K [R | t], for reprojection errors
+        self.KR = np.matmul(self.K, self.R)
+        self.Kt = np.einsum('kij,kj->ki', self.K, self.t)
+
+        self.origins, self.directions = rays_from_pixels(
+            self.pixels, self.image_index, self.centers, self.pixel_to_world
+        )
+
+    def __len__(self):
+        return len(self.class_ids)
+
+
+def rays_from_pixels(pixels, image_index, centers, pixel_to_world):
+    """Unit world-space rays through pixels, for all detections at once."""
+    pixels_h = np.hstack([pixels, np.ones((len(pixels), 1))])
+    directions = np.einsum('nij,nj->ni', pixel_to_world[image_index], pixels_h)
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return centers[image_index], directions
+
+
+def collect_observations(reconstruction, image_bbox_list):
+    """
+    Stack the label detections of every registered image. image_bbox_list holds
+    (image name, bboxes) with YOLO-normalized bbox centres.
+    """
+    images_by_name = {image.name: image for image in reconstruction.images.values()}
+
+    class_ids, image_index, pixels = [], [], []
+    K, R, t, names = [], [], [], []
+    for filename, bboxes in image_bbox_list:
+        if not bboxes:
+            continue
+        image = images_by_name.get(filename)
+        if image is None or not reconstruction.is_image_registered(image.image_id):
+            print(f"Skipping labels of {filename}: image not registered")
+            continue
+
+        camera = reconstruction.cameras[image.camera_id]
+        ext = image.cam_from_world.matrix()
+        K.append(camera.calibration_matrix())
+        R.append(ext[:3, :3])
+        t.append(ext[:3, 3])
+        names.append(filename)
+
+        boxes = np.array([(bbox['class_id'], bbox['x_center'], bbox['y_center']) for bbox in bboxes])
+        class_ids.append(boxes[:, 0].astype(np.int64))
+        pixels.append(boxes[:, 1:] * (camera.width, camera.height))
+        image_index.append(np.full(len(bboxes), len(K) - 1))
+
+    if not K:
+        return Observations(np.empty(0), np.empty(0), np.empty((0, 2)), np.empty((0, 3, 3)),
+                            np.empty((0, 3, 3)), np.empty((0, 3)))
+    return Observations(
+        np.concatenate(class_ids), np.concatenate(image_index), np.concatenate(pixels),
+        K, R, t, names,
+    )
+
+
+def group_by_class(class_ids):
+    """
+    Sort order and segment starts grouping detections by class, with classes in
+    order of first appearance. Returns (classes, order, starts).
+    """
+    classes, first = np.unique(class_ids, return_index=True)
+    classes = classes[np.argsort(first)]
+    rank = np.empty(classes.max() + 1 if len(classes) else 0, dtype=np.int64)
+    rank[classes] = np.arange(len(classes))
+    order = np.argsort(rank[class_ids], kind="stable")
+    counts = np.bincount(rank[class_ids], minlength=len(classes))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return classes, order, starts
+
+
+def mean_viewpoints(observations, classes, inliers=None):
+    """
+    Mean centre of the cameras that saw each label, in the order of classes.
+    Only inlier detections count when given, unless a label has none.
+    """
+    classes = np.asarray(classes, dtype=np.int64)
+    rank = np.full(max(classes.max(), observations.class_ids.max()) + 1 if len(classes) else 0, -1)
+    rank[classes] = np.arange(len(classes))
+    label = rank[observations.class_ids]
+    centers = observations.centers[observations.image_index]
+
+    def means(mask):
+        mask = mask & (label >= 0)
+        counts = np.bincount(label[mask], minlength=len(classes))
+        sums = np.stack([np.bincount(label[mask], weights=centers[mask, k], minlength=len(classes)) for k in range(3)], axis=1)
+        return sums / np.maximum(counts, 1)[:, None], counts
+
+    viewpoints, _ = means(np.ones(len(observations), dtype=bool))
+    if inliers is not None:
+        inlier_viewpoints, inlier_counts = means(np.asarray(inliers, dtype=bool))
+        viewpoints = np.where((inlier_counts > 0)[:, None], inlier_viewpoints, viewpoints)
+    return viewpoints
+
+
+def solve_ray_systems(origins, directions, segments, weights=None):
+    """
+    Least-squares points closest to groups of rays, all groups in one batched solve.
+
+    For each ray the normal equations add (I - d d^T) and (I - d d^T) C; sums per
+    group come from segment reductions over (order, starts) as returned by
+    group_by_class. Degenerate groups (one ray, parallel rays) get the minimum-norm
+    solution, as np.linalg.lstsq would.
+    """
+    order, starts = segments
+    d = directions[order]
+    C = origins[order]
+    w = np.ones(len(d)) if weights is None else weights[order]
+
+    outer = (w[:, None] * d)[:, :, None] * d[:, None, :]
+    proj_C = w[:, None] * (C - d * np.einsum('ni,ni->n', d, C)[:, None])
+
+    A = np.add.reduceat(w, starts)[:, None, None] * np.eye(3) - np.add.reduceat(outer, starts, axis=0)
+    b = np.add.reduceat(proj_C, starts, axis=0)
+
+    # Batched solve for well-conditioned systems; the (slower) pseudo-inverse only for
+    # degenerate ones, with the tolerance of np.linalg.lstsq(rcond=None)
+    points = np.empty_like(b)
+    scale = (np.trace(A, axis1=1, axis2=2) / 3) ** 3
+    regular = np.linalg.det(A) > DEGENERATE_DETERMINANT * scale
+    points[regular] = np.linalg.solve(A[regular], b[regular][:, :, None])[:, :, 0]
+    if not regular.all():
+        pinv = np.linalg.pinv(A[~regular], rcond=3 * np.finfo(np.float64).eps)
+        points[~regular] = np.einsum('kij,kj->ki', pinv, b[~regular])
+    return points
+
+
+def triangulate_points(origins, directions, class_ids, weights=None):
+    """
+    Triangulate one 3D point per class from all rays of that class.
+    Returns (classes, points) with classes in order of first appearance.
+    """
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    if len(class_ids) == 0:
+        return class_ids, np.empty((0, 3))
+    classes, order, starts = group_by_class(class_ids)
+    points = solve_ray_systems(
+        np.asarray(origins, dtype=np.float64), np.asarray(directions, dtype=np.float64), (order, starts),
+        None if weights is None else np.asarray(weights, dtype=np.float64),
+    )
+    return classes, points
+
+
+def project(observations, points, ray_index):
+    """
+    Reprojection error (pixels), cosine of the angle to the observed ray and depth
+    of points in the images of rays. points is (n, 3), or (n, h, 3) for h points per
+    ray, with ray_index (n,) the ray each row belongs to.
+    """
+    image = observations.image_index[ray_index]
+    hypotheses = points if points.ndim == 3 else points[:, None, :]
+
+    # Homogeneous pixels K (R X + t); K's last row is (0, 0, 1), so their z is the depth
+    pixels = np.matmul(hypotheses, observations.KR[image].transpose(0, 2, 1)) + observations.Kt[image][:, None, :]
+    depth = pixels[..., 2]
+    to_point = hypotheses - observations.origins[ray_index][:, None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        error = pixels[..., :2] / depth[..., None] - observations.pixels[ray_index][:, None, :]
+        reprojection = np.sqrt(np.sum(error * error, axis=-1))
+        cosine = (np.sum(to_point * observations.directions[ray_index][:, None, :], axis=-1)
+                  / np.sqrt(np.sum(to_point * to_point, axis=-1)))
+
+    # Points behind the camera are never inliers
+    reprojection = np.where(depth > 0, reprojection, np.inf)
+    cosine = np.where(depth > 0, cosine, -1.0)
+    if points.ndim == 2:
+        return reprojection[:, 0], cosine[:, 0], depth[:, 0]
+    return reprojection, cosine, depth
+
+
+def two_ray_midpoints(C1, d1, C2, d2):
+    """Midpoints of the closest approach of ray pairs (unit directions); NaN for parallel rays."""
+    w = C1 - C2
+    b = np.einsum('...i,...i->...', d1, d2)
+    d = np.einsum('...i,...i->...', d1, w)
+    e = np.einsum('...i,...i->...', d2, w)
+    denominator = 1.0 - b * b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        s = np.where(denominator > 1e-12, (b * e - d) / denominator, np.nan)
+        t = np.where(denominator > 1e-12, (e - b * d) / denominator, np.nan)
+    return 0.5 * (C1 + s[..., None] * d1 + C2 + t[..., None] * d2)
+
+
+class TriangulationResult:
+    """
+    Robustly triangulated labels, in order of first appearance.
+
+    Per label: point, number of observations and inliers, mean inlier reprojection
+    error (pixels) and position uncertainty (1-sigma radius, model units). Per
+    detection: inlier mask.
+    """
+
+    def __init__(self, classes, points, num_observations, num_inliers, reprojection_error, uncertainty, inliers):
+        self.classes = classes
+        self.points = points
+        self.num_observations = num_observations
+        self.num_inliers = num_inliers
+        self.reprojection_error = reprojection_error
+        self.uncertainty = uncertainty
+        self.inliers = inliers
+
+    def __len__(self):
+        return len(self.classes)
+
+    def report(self, scale=1.0):
+        """
+        Per-label statistics, with uncertainty converted to meters by the model scale.
+        Undefined values (a label seen by one ray, no inliers) are None, so the report is strict JSON.
+        """
+        return [
+            {
+                "class_id": int(class_id),
+                "observations": int(self.num_observations[i]),
+                "inliers": int(self.num_inliers[i]),
+                "reprojection_error_px": _finite(self.reprojection_error[i]),
+                "uncertainty_m": _finite(self.uncertainty[i] * scale),
+            }
+            for i, class_id in enumerate(self.classes)
+        ]
+
+
+def _finite(value):
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def robust_triangulate(observations, num_hypotheses=16, reprojection_threshold=8.0, angle_threshold=2.0,
+                       refine_iterations=2, seed=0):
+    """
+    RANSAC triangulation of every label at once, followed by IRLS refinement.
+
+    For each label, num_hypotheses ray pairs are sampled and triangulated in one
+    batch. Every hypothesis is scored (MSAC) against all rays of its label: a ray
+    is an inlier when the point lies in front of its camera, reprojects within
+    reprojection_threshold pixels and within angle_threshold degrees of the ray.
+    The best hypothesis's inliers are re-solved by least squares, and the inlier
+    set is updated from the refined point refine_iterations times. Labels with
+    fewer than two inliers keep the plain least-squares point over all rays.
+    """
+    n = len(observations)
+    if n == 0:
+        return TriangulationResult(*(np.empty(0) for _ in range(6)), np.empty(0, dtype=bool))
+
+    classes, order, starts = group_by_class(observations.class_ids)
+    counts = np.diff(np.append(starts, n))
+    num_classes = len(classes)
+    # Label rank of every sorted ray
+    rank = np.repeat(np.arange(num_classes), counts)
+    min_cosine = np.cos(np.radians(angle_threshold))
+
+    # Sample two distinct rays per hypothesis within each label
+    rng = np.random.default_rng(seed)
+    first = rng.integers(0, counts[:, None], size=(num_classes, num_hypotheses))
+    offset = 1 + rng.integers(0, np.maximum(counts - 1, 1)[:, None], size=(num_classes, num_hypotheses))
+    second = (first + offset) % counts[:, None]
+    i = order[starts[:, None] + first]
+    j = order[starts[:, None] + second]
+    hypotheses = two_ray_midpoints(
+        observations.origins[i], observations.directions[i], observations.origins[j], observations.directions[j]
+    )
+
+    # Score every hypothesis of a label against every ray of that label: (n, num_hypotheses)
+    reprojection, cosine, _ = project(observations, hypotheses[rank], order)
+    squared = np.minimum(reprojection, reprojection_threshold) ** 2
+    squared[cosine < min_cosine] = reprojection_threshold ** 2
+    cost = np.add.reduceat(squared, starts, axis=0)
+    cost[~np.isfinite(hypotheses).all(axis=2)] = np.inf
+    best = hypotheses[np.arange(num_classes), np.argmin(cost, axis=1)]
+
+    def inliers_of(points):
+        reprojection, cosine, _ = project(observations, points[rank], order)
+        return (reprojection < reprojection_threshold) & (cosine >= min_cosine), reprojection
+
+    inliers, _ = inliers_of(best)
+    for _ in range(refine_iterations + 1):
+        num_inliers = np.add.reduceat(inliers.astype(np.int64), starts)
+        # Too few inliers to triangulate: use every ray of the label
+        weights = np.where((num_inliers >= 2)[rank], inliers, True).astype(np.float64)
+        points = solve_ray_systems(observations.origins, observations.directions, (order, starts),
+                                   _unsort(weights, order))
+        inliers, reprojection = inliers_of(points)
+
+    num_inliers = np.add.reduceat(inliers.astype(np.int64), starts)
+    used = np.where((num_inliers >= 2)[rank], inliers, True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        reprojection_error = (np.add.reduceat(np.where(inliers, reprojection, 0.0), starts)
+                              / np.maximum(num_inliers, 1))
+    reprojection_error[num_inliers == 0] = np.nan
+
+    uncertainty = ray_uncertainty(observations, points, order, starts, rank, used)
+    return TriangulationResult(
+        classes, points, counts, num_inliers, reprojection_error, uncertainty, _unsort(inliers, order),
+    )
+
+
+def ray_uncertainty(observations, points, order, starts, rank, used):
+    """
+    1-sigma position uncertainty sqrt(trace(cov)) of least-squares ray intersections,
+    with cov = sigma^2 A^-1 and sigma^2 from the perpendicular residuals (2 per ray,
+    3 unknowns). Infinite for labels seen by fewer than two rays.
+    """
+    d = observations.directions[order]
+    offset = points[rank] - observations.origins[order]
+    perpendicular = offset - d * np.einsum('ni,ni->n', offset, d)[:, None]
+    w = used.astype(np.float64)
+
+    residual = np.add.reduceat(w * np.einsum('ni,ni->n', perpendicular, perpendicular), starts)
+    num_rays = np.add.reduceat(w, starts)
+    A = (num_rays[:, None, None] * np.eye(3)
+         - np.add.reduceat((w[:, None] * d)[:, :, None] * d[:, None, :], starts, axis=0))
+
+    uncertainty = np.full(len(starts), np.inf)
+    scale = (np.trace(A, axis1=1, axis2=2) / 3) ** 3
+    regular = (num_rays >= 2) & (np.linalg.det(A) > DEGENERATE_DETERMINANT * scale)
+    if regular.any():
+        variance = residual[regular] / np.maximum(2 * num_rays[regular] - 3, 1)
+        trace_inverse = np.trace(np.linalg.inv(A[regular]), axis1=1, axis2=2)
+        uncertainty[regular] = np.sqrt(variance * trace_inverse)
+    return uncertainty
+
+
+def _unsort(values, order):
+    # Values per sorted ray back to detection order
+    unsorted = np.empty_like(values)
+    unsorted[order] = values
+    return unsorted
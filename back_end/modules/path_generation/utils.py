@@ -8,9 +8,11 @@ from tqdm import tqdm
 import cv2
 import open3d as o3d
 import shutil
-import piexif
 import random
 from .dji_exporter import waypoints_to_kmz
+from .triangulation import rays_from_pixels, triangulate_points
+from .geodesy import geodetic_to_ecef, ecef_to_geodetic, similarity_to_ecef
+from .metadata import read_image_gps
 
 # Get Parent Directory
 BASE_PATH = Path(__file__).resolve().parent
@@ -22,8 +24,7 @@ LABEL_DI = "./notebooks/sfm/data/labels"
 # Output
 OUTPUT_DIR = BASE_PATH / "output"
 FEATURE_DIR = OUTPUT_DIR / "features"
-DATABASE_PATH = OUTPUT_DIR / "database.db"
-RECONSTRUCTION_PATH = OUTPUT_DIR / "reconstruction"
+# COLMAP databases and reconstructions live in per-session workspaces (see workspace.py)
 
 # ______________________ File Handling Functions
 def reset_output_dir(path):
@@ -31,32 +32,13 @@ def reset_output_dir(path):
         shutil.rmtree(path)
     os.makedirs(path)
 
-def get_image_gps_from_file(image, image_dir):
-    image_path = Path(image_dir) / image.name
-    exif = piexif.load(str(image_path))
-    gps = exif.get("GPS", {})
-
-    def dms_to_deg(dms, ref):
-        deg = dms[0][0]/dms[0][1]
-        min = dms[1][0]/dms[1][1]
-        sec = dms[2][0]/dms[2][1]
-        sign = -1 if ref in ['S', 'W'] else 1
-        return sign * (deg + min/60 + sec/3600)
-
-    lat = dms_to_deg(gps[piexif.GPSIFD.GPSLatitude], gps[piexif.GPSIFD.GPSLatitudeRef].decode())
-    lon = dms_to_deg(gps[piexif.GPSIFD.GPSLongitude], gps[piexif.GPSIFD.GPSLongitudeRef].decode())
-    alt = gps.get(piexif.GPSIFD.GPSAltitude, (0,1))
-    alt = alt[0]/alt[1]
-
-    return lat, lon, alt
-
 # ______________________ Mapping Helper Functions
-def incremental_mapping_with_pbar(database_path, image_path, sfm_path):
+def incremental_mapping_with_pbar(database_path, image_path, sfm_path, input_path=None, options=None):
     num_images = pycolmap.Database(database_path).num_images
-    
-    # Create a progress bar placeholder
+
+    # Create a progress bar placeholder; an existing model (input_path) starts with its registered images
     pbar = tqdm(total=num_images, desc="Images registered:")
-    pbar.update(0)
+    pbar.update(pycolmap.Reconstruction(input_path).num_reg_images() if input_path else 0)
     
     # Define callback functions that update the progress bar
     def initial_pair_callback():
@@ -70,6 +52,8 @@ def incremental_mapping_with_pbar(database_path, image_path, sfm_path):
             database_path,
             image_path,
             sfm_path,
+            input_path=str(input_path) if input_path else "",
+            options=options if options is not None else pycolmap.IncrementalPipelineOptions(),
             initial_image_pair_callback=initial_pair_callback,
             next_image_callback=next_image_callback,
         )
@@ -83,115 +67,138 @@ def incremental_mapping_with_pbar(database_path, image_path, sfm_path):
 
 # Find rays from image
 def triangulate_lines(points_2d, intrinsics, extrinsics):
-    lines = []
-    for pts, K, ext in zip(points_2d, intrinsics, extrinsics):
-        R, t = ext[:3, :3], ext[:3, 3]
-        C = -R.T @ t
-        for p in pts:
-            p_h = np.array([p[0], p[1], 1.0])
-            ray_cam = np.linalg.inv(K) @ p_h
-            ray_world = R.T @ ray_cam
-            ray_world /= np.linalg.norm(ray_world)
-            lines.append((C, ray_world))
-    return lines
+    K = np.array(intrinsics, dtype=np.float64).reshape(-1, 3, 3)
+    ext = np.array(extrinsics, dtype=np.float64)
+    R, t = ext[:, :3, :3], ext[:, :3, 3]
+    centers = -np.einsum('kji,kj->ki', R, t)
+    pixel_to_world = np.matmul(R.transpose(0, 2, 1), np.linalg.inv(K))
+
+    image_index = np.repeat(np.arange(len(points_2d)), [len(pts) for pts in points_2d])
+    pixels = np.array([p for pts in points_2d for p in pts], dtype=np.float64).reshape(-1, 2)
+    origins, directions = rays_from_pixels(pixels, image_index, centers, pixel_to_world)
+    return list(zip(origins, directions))
 
 def fit_point_to_rays(rays):
-    A = []
-    b = []
-    for C, d in rays:
-        d = d / np.linalg.norm(d)
-        I = np.eye(3)
-        A.append(I - np.outer(d, d))
-        b.append((I - np.outer(d, d)) @ C)
-    A = np.sum(A, axis=0)
-    b = np.sum(b, axis=0)
-    return np.linalg.lstsq(A, b, rcond=None)[0]  # least-squares point
+    origins = np.array([C for C, _ in rays], dtype=np.float64).reshape(-1, 3)
+    directions = np.array([d for _, d in rays], dtype=np.float64).reshape(-1, 3)
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    return triangulate_points(origins, directions, np.zeros(len(rays)))[1][0]  # least-squares point
 
 
 # Similarity Helper Functions
-def estimate_similarity_transform(source, target):
-    src_mean = source.mean(axis=0)
-    tgt_mean = target.mean(axis=0)
+def estimate_similarity_transforms(source, target):
+    """
+    Umeyama least-squares similarities target ~ scale * R @ source + t for a batch
+    of point sets (h, m, 3), with one stacked SVD. Returns scale (h,), R (h, 3, 3), t (h, 3).
+    """
+    src_mean = source.mean(axis=1, keepdims=True)
+    tgt_mean = target.mean(axis=1, keepdims=True)
 
     src_centered = source - src_mean
     tgt_centered = target - tgt_mean
 
-    H = src_centered.T @ tgt_centered
-    U, _, Vt = np.linalg.svd(H)
-    R = Vt.T @ U.T
-    if np.linalg.det(R) < 0:
-        Vt[-1] *= -1
-        R = Vt.T @ U.T
+    H = np.einsum('hmi,hmj->hij', src_centered, tgt_centered)
+    U, S, Vt = np.linalg.svd(H)
+    # Flip the weakest axis where needed so R is a rotation, not a reflection
+    D = np.ones_like(S)
+    D[:, -1] = np.sign(np.linalg.det(np.matmul(U, Vt)))
+    R = np.einsum('hji,hj,hkj->hik', Vt, D, U)
 
-    scale = np.sum(tgt_centered * (src_centered @ R)) / np.sum(src_centered**2)
-    t = tgt_mean - scale * (R @ src_mean)
+    variance = np.einsum('hmi,hmi->h', src_centered, src_centered)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = np.sum(S * D, axis=1) / variance
+    t = tgt_mean[:, 0] - scale[:, None] * np.einsum('hij,hj->hi', R, src_mean[:, 0])
 
     return scale, R, t
 
-def ransac_similarity(source, target, num_iter=1000, threshold=3.0):
-    best_inliers = []
-    best_model = None
-
-    for _ in range(num_iter):
-        idx = random.sample(range(len(source)), 3)
-        src_sample = source[idx]
-        tgt_sample = target[idx]
-
-        try:
-            scale, R, t = estimate_similarity_transform(src_sample, tgt_sample)
-        except:
+def estimate_similarity_transform(source, target):
+    scale, R, t = estimate_similarity_transforms(source[None], target[None])
+    return scale[0], R[0], t[0]
+
+def similarity_errors(source, target, scale, R, t):
+    """Distances |scale * R @ source + t - target| for a batch of similarities: (h, n)."""
+    transformed = scale[:, None, None] * np.einsum('hij,nj->hni', R, source) + t[:, None, :]
+    return np.linalg.norm(transformed - target[None], axis=2)
+
+def ransac_similarity(source, target, num_iter=1000, threshold=3.0, confidence=0.999, batch_size=64, seed=0):
+    """
+    Robust similarity target ~ scale * R @ source + t.
+
+    Minimal 3-point hypotheses are generated and scored batch_size at a time; the
+    search stops once enough batches ran to find an all-inlier sample with the
+    given confidence at the best inlier ratio so far (or after num_iter hypotheses).
+    The best model is then re-estimated on its inliers until the inlier set is stable.
+
+    Returns scale, R, t and the boolean inlier mask.
+    """
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    n = len(source)
+    if n < 3:
+        raise RuntimeError("RANSAC needs at least 3 correspondences")
+
+    rng = np.random.default_rng(seed)
+    best_count, best_cost, best_model = 0, np.inf, None
+    required, evaluated = num_iter, 0
+    while evaluated < min(num_iter, required):
+        idx = rng.integers(0, n, size=(batch_size, 3))
+        idx = idx[(idx[:, 0] != idx[:, 1]) & (idx[:, 0] != idx[:, 2]) & (idx[:, 1] != idx[:, 2])]
+        evaluated += batch_size
+        if len(idx) == 0:
             continue
 
-        transformed = scale * (source @ R.T) + t
-        errors = np.linalg.norm(transformed - target, axis=1)
-        inliers = np.where(errors < threshold)[0]
-
-        if len(inliers) > len(best_inliers):
-            best_inliers = inliers
-            best_model = (scale, R, t)
-
-    if best_model is None:
+        scale, R, t = estimate_similarity_transforms(source[idx], target[idx])
+        valid = np.isfinite(scale) & (scale > 0)
+        if not valid.any():
+            continue
+        scale, R, t = scale[valid], R[valid], t[valid]
+
+        errors = similarity_errors(source, target, scale, R, t)
+        counts = np.sum(errors < threshold, axis=1)
+        # Ties in inlier count go to the tighter fit (truncated squared error)
+        costs = np.sum(np.minimum(errors, threshold) ** 2, axis=1)
+        best = np.lexsort((costs, -counts))[0]
+        if counts[best] > best_count or (counts[best] == best_count and costs[best] < best_cost):
+            best_count, best_cost = counts[best], costs[best]
+            best_model = (scale[best], R[best], t[best])
+
+            # Adaptive stopping: hypotheses needed to draw one all-inlier sample
+            inlier_ratio = best_count / n
+            if inlier_ratio >= 1.0:
+                required = 0
+            elif inlier_ratio > 0:
+                required = int(np.ceil(np.log(1 - confidence) / np.log(1 - inlier_ratio ** 3)))
+
+    if best_model is None or best_count < 3:
         raise RuntimeError("RANSAC failed to find a valid model")
+
+    # Refine on the inliers until they stop changing
+    scale, R, t = best_model
+    inliers = similarity_errors(source, target, np.array([scale]), R[None], t[None])[0] < threshold
+    for _ in range(10):
+        scale, R, t = estimate_similarity_transform(source[inliers], target[inliers])
+        refined = similarity_errors(source, target, np.array([scale]), R[None], t[None])[0] < threshold
+        if refined.sum() < 3 or np.array_equal(refined, inliers):
+            break
+        inliers = refined
+
+    return scale, R, t, inliers
     
 # ______________________ Space trasformation functions
+# Single-point wrappers around geodesy.py, which converts whole arrays at once
+
 # From GPS to ECEF
 def transform_gps_to_ecef(lat, lon, alt):
-    # Convert GPS coordinates to ECEF
-    # WGS84 constants
-    a = 6378137.0  # Semi-major axis
-    e_sq = 6.69437999014e-3  # Square of eccentricity
-
-    lat_rad = np.radians(lat)
-    lon_rad = np.radians(lon)
-    N = a / np.sqrt(1 - e_sq * np.sin(lat_rad)**2)
-
-    x = (N + alt) * np.cos(lat_rad) * np.cos(lon_rad)
-    y = (N + alt) * np.cos(lat_rad) * np.sin(lon_rad)
-    z = (N * (1 - e_sq) + alt) * np.sin(lat_rad)
-    return np.array([x, y, z])
+    return geodetic_to_ecef(lat, lon, alt)
 
 # From world space to ECEF
 def transform_proj_to_ecef(point, scale, R, t):
     point = np.asarray(point).reshape(3,)  # from (3,1) to (3,)
-    return scale * (R @ point) + t
+    return similarity_to_ecef(point, scale, R, t)
 
 def transform_ecef_to_gps(x, y, z):
-    a = 6378137.0
-    e_sq = 6.69437999014e-3
-
-    b = np.sqrt(a**2 * (1 - e_sq))
-    ep = np.sqrt((a**2 - b**2) / b**2)
-    p = np.sqrt(x**2 + y**2)
-    th = np.arctan2(a * z, b * p)
-    lon = np.arctan2(y, x)
-    lat = np.arctan2(z + ep**2 * b * np.sin(th)**3, p - e_sq * a * np.cos(th)**3)
-    N = a / np.sqrt(1 - e_sq * np.sin(lat)**2)
-    alt = p / np.cos(lat) - N
-
-    lat = np.degrees(lat)
-    lon = np.degrees(lon)
-    return lat, lon, alt
+    return ecef_to_geodetic(np.stack(np.broadcast_arrays(x, y, z), axis=-1))
 
 def transform_proj_to_gps(point, scale, R, t):
     ecef = transform_proj_to_ecef(point, scale, R, t)
-    return transform_ecef_to_gps(*ecef)
\ No newline at end of file
+    return transform_ecef_to_gps(*ecef)
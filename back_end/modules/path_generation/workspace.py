@@ -0,0 +1,111 @@
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+from .utils import OUTPUT_DIR
+from .priors import PriorFrame
+
+# Every session gets its own COLMAP database and reconstruction folder under here
+WORKSPACE_ROOT = OUTPUT_DIR / "workspaces"
+
+# Workspaces untouched for longer than this are removed by collect_garbage
+WORKSPACE_RETENTION_SECONDS = int(os.getenv("WORKSPACE_RETENTION_SECONDS", str(24 * 3600)))
+
+# Present while a workspace is in use; garbage collection never removes a locked workspace
+LOCK_FILE = ".lock"
+
+
+class Workspace:
+    """
+    Isolated COLMAP workspace for one session: its own feature database and
+    reconstruction folder, so concurrent reconstructions never share state.
+
+    Use as a context manager to mark the workspace as in use:
+
+        with Workspace.create(session_id) as workspace:
+            pycolmap.extract_features(workspace.database_path, image_path)
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.database_path = self.root / "database.db"
+        self.reconstruction_path = self.root / "reconstruction"
+
+    @classmethod
+    def create(cls, session_id=None, root=WORKSPACE_ROOT):
+        """Create (or reopen) the workspace of a session; a random ID is used if none is given."""
+        session_id = session_id or uuid.uuid4().hex
+        # Session IDs end up in a path, keep them to a single safe component
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(session_id)).strip(".") or uuid.uuid4().hex
+        workspace = cls(Path(root) / name)
+        workspace.reconstruction_path.mkdir(parents=True, exist_ok=True)
+        workspace.touch()
+        return workspace
+
+    def touch(self):
+        # The directory mtime is the last-used time for retention
+        os.utime(self.root)
+
+    def reset(self):
+        """Drop the feature database and any reconstruction, keeping the workspace itself."""
+        if self.database_path.exists():
+            self.database_path.unlink()
+        PriorFrame.path_for(self.database_path).unlink(missing_ok=True)
+        if self.reconstruction_path.exists():
+            shutil.rmtree(self.reconstruction_path)
+        self.reconstruction_path.mkdir(parents=True)
+
+    def remove(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    @property
+    def is_locked(self):
+        lock = self.root / LOCK_FILE
+        try:
+            pid = int(lock.read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+        # A lock left behind by a dead process does not count
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def __enter__(self):
+        (self.root / LOCK_FILE).write_text(str(os.getpid()))
+        self.touch()
+        return self
+
+    def __exit__(self, *exc):
+        (self.root / LOCK_FILE).unlink(missing_ok=True)
+        self.touch()
+        return False
+
+    def __repr__(self):
+        return f"Workspace({str(self.root)!r})"
+
+
+def collect_garbage(root=WORKSPACE_ROOT, max_age=WORKSPACE_RETENTION_SECONDS):
+    """Remove unlocked workspaces not used for max_age seconds. Returns the removed paths."""
+    root = Path(root)
+    if not root.exists():
+        return []
+
+    removed = []
+    now = time.time()
+    for path in root.iterdir():
+        if not path.is_dir():
+            continue
+        workspace = Workspace(path)
+        if workspace.is_locked:
+            continue
+        if now - path.stat().st_mtime > max_age:
+            workspace.remove()
+            removed.append(path)
+    return removed
@@ -0,0 +1,76 @@
+import os
+import re
+from pathlib import Path
+
+# Size of the blocks a result file is streamed in
+RESULT_CHUNK_SIZE = 256 * 1024
+
+# Session IDs as generated by uploads.new_session_id
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+RESULT_MEDIA_TYPES = {
+    ".kmz": "application/vnd.google-earth.kmz",
+    ".zip": "application/zip",
+    ".json": "application/json",
+}
+
+
+def result_dir(upload_dir, session_id):
+    """Folder the pipeline writes a session's artifacts to."""
+    if not SESSION_ID_PATTERN.match(session_id):
+        raise ValueError(f"Invalid session ID: {session_id!r}")
+    return Path(upload_dir) / f"{session_id}_output"
+
+
+def media_type(path):
+    return RESULT_MEDIA_TYPES.get(Path(path).suffix.lower(), "application/octet-stream")
+
+
+def file_etag(path):
+    """ETag from size and modification time, so a regenerated result gets a new tag."""
+    stat = os.stat(path)
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parse a single "bytes=start-end" Range header into an inclusive (start, end).
+    Returns None when the header is absent or not a single byte range (serve the
+    whole file), and raises ValueError when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if match is None:
+        return None
+
+    start, end = match.groups()
+    if start == "" and end == "":
+        return None
+    if start == "":
+        # Suffix range: the last `end` bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {header!r} not satisfiable for {size} bytes")
+    return start, end
+
+
+def iter_file(path, start, end, chunk_size=RESULT_CHUNK_SIZE):
+    """Yield bytes start..end (inclusive) of a file without loading it whole."""
+    remaining = end - start + 1
+    with open(path, "rb") as f:
+        f.seek(start)
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
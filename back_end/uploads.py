@@ -0,0 +1,186 @@
+import asyncio
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+# Chunks buffered between the websocket and the disk writer before receiving blocks (backpressure)
+UPLOAD_QUEUE_CHUNKS = int(os.getenv("UPLOAD_QUEUE_CHUNKS", "16"))
+
+# Buffer size of the file objects the writer thread writes through
+UPLOAD_WRITE_BUFFER = 1024 * 1024
+
+
+def new_session_id():
+    return f"session_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+
+def safe_filename(filename):
+    """Strip any directory part so a client cannot write outside its session folder."""
+    name = Path(filename.replace("\\", "/")).name
+    if name in ("", ".", ".."):
+        raise ValueError(f"Invalid filename: {filename!r}")
+    return name
+
+
+class SessionUpload:
+    """
+    Streams one batch of uploaded files straight into its session directory.
+
+    Chunks go through a bounded queue to a writer task that does the blocking disk
+    writes in a worker thread, so the event loop never touches the disk. When the
+    disk falls behind, write() waits for room in the queue, which stops the
+    websocket from reading further frames (backpressure).
+    """
+
+    def __init__(self, upload_dir, session_id=None, queue_chunks=UPLOAD_QUEUE_CHUNKS):
+        self.session_id = session_id or new_session_id()
+        self.session_dir = Path(upload_dir) / self.session_id
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+        self.files = []
+        self.bytes_written = 0
+        self.started = time.perf_counter()
+        self._file = None
+        self._is_open = False
+        self._queue = asyncio.Queue(maxsize=queue_chunks)
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        # Items are ("open", (path, offset)), ("data", bytes), ("close", None) or ("stop", None), applied in order.
+        # Everything already queued is applied in a single thread hop to keep per-chunk overhead low.
+        # Only the worker thread touches the file, and it closes it on "stop" or on error: the task is
+        # never cancelled, so no file is closed or deleted under a write still in flight.
+        stopped = False
+        while not stopped:
+            actions = [await self._queue.get()]
+            while not self._queue.empty():
+                actions.append(self._queue.get_nowait())
+            try:
+                stopped = await asyncio.to_thread(self._apply, actions)
+            finally:
+                for _ in actions:
+                    self._queue.task_done()
+
+    def _apply(self, actions):
+        """Apply queued actions in the worker thread; returns True once told to stop."""
+        try:
+            for action, value in actions:
+                if action == "open":
+                    path, offset = value
+                    self._close_file()
+                    # Resume at offset, discarding anything after it
+                    self._file = open(path, "r+b" if offset else "wb", buffering=UPLOAD_WRITE_BUFFER)
+                    self._file.seek(offset)
+                    self._file.truncate()
+                elif action == "data":
+                    self._file.write(value)
+                    self.bytes_written += len(value)
+                elif action == "close":
+                    self._close_file()
+                elif action == "stop":
+                    self._close_file()
+                    return True
+        except BaseException:
+            self._close_file()
+            raise
+        return False
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _check_writer(self):
+        # Surface disk errors (e.g. disk full) to the caller instead of losing them in the task
+        if self._writer.done():
+            self._writer.result()
+            raise RuntimeError("Upload writer stopped unexpectedly")
+
+    async def _put(self, item):
+        """Queue an item for the writer; raises instead of waiting forever for room once the writer has failed."""
+        self._check_writer()
+        try:
+            self._queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+        # Wait for room in the queue, or for the writer to die with the queue still full
+        put = asyncio.create_task(self._queue.put(item))
+        await asyncio.wait({put, self._writer}, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+        self._check_writer()
+
+    async def open_file(self, filename):
+        """Start writing a file of this batch into the session directory."""
+        name = safe_filename(filename)
+        await self._put(("open", (self.session_dir / name, 0)))
+        self.files.append(name)
+        self._is_open = True
+        return name
+
+    async def open_path(self, path, offset=0):
+        """Start writing to an arbitrary path (e.g. a partial blob), resuming at offset."""
+        await self._put(("open", (Path(path), offset)))
+        self._is_open = True
+
+    @property
+    def is_open(self):
+        return self._is_open
+
+    async def write(self, chunk):
+        if not self._is_open:
+            raise RuntimeError("No file currently open")
+        await self._put(("data", chunk))
+
+    async def flush(self):
+        """Close the current file and wait until everything queued is on disk."""
+        self._is_open = False
+        await self._put(("close", None))
+        # Wait for the writer to drain the queue, or for it to fail
+        drained = asyncio.create_task(self._queue.join())
+        await asyncio.wait({drained, self._writer}, return_when=asyncio.FIRST_COMPLETED)
+        if not drained.done():
+            drained.cancel()
+        self._check_writer()
+
+    async def finish(self):
+        """Flush and close everything; returns throughput statistics for the batch."""
+        await self.flush()
+        await self._stop()
+        self._writer.result()
+        return self.stats()
+
+    async def _stop(self, discard=False):
+        """Tell the writer to close its file and end, and wait until it has."""
+        if discard:
+            # Chunks of an aborted upload that are still queued are never written
+            while not self._queue.empty():
+                self._queue.get_nowait()
+                self._queue.task_done()
+        if not self._writer.done():
+            # The queue has room: it was just drained, by flush() or above
+            self._queue.put_nowait(("stop", None))
+        await asyncio.wait({self._writer})
+
+    def add_file(self, name):
+        """Record a file placed in the session directory by other means (e.g. a blob link)."""
+        self.files.append(safe_filename(name))
+
+    async def abort(self):
+        """Stop writing and delete the partial session directory."""
+        await self._stop(discard=True)
+        if not self._writer.cancelled():
+            # A disk error does not matter any more; retrieve it so it isn't reported as unhandled
+            self._writer.exception()
+        await asyncio.to_thread(shutil.rmtree, self.session_dir, True)
+
+    def stats(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            "files": len(self.files),
+            "bytes": self.bytes_written,
+            "seconds": seconds,
+            "mb_per_second": self.bytes_written / (1024 * 1024) / seconds if seconds > 0 else 0.0,
+        }
@@ -98,6 +98,22 @@ export function MessageRenderer({ message }: MessageRendererProps) {
         </div>
       );
 
+    case "result_ready":
+      return (
+        <div className="space-y-2">
+          <div className="flex items-center gap-2">
+            <Download className="h-4 w-4 text-green-400" />
+            <a
+              href={data?.url}
+              download={data?.filename || "waylines.kmz"}
+              className="text-sm text-green-300 underline"
+            >
+              Download {data?.filename || "Waylines.kmz"}
+            </a>
+          </div>
+        </div>
+      );
+
     case "image":
       return (
         <div className="space-y-2">
@@ -4,6 +4,8 @@
 export type MessageRequest = {
   text: string;
   images?: File[];
+  // Pipeline options, e.g. { sfm_matching: "spatial", max_distance: 50 }
+  options?: Record<string, unknown>;
 };
 
 export type StreamMessage = {
@@ -16,6 +18,22 @@ export type MessageResponse = {
   status: "success" | "error";
 };
 
+type ManifestEntry = {
+  name: string;
+  sha256: string;
+  size: number;
+};
+
+// How often the server may ask again for blobs that failed to arrive
+const MAX_UPLOAD_ATTEMPTS = 3;
+
+async function sha256Hex(file: File): Promise<string> {
+  const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+}
+
 export async function sendMessageToApi(
   apiUrl: string,
   request: MessageRequest,
@@ -25,19 +43,43 @@ export async function sendMessageToApi(
     const ws = new WebSocket(apiUrl);
     ws.binaryType = "arraybuffer";
 
+    // Images by hash; the server answers the manifest with the blobs it does not have yet
+    const blobs = new Map<string, File>();
+    let uploadAttempts = 0;
+
+    const sendMissing = async (missing: { sha256: string; offset: number }[]) => {
+      if (++uploadAttempts > MAX_UPLOAD_ATTEMPTS) {
+        throw new Error("Upload failed verification too many times.");
+      }
+      for (const { sha256, offset } of missing) {
+        const file = blobs.get(sha256);
+        if (!file) continue;
+        // Resume interrupted uploads where the server left off
+        ws.send(`BLOB:${sha256}:${offset}`);
+        ws.send(await file.slice(offset).arrayBuffer());
+      }
+      ws.send("UPLOAD_COMPLETE");
+    };
+
     ws.onopen = async () => {
       try {
         ws.send(`PROMPT:${request.text}`);
+        if (request.options) {
+          ws.send(`OPTIONS:${JSON.stringify(request.options)}`);
+        }
 
-        if (request.images?.length) {
-          for (const image of request.images) {
-            ws.send(`FILENAME:${image.name}`);
-            const buffer = await image.arrayBuffer();
-            ws.send(buffer);
-          }
+        if (!request.images?.length) {
+          ws.send("UPLOAD_COMPLETE");
+          return;
         }
 
-        ws.send("UPLOAD_COMPLETE");
+        const manifest: ManifestEntry[] = [];
+        for (const image of request.images) {
+          const sha256 = await sha256Hex(image);
+          blobs.set(sha256, image);
+          manifest.push({ name: image.name, sha256, size: image.size });
+        }
+        ws.send(`MANIFEST:${JSON.stringify(manifest)}`);
       } catch (e) {
         reject({
           messages: [{ type: "error", data: String(e) }],
@@ -52,6 +94,19 @@ export async function sendMessageToApi(
       if (typeof event.data === "string") {
         try {
           const parsed = JSON.parse(event.data);
+          if (parsed.type === "missing") {
+            sendMissing(parsed.data).catch((e) =>
+              reject({
+                messages: [{ type: "error", data: String(e) }],
+                status: "error",
+              })
+            );
+            return;
+          }
+          if (parsed.type === "blob_stored") {
+            // Per-image acknowledgement, not worth showing
+            return;
+          }
           onStreamMessage?.(parsed);
           collectedMessages.push(parsed);
         } catch {